@@ -0,0 +1,515 @@
+import hashlib
+import json
+import logging
+import os
+import struct
+import time
+import xml.etree.ElementTree as ET
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import libvirt
+
+from Hypervisor_DomainXML import DomainDescription, clone_domain_xml
+from Hypervisor_Snapshots import create_snapshot, wait_block_job
+from Hypervisor_Volumes import DEFAULT_POOL, find_volume, refresh_pools, remove_volumes, storage_pool, volume_usage, \
+    volume_xml
+
+FORMAT_VERSION = 1
+MAGIC = b"HVBAK1\n\0"
+TRAILER = struct.Struct('<Q8s')
+TRAILER_MAGIC = b"HVBAKEND"
+SUFFIX = ".hvbak"
+CHUNK_SIZE = 4 * 1024 * 1024
+RECV_SIZE = 1024 * 1024
+COMPRESSION_LEVEL = 1
+CHECKPOINT_BYTES = 256 * 1024 * 1024
+ZERO = bytes(CHUNK_SIZE)
+SAMPLE_SIZE = 64 * 1024
+INCOMPRESSIBLE = 0.9
+ZLIB = "zlib"
+RAW = "raw"
+QCOW2_MAGIC = b"QFI\xfb"
+SOURCE_KEYS = ('source', 'format', 'backing', 'capacity', 'physical', 'allocation', 'mtime')
+
+
+class BackupError(RuntimeError):
+    pass
+
+
+def partial_path(path):
+    return f"{path}.partial.json"
+
+
+def encode_chunk(data, level, previous=None):
+    if data == ZERO[:len(data)]:
+        return None, None, None
+    digest = hashlib.sha256(data).hexdigest()
+    if digest == previous:
+        return digest, None, None
+    sample = data[:SAMPLE_SIZE]
+    if len(zlib.compress(sample, level)) > len(sample) * INCOMPRESSIBLE:
+        return digest, data, RAW
+    return digest, zlib.compress(data, level), ZLIB
+
+
+def decode_chunk(blob, digest, codec=ZLIB):
+    data = zlib.decompress(blob) if codec == ZLIB else blob
+    if hashlib.sha256(data).hexdigest() != digest:
+        raise BackupError("Checksum mismatch in backup archive")
+    return data
+
+
+def read_manifest(path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise BackupError(f"{path} is not a VM backup archive")
+        f.seek(0, os.SEEK_END)
+        end = f.tell() - TRAILER.size
+        f.seek(max(end, 0))
+        position, magic = TRAILER.unpack(f.read(TRAILER.size)) if end > 0 else (0, b"")
+        if magic != TRAILER_MAGIC:
+            raise BackupError(f"{path} is incomplete; run the export again to resume it")
+        f.seek(position)
+        manifest = json.loads(f.read(end - position))
+    if manifest.get('version') != FORMAT_VERSION:
+        raise BackupError(f"{path} has unsupported format version {manifest.get('version')}")
+    return manifest
+
+
+def disk_key(disk):
+    return disk['target'], disk.get('layer', 0)
+
+
+def sources_unchanged(entries, disks):
+    current = {disk_key(disk): disk for disk in disks}
+    return all(disk_key(entry) in current and all(entry.get(key) == current[disk_key(entry)].get(key)
+                                                  for key in SOURCE_KEYS) for entry in entries)
+
+
+def rebase_header(data, backing):
+    if data[:4] != QCOW2_MAGIC:
+        raise BackupError("Only qcow2 layers can be rebased")
+    offset, size, cluster_bits = struct.unpack('>QII', data[8:24])
+    name = backing.encode()
+    if not offset or offset + len(name) > min(1 << cluster_bits, len(data)):
+        raise BackupError(f"No room for the backing file name {backing} in the qcow2 header")
+    data = bytearray(data)
+    data[16:20] = struct.pack('>I', len(name))
+    data[offset:offset + max(size, len(name))] = name.ljust(size, b"\0")
+    return bytes(data)
+
+
+def lookup_volume(conn, path):
+    try:
+        return conn.storageVolLookupByPath(path)
+    except libvirt.libvirtError as e:
+        if e.get_error_code() != libvirt.VIR_ERR_NO_STORAGE_VOL:
+            raise
+    refresh_pools(conn)
+    try:
+        return conn.storageVolLookupByPath(path)
+    except libvirt.libvirtError as e:
+        if e.get_error_code() != libvirt.VIR_ERR_NO_STORAGE_VOL:
+            raise
+        raise BackupError(f"{path} is not in a storage pool on {conn.getURI()}")
+
+
+class ArchiveWriter:
+    def __init__(self, path, base=None, workers=None, level=COMPRESSION_LEVEL, resume=True, disks=()):
+        self.path = path
+        self.level = level
+        self.workers = workers or os.cpu_count() or 1
+        self.base_chunks = {}
+        if base:
+            base_name = os.path.basename(base)
+            for disk in read_manifest(base)['disks']:
+                for chunk in disk['chunks']:
+                    if 'sha256' in chunk:
+                        self.base_chunks[(*disk_key(disk), chunk['offset'], chunk['length'])] = {
+                            **chunk, 'archive': chunk.get('archive') or base_name}
+        self.pending = deque()
+        self.read = 0
+        self.stored = 0
+        self._checkpointed = 0
+        self.manifest = None
+        if resume and os.path.exists(partial_path(path)) and os.path.exists(path):
+            with open(partial_path(path)) as f:
+                manifest = json.load(f)
+            if manifest.get('base') == (os.path.basename(base) if base else None) \
+                    and os.path.getsize(path) >= manifest['size']:
+                if sources_unchanged(manifest['disks'], disks):
+                    self.manifest = manifest
+                else:
+                    logging.info(f"Starting {path} over: its disks changed since the interrupted export")
+        if self.manifest:
+            self.file = open(path, 'r+b')
+            self.file.truncate(self.manifest['size'])
+            self.file.seek(self.manifest['size'])
+            logging.info(f"Resuming {path} from {self.manifest['size'] / 1048576:.0f} MB")
+        else:
+            self.manifest = {'version': FORMAT_VERSION, 'created': time.time(), 'size': len(MAGIC), 'disks': [],
+                             'base': os.path.basename(base) if base else None}
+            self.file = open(path, 'wb')
+            self.file.write(MAGIC)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="backup")
+
+    def disk_entry(self, disk):
+        for entry in self.manifest['disks']:
+            if disk_key(entry) == disk_key(disk):
+                return entry
+        entry = {**disk, 'chunks': [], 'length': 0, 'complete': False}
+        self.manifest['disks'].append(entry)
+        return entry
+
+    def _queue(self, entry, offset, length, future):
+        self.pending.append((entry, offset, length, future))
+        while len(self.pending) >= self.workers * 2:
+            self._write_oldest()
+
+    def _submit(self, entry, offset, data):
+        previous = self.base_chunks.get((*disk_key(entry), offset, len(data)))
+        self._queue(entry, offset, len(data),
+                    self.executor.submit(encode_chunk, data, self.level, previous and previous['sha256']))
+
+    def _write_oldest(self):
+        entry, offset, length, future = self.pending.popleft()
+        chunk = {'offset': offset, 'length': length}
+        digest, blob, codec = future.result() if future else (None, None, None)
+        if digest is None:
+            chunk['hole'] = True
+        elif blob is None:
+            base = self.base_chunks[(*disk_key(entry), offset, length)]
+            chunk.update(sha256=digest, archive=base['archive'], position=base['position'], size=base['size'],
+                         codec=base['codec'])
+        else:
+            self.file.write(blob)
+            chunk.update(sha256=digest, position=self.manifest['size'], size=len(blob), codec=codec)
+            self.manifest['size'] += len(blob)
+            self.stored += len(blob)
+        entry['chunks'].append(chunk)
+        entry['length'] = offset + length
+        if future:
+            self.read += length
+        if self.read - self._checkpointed >= CHECKPOINT_BYTES:
+            self.checkpoint()
+
+    def drain(self):
+        while self.pending:
+            self._write_oldest()
+
+    def checkpoint(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        temp = f"{partial_path(self.path)}.tmp"
+        with open(temp, 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(temp, partial_path(self.path))
+        self._checkpointed = self.read
+
+    def add_disk(self, conn, disk, on_read=None, check_cancelled=None):
+        entry = self.disk_entry(disk)
+        if entry['complete']:
+            return entry
+        offset = entry['length']
+        vol = lookup_volume(conn, disk['source'])
+        stream = conn.newStream(0)
+        buffer = bytearray()
+        start = offset
+        try:
+            vol.download(stream, offset, 0, libvirt.VIR_STORAGE_VOL_DOWNLOAD_SPARSE_STREAM)
+            while True:
+                if check_cancelled:
+                    check_cancelled()
+                got = stream.recvFlags(RECV_SIZE, libvirt.VIR_STREAM_RECV_STOP_AT_HOLE)
+                if got == -3:
+                    if buffer:
+                        self._submit(entry, start, bytes(buffer))
+                        buffer.clear()
+                    hole = stream.recvHole(0)
+                    self._queue(entry, offset, hole, None)
+                    offset += hole
+                    start = offset
+                    continue
+                if not got:
+                    break
+                buffer += got
+                offset += len(got)
+                while len(buffer) >= CHUNK_SIZE - start % CHUNK_SIZE:
+                    size = CHUNK_SIZE - start % CHUNK_SIZE
+                    self._submit(entry, start, bytes(buffer[:size]))
+                    del buffer[:size]
+                    start += size
+                if on_read:
+                    on_read(len(got))
+            if buffer:
+                self._submit(entry, start, bytes(buffer))
+            self.drain()
+            stream.finish()
+        except BaseException:
+            try:
+                stream.abort()
+            except libvirt.libvirtError:
+                pass
+            self.pending.clear()
+            self.checkpoint()
+            raise
+        entry['complete'] = True
+        self.checkpoint()
+        return entry
+
+    def finish(self, domain_xml):
+        self.drain()
+        self.manifest['domain_xml'] = domain_xml
+        self.manifest['external'] = sorted({entry['backing'] for entry in self.manifest['disks']
+                                            if entry.get('backing') and not entry.get('backing_included')})
+        self.manifest['finished'] = time.time()
+        data = json.dumps(self.manifest, indent=1).encode()
+        self.file.write(data)
+        self.file.write(TRAILER.pack(self.manifest['size'], TRAILER_MAGIC))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.close()
+        if os.path.exists(partial_path(self.path)):
+            os.unlink(partial_path(self.path))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.file.close()
+
+
+def backup_disks(description):
+    return [{'target': disk['target'], 'source': disk['source'], 'format': disk['format'] or 'raw'}
+            for disk in description.disks
+            if disk['device'] == 'disk' and disk['type'] == 'file' and disk['source'] and disk['target']]
+
+
+def volume_layer(vol):
+    root = ET.fromstring(vol.XMLDesc(0))
+    backing = root.find('backingStore')
+    usage = volume_usage(vol)
+    return {'capacity': usage['capacity'], 'physical': usage['physical'], 'allocation': usage['allocation'],
+            'mtime': root.findtext('./target/timestamps/mtime'),
+            'backing': backing.findtext('path') if backing is not None else None,
+            'backing_format': backing.find('format').get('type') if backing is not None
+            and backing.find('format') is not None else None}
+
+
+def disk_layers(conn, disk, overlays=(), protected_paths=()):
+    layers = []
+    path, fmt = disk['source'], disk['format']
+    while True:
+        layer = {**disk, 'layer': len(layers), 'source': path, 'format': fmt,
+                 **volume_layer(lookup_volume(conn, path))}
+        layers.append(layer)
+        included = bool(layer['backing']) and path in overlays and layer['backing'] not in protected_paths
+        layer['backing_included'] = included
+        if not included:
+            return layers
+        path, fmt = layer['backing'], layer['backing_format'] or 'raw'
+
+
+def freeze_disks(dom, description):
+    create_snapshot(dom, description, f"backup-{int(time.time())}", "Temporary overlay for a backup",
+                    disk_only=True, metadata=False)
+    return DomainDescription(dom.XMLDesc(0))
+
+
+def thaw_disks(conn, dom, frozen, local=True, poll_interval=1.0):
+    if not dom.isActive():
+        logging.warning(f"'{dom.name()}' stopped during the backup; its disks keep the backup overlay until "
+                        "the chain is flattened")
+        return
+    overlays = []
+    for disk in backup_disks(frozen):
+        chain = frozen.backing_chain(disk['target'])
+        if len(chain) < 2:
+            continue
+        dom.blockCommit(disk['target'], None, None, 0,
+                        libvirt.VIR_DOMAIN_BLOCK_COMMIT_ACTIVE | libvirt.VIR_DOMAIN_BLOCK_COMMIT_SHALLOW)
+        wait_block_job(dom, disk['target'], poll_interval=poll_interval, pivot=True)
+        overlays.append(chain[0])
+    errors = remove_volumes(conn, overlays, local)
+    if errors:
+        logging.warning(f"Backup overlays left behind: {', '.join(errors)}")
+
+
+def export_domain(conn, dom, description, path, base=None, workers=None, level=COMPRESSION_LEVEL, local=True,
+                  overlays=(), protected_paths=(), on_progress=None, check_cancelled=None):
+    disks = [layer for disk in backup_disks(description)
+             for layer in disk_layers(conn, disk, overlays, protected_paths)]
+    total = sum(disk['physical'] for disk in disks) or 1
+    domain_xml = dom.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE | libvirt.VIR_DOMAIN_XML_SECURE)
+    active = dom.isActive()
+    writer = ArchiveWriter(path, base, workers, level, not active, disks)
+    try:
+        frozen = freeze_disks(dom, description) if active else None
+    except BaseException:
+        writer.close()
+        raise
+    started = time.monotonic()
+    done = sum(entry['length'] for entry in writer.manifest['disks'])
+    read = [0]
+
+    def on_read(size):
+        read[0] += size
+        if on_progress:
+            rate = read[0] / max(time.monotonic() - started, 1e-6)
+            on_progress(min(99.9, (done + read[0]) / total * 100), rate)
+
+    try:
+        for disk in disks:
+            writer.add_disk(conn, disk, on_read, check_cancelled)
+        writer.finish(domain_xml)
+    except BaseException:
+        writer.close()
+        raise
+    finally:
+        if frozen is not None:
+            thaw_disks(conn, dom, frozen, local)
+    elapsed = time.monotonic() - started
+    logging.info(f"Exported {dom.name()} to {path}: {writer.read / 1073741824:.1f} GB read, "
+                 f"{writer.stored / 1073741824:.1f} GB stored in {elapsed:.0f}s "
+                 f"({writer.read / 1048576 / max(elapsed, 1e-6):.0f} MB/s)")
+    return {'path': path, 'read': writer.read, 'stored': writer.stored, 'elapsed': elapsed}
+
+
+def remap_disks(xml, disk_paths):
+    root = ET.fromstring(xml)
+    for disk in root.findall('./devices/disk'):
+        source = disk.find('source')
+        if source is not None and source.get('file') in disk_paths:
+            source.set('file', disk_paths[source.get('file')][0])
+            backing = disk.find('backingStore')
+            if backing is not None:
+                disk.remove(backing)
+    return ET.tostring(root, encoding='unicode')
+
+
+class ArchiveReader:
+    def __init__(self, path):
+        self.path = path
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self.manifest = read_manifest(path)
+        self.files = {}
+
+    def blob(self, chunk):
+        name = chunk.get('archive') or os.path.basename(self.path)
+        f = self.files.get(name)
+        if f is None:
+            archive = os.path.join(self.directory, name)
+            if not os.path.exists(archive):
+                raise BackupError(f"Incremental backup needs {name} next to {self.path}")
+            f = self.files[name] = open(archive, 'rb')
+        f.seek(chunk['position'])
+        return f.read(chunk['size'])
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+def send_all(stream, data):
+    view = memoryview(data)
+    while view:
+        view = view[stream.send(view):]
+
+
+def restore_disk(conn, reader, disk, pool_name, vol_name, workers=None, on_written=None, check_cancelled=None,
+                 backing=None):
+    pool = storage_pool(conn, pool_name)
+    if find_volume(pool, vol_name):
+        raise BackupError(f"Volume {vol_name} already exists in pool '{pool_name}'")
+    if disk.get('backing') and not backing:
+        try:
+            lookup_volume(conn, disk['backing'])
+        except BackupError:
+            raise BackupError(f"Disk {disk['target']} needs its backing image {disk['backing']} on {conn.getURI()}")
+    vol = pool.createXML(volume_xml(vol_name, disk['capacity'], disk['format'], unit='B'), 0)
+    workers = workers or os.cpu_count() or 1
+    stream = conn.newStream(0)
+    pending = deque()
+
+    def send_oldest():
+        chunk, future = pending.popleft()
+        if future is None:
+            stream.sendHole(chunk['length'], 0)
+        elif backing and chunk['offset'] == 0:
+            send_all(stream, rebase_header(future.result(), backing))
+        else:
+            send_all(stream, future.result())
+        if on_written:
+            on_written(chunk['length'])
+
+    try:
+        vol.upload(stream, 0, disk['length'], libvirt.VIR_STORAGE_VOL_UPLOAD_SPARSE_STREAM)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="restore") as executor:
+            for chunk in disk['chunks']:
+                if check_cancelled:
+                    check_cancelled()
+                future = None if chunk.get('hole') else executor.submit(decode_chunk, reader.blob(chunk),
+                                                                        chunk['sha256'], chunk['codec'])
+                pending.append((chunk, future))
+                while len(pending) >= workers * 2:
+                    send_oldest()
+            while pending:
+                send_oldest()
+        stream.finish()
+    except BaseException:
+        try:
+            stream.abort()
+        except libvirt.libvirtError:
+            pass
+        vol.delete(0)
+        raise
+    return vol.path()
+
+
+def import_domain(conn, path, name=None, pool_name=DEFAULT_POOL, workers=None, on_progress=None,
+                  check_cancelled=None):
+    reader = ArchiveReader(path)
+    manifest = reader.manifest
+    original = DomainDescription(manifest['domain_xml'])
+    name = name or original.name
+    try:
+        conn.lookupByName(name)
+        raise BackupError(f"A VM named '{name}' already exists on {conn.getURI()}")
+    except libvirt.libvirtError as e:
+        if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+            raise
+    if any(not disk['complete'] for disk in manifest['disks']):
+        raise BackupError(f"{path} has incomplete disks")
+    total = sum(disk['length'] for disk in manifest['disks']) or 1
+    started = time.monotonic()
+    written = [0]
+
+    def on_written(size):
+        written[0] += size
+        if on_progress:
+            on_progress(written[0] / total * 100, written[0] / max(time.monotonic() - started, 1e-6))
+
+    disk_paths = {}
+    try:
+        for disk in sorted(manifest['disks'], key=lambda disk: (disk['target'], -disk.get('layer', 0))):
+            layer = disk.get('layer', 0)
+            suffix = 'qcow2' if disk['format'] == 'qcow2' else 'img'
+            vol_name = f"{name}-{disk['target']}{f'-{layer}' if layer else ''}.{suffix}"
+            backing = disk_paths[disk['backing']][0] if disk.get('backing_included') else None
+            new_path = restore_disk(conn, reader, disk, pool_name, vol_name, workers, on_written, check_cancelled,
+                                    backing)
+            disk_paths[disk['source']] = (new_path, disk['format'])
+        if name == original.name:
+            xml = remap_disks(manifest['domain_xml'], disk_paths)
+        else:
+            xml = clone_domain_xml(manifest['domain_xml'], name, disk_paths)
+        dom = conn.defineXML(xml)
+    except BaseException:
+        remove_volumes(conn, [new_path for new_path, _ in disk_paths.values()], local=False)
+        raise
+    finally:
+        reader.close()
+    elapsed = time.monotonic() - started
+    logging.info(f"Imported '{name}' from {path}: {total / 1073741824:.1f} GB in {elapsed:.0f}s "
+                 f"({total / 1048576 / max(elapsed, 1e-6):.0f} MB/s)")
+    return dom.UUIDString()
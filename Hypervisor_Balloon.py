@@ -0,0 +1,234 @@
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import libvirt
+
+from Hypervisor_DomainXML import BALLOON_STATS_PERIOD
+from Hypervisor_Inventory import row_key
+
+BALLOON_NAMESPACE = "https://github.com/NRNarender/HypervisorKVMQEMU/balloon"
+GROW = "grow"
+SHRINK = "shrink"
+HOLD = "hold"
+
+BalloonDecision = namedtuple('BalloonDecision', 'time key name host action current target reason applied')
+
+DEFAULT_SETTINGS = {
+    'low_free': 0.10,
+    'target_free': 0.20,
+    'high_free': 0.30,
+    'step': 0.10,
+    'min_ratio': 0.50,
+    'reclaim_pressure': 0.80,
+    'critical_pressure': 0.95,
+    'swap_in_kib': 800,
+    'major_faults': 200,
+    'cooldown': 3,
+    'min_change_kib': 64 * 1024,
+}
+
+
+def balloon_bounds_xml(min_mb=None, max_mb=None):
+    attributes = "".join(f" {name}='{value}'" for name, value in (('min', min_mb), ('max', max_mb)) if value)
+    return f"<balloon{attributes}/>"
+
+
+def balloon_bounds(description):
+    node = description.root.find(f"./metadata/{{{BALLOON_NAMESPACE}}}balloon")
+    if node is None:
+        return None, None
+    return tuple(int(node.get(name)) * 1024 if node.get(name) else None for name in ('min', 'max'))
+
+
+def set_balloon_bounds(dom, min_mb=None, max_mb=None):
+    flags = libvirt.VIR_DOMAIN_AFFECT_CONFIG | (libvirt.VIR_DOMAIN_AFFECT_LIVE if dom.isActive() else 0)
+    xml = balloon_bounds_xml(min_mb, max_mb) if min_mb or max_mb else None
+    dom.setMetadata(libvirt.VIR_DOMAIN_METADATA_ELEMENT, xml, "hv", BALLOON_NAMESPACE, flags)
+
+
+def host_pressure(conn):
+    stats = conn.getMemoryStats(libvirt.VIR_NODE_MEMORY_STATS_ALL_CELLS, 0)
+    total = stats.get('total', 0)
+    if not total:
+        return 0.0
+    available = stats.get('free', 0) + stats.get('buffers', 0) + stats.get('cached', 0)
+    return min(1.0, max(0.0, 1.0 - available / total))
+
+
+def balloon_target(stats, previous, bounds, pressure, settings=DEFAULT_SETTINGS):
+    current = stats.get('balloon.current')
+    maximum = stats.get('balloon.maximum') or current
+    available = stats.get('balloon.available')
+    usable = stats.get('balloon.usable', stats.get('balloon.unused'))
+    if not current or not available or usable is None:
+        return HOLD, current, "no balloon stats from the guest"
+    min_kib, max_kib = bounds
+    floor = min(min_kib or int(maximum * settings['min_ratio']), maximum)
+    ceiling = min(max_kib or maximum, maximum)
+    if current > ceiling:
+        return SHRINK, ceiling, f"above the {ceiling // 1024} MB bound"
+    free = usable / available
+    swap_in = faults = 0
+    if previous:
+        swap_in = max(0, stats.get('balloon.swap_in', 0) - previous.get('balloon.swap_in', 0))
+        faults = max(0, stats.get('balloon.major_fault', 0) - previous.get('balloon.major_fault', 0))
+    swapping = swap_in > settings['swap_in_kib'] or faults > settings['major_faults']
+    step = int(maximum * settings['step'])
+    if swapping or free < settings['low_free']:
+        why = f"{swap_in} KiB swapped in, {faults} major faults" if swapping else f"only {free:.0%} free in guest"
+        if pressure >= settings['critical_pressure'] and not swapping:
+            return HOLD, current, f"{why}, but host memory pressure is {pressure:.0%}"
+        need = int((settings['target_free'] * available - usable) / (1 - settings['target_free']))
+        target = min(ceiling, current + max(step, need))
+        if target <= current:
+            return HOLD, current, f"{why}, already at the {ceiling // 1024} MB ceiling"
+        return GROW, target, why
+    target_free, high_free = settings['target_free'], settings['high_free']
+    if pressure >= settings['reclaim_pressure']:
+        target_free, high_free = (settings['low_free'] + target_free) / 2, target_free
+    if free > high_free:
+        excess = int(usable - target_free * available)
+        target = max(floor, current - min(step, excess))
+        if target >= current:
+            return HOLD, current, f"{free:.0%} free in guest, already at the {floor // 1024} MB floor"
+        return SHRINK, target, f"{free:.0%} free in guest, host pressure {pressure:.0%}"
+    return HOLD, current, f"{free:.0%} free in guest"
+
+
+class _HostBalloons:
+    def __init__(self):
+        self.previous = {}
+        self.last_change = {}
+        self.stats_enabled = set()
+
+
+class BalloonController:
+    def __init__(self, managers, interval=10.0, dry_run=True, settings=None, history=1000):
+        self.managers = managers
+        self.interval = interval
+        self.dry_run = dry_run
+        self.settings = {**DEFAULT_SETTINGS, **(settings or {})}
+        self.history = deque(maxlen=history)
+        self.pressure = {}
+        self._hosts = {}
+        self._in_flight = {}
+        self._ticks = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="balloon")
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="balloon-controller", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def recent(self, limit=200, changes_only=False):
+        with self._lock:
+            decisions = [d for d in self.history if d.action != HOLD] if changes_only else list(self.history)
+        return decisions[-limit:]
+
+    def _enable_stats(self, host, dom, key, stats):
+        if key in host.stats_enabled:
+            return
+        host.stats_enabled.add(key)
+        if 'balloon.last-update' in stats or 'balloon.available' in stats:
+            return
+        try:
+            dom.setMemoryStatsPeriod(BALLOON_STATS_PERIOD, libvirt.VIR_DOMAIN_AFFECT_LIVE)
+            logging.info(f"Enabled balloon stats every {BALLOON_STATS_PERIOD}s for {dom.name()}")
+        except libvirt.libvirtError as e:
+            logging.warning(f"Cannot enable balloon stats for {dom.name()}: {e}")
+
+    def _decide(self, manager, host, dom, stats, pressure, now):
+        key = row_key(manager.uri, dom.UUIDString())
+        self._enable_stats(host, dom, key, stats)
+        description = manager.xml_cache.get(dom)
+        action, target, reason = balloon_target(stats, host.previous.get(key), balloon_bounds(description),
+                                                pressure, self.settings)
+        host.previous[key] = stats
+        current = stats.get('balloon.current')
+        if action != HOLD:
+            last_tick, last_action = host.last_change.get(key, (None, None))
+            minimum = self.settings['min_change_kib']
+            if abs(target - current) < minimum:
+                action, target, reason = HOLD, current, f"{reason}; change below {minimum // 1024} MB"
+            elif (last_tick is not None and self._ticks - last_tick < self.settings['cooldown']
+                  and (last_action != action or action == SHRINK)):
+                action, target, reason = HOLD, current, f"{reason}; cooling down after {last_action}"
+        applied = False
+        if action != HOLD:
+            host.last_change[key] = (self._ticks, action)
+            if not self.dry_run:
+                dom.setMemoryFlags(target, libvirt.VIR_DOMAIN_AFFECT_LIVE)
+                applied = True
+            logging.info(f"Balloon {'' if applied else 'dry-run '}{action} {dom.name()}: "
+                         f"{current // 1024} -> {target // 1024} MB ({reason})")
+        return BalloonDecision(now, key, dom.name(), manager.hostname or manager.uri, action, current, target,
+                               reason, applied)
+
+    def _tick_host(self, manager):
+        with self._lock:
+            host = self._hosts.setdefault(manager.uri, _HostBalloons())
+        now = time.time()
+        decisions = []
+        with manager.lease(timeout=self.interval) as conn:
+            pressure = host_pressure(conn)
+            records = conn.getAllDomainStats(libvirt.VIR_DOMAIN_STATS_BALLOON,
+                                             libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_ACTIVE)
+            for dom, stats in records:
+                try:
+                    decisions.append(self._decide(manager, host, dom, stats, pressure, now))
+                except libvirt.libvirtError as e:
+                    logging.warning(f"Balloon adjustment of {dom.name()} failed: {e}")
+        seen = {decision.key for decision in decisions}
+        for key in [key for key in host.previous if key not in seen]:
+            host.previous.pop(key, None)
+            host.last_change.pop(key, None)
+            host.stats_enabled.discard(key)
+        return manager.uri, pressure, decisions
+
+    def tick(self):
+        self._ticks += 1
+        for uri, manager in list(self.managers().items()):
+            if uri in self._in_flight:
+                logging.warning(f"Balloon controller skips {uri}: its previous tick is still running")
+                continue
+            self._in_flight[uri] = self._executor.submit(self._tick_host, manager)
+        wait(list(self._in_flight.values()), timeout=self.interval)
+        decisions = []
+        for uri, future in list(self._in_flight.items()):
+            if not future.done():
+                continue
+            del self._in_flight[uri]
+            try:
+                _, pressure, host_decisions = future.result()
+            except Exception as e:
+                logging.warning(f"Balloon controller failed on {uri}: {e}")
+                continue
+            self.pressure[uri] = pressure
+            decisions.extend(host_decisions)
+        with self._lock:
+            self.history.extend(decisions)
+        return decisions
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.tick()
+            except Exception as e:
+                logging.error(f"Balloon controller tick failed: {e}")
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
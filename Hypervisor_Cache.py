@@ -0,0 +1,117 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "hypervisor", "inventory.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS domains (
+    key TEXT PRIMARY KEY,
+    uri TEXT NOT NULL,
+    row TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS domains_uri ON domains (uri);
+CREATE TABLE IF NOT EXISTS networks (
+    uri TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (uri, name)
+);
+CREATE TABLE IF NOT EXISTS stats (
+    key TEXT PRIMARY KEY,
+    stats TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS hosts (
+    uri TEXT PRIMARY KEY,
+    hostname TEXT,
+    synced REAL
+);
+"""
+
+
+class InventoryCache:
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inventory-cache")
+
+    def _placeholders(self, values):
+        return ",".join("?" * len(values))
+
+    def load_domains(self, uris):
+        uris = list(uris)
+        with self._lock:
+            cursor = self._db.execute(
+                f"SELECT row FROM domains WHERE uri IN ({self._placeholders(uris)})", uris)
+            return [json.loads(row) for row, in cursor]
+
+    def load_networks(self, uri):
+        with self._lock:
+            return [name for name, in self._db.execute(
+                "SELECT name FROM networks WHERE uri = ? ORDER BY name", (uri,))]
+
+    def load_stats(self, key):
+        with self._lock:
+            found = self._db.execute("SELECT stats, updated FROM stats WHERE key = ?", (key,)).fetchone()
+        return (json.loads(found[0]), found[1]) if found else (None, None)
+
+    def last_sync(self, uri):
+        with self._lock:
+            found = self._db.execute("SELECT hostname, synced FROM hosts WHERE uri = ?", (uri,)).fetchone()
+        return found if found else (None, None)
+
+    def _write(self, statements):
+        try:
+            with self._lock, self._db:
+                for sql, params in statements:
+                    if isinstance(params, list):
+                        self._db.executemany(sql, params)
+                    else:
+                        self._db.execute(sql, params)
+        except sqlite3.Error as e:
+            logging.warning(f"Inventory cache write failed: {e}")
+
+    def _submit(self, statements):
+        if statements:
+            self._writer.submit(self._write, statements)
+
+    def store_rows(self, rows, removed=()):
+        now = time.time()
+        statements = []
+        if removed:
+            statements.append(("DELETE FROM domains WHERE key = ?", [(key,) for key in removed]))
+            statements.append(("DELETE FROM stats WHERE key = ?", [(key,) for key in removed]))
+        if rows:
+            statements.append(("INSERT OR REPLACE INTO domains (key, uri, row, updated) VALUES (?, ?, ?, ?)",
+                               [(row['key'], row['uri'], json.dumps(row), now) for row in rows]))
+        self._submit(statements)
+
+    def store_sync(self, uri, hostname):
+        self._submit([("INSERT OR REPLACE INTO hosts (uri, hostname, synced) VALUES (?, ?, ?)",
+                       (uri, hostname, time.time()))])
+
+    def store_networks(self, uri, names):
+        self._submit([
+            ("DELETE FROM networks WHERE uri = ?", (uri,)),
+            ("INSERT OR IGNORE INTO networks (uri, name) VALUES (?, ?)", [(uri, name) for name in names]),
+        ])
+
+    def store_stats(self, stats):
+        now = time.time()
+        self._submit([("INSERT OR REPLACE INTO stats (key, stats, updated) VALUES (?, ?, ?)",
+                       [(key, json.dumps(values), now) for key, values in stats.items()])])
+
+    def close(self):
+        self._writer.shutdown(wait=True)
+        with self._lock:
+            self._db.close()
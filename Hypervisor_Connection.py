@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import libvirt
+
+from Hypervisor_DomainXML import DomainXMLCache
+from Hypervisor_Events import start_event_loop
+from Hypervisor_Inventory import is_unsupported
+
+
+class PooledConnection:
+    def __init__(self, conn):
+        self.conn = conn
+        self.dead = False
+
+    def usable(self):
+        if self.dead:
+            return False
+        try:
+            return bool(self.conn.isAlive())
+        except libvirt.libvirtError:
+            return False
+
+    def close(self):
+        try:
+            self.conn.unregisterCloseCallback()
+        except libvirt.libvirtError:
+            pass
+        try:
+            self.conn.close()
+        except libvirt.libvirtError:
+            pass
+
+
+class ConnectionManager:
+    def __init__(self, uri, pool_size=4, keepalive_interval=5, keepalive_count=3,
+                 max_retries=5, max_backoff=30, lease_timeout=60, on_state=None):
+        self.uri = uri
+        self.pool_size = pool_size
+        self.keepalive_interval = keepalive_interval
+        self.keepalive_count = keepalive_count
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.lease_timeout = lease_timeout
+        self.on_state = on_state
+        self.hostname = None
+        self.xml_cache = DomainXMLCache()
+        self.closed = False
+        self._lost = False
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._lock = threading.Lock()
+        start_event_loop()
+
+    def _notify(self, message):
+        if self.on_state:
+            self.on_state(message)
+
+    def _open(self):
+        delay = 1
+        attempt = 1
+        while True:
+            if self.closed:
+                raise libvirt.libvirtError(f"Connection manager for {self.uri} is closed")
+            try:
+                conn = libvirt.open(self.uri)
+                if conn is None:
+                    raise libvirt.libvirtError(f"Failed to open {self.uri}")
+                handle = PooledConnection(conn)
+                self._configure(handle)
+                return handle
+            except libvirt.libvirtError as e:
+                if attempt >= self.max_retries:
+                    self._notify("Connection failed")
+                    raise
+                logging.warning(f"Connecting to {self.uri} failed (attempt {attempt}), retrying in {delay}s: {e}")
+                self._notify(f"Reconnecting to {self.uri}...")
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+                attempt += 1
+
+    def _configure(self, handle):
+        try:
+            handle.conn.setKeepAlive(self.keepalive_interval, self.keepalive_count)
+        except libvirt.libvirtError as e:
+            if not is_unsupported(e):
+                raise
+        handle.conn.registerCloseCallback(self._on_close, handle)
+        if self.hostname is None or self._lost:
+            if self._lost:
+                self.xml_cache.clear()
+            self.hostname = handle.conn.getHostname()
+            self._lost = False
+            self._notify(f"Connected to {self.hostname}")
+
+    def _on_close(self, conn, reason, handle):
+        handle.dead = True
+        self._lost = True
+        logging.warning(f"Connection to {self.uri} closed (reason {reason})")
+        self._notify(f"Connection to {self.uri} lost")
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                handle = self._idle.pop() if self._idle else None
+            if handle is None:
+                return self._open()
+            if handle.usable():
+                return handle
+            handle.close()
+
+    def _checkin(self, handle):
+        if self.closed or not handle.usable():
+            handle.close()
+            return
+        with self._lock:
+            self._idle.append(handle)
+
+    @contextmanager
+    def lease(self, timeout=None):
+        if not self._slots.acquire(timeout=self.lease_timeout if timeout is None else timeout):
+            raise libvirt.libvirtError(f"Timed out waiting for a connection to {self.uri}")
+        handle = None
+        try:
+            handle = self._checkout()
+            yield handle.conn
+        finally:
+            if handle is not None:
+                self._checkin(handle)
+            self._slots.release()
+
+    def close(self):
+        self.closed = True
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for handle in idle:
+            handle.close()
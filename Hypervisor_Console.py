@@ -0,0 +1,461 @@
+import base64
+import hashlib
+import logging
+import mimetypes
+import os
+import queue
+import secrets
+import selectors
+import socket
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlparse
+
+import libvirt
+
+from Hypervisor_Controller import console_address
+from Hypervisor_Volumes import is_remote
+
+NOVNC_DIRS = ("/usr/share/novnc", "/usr/share/webapps/novnc", "/usr/local/share/novnc")
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC11B85"
+RECV_SIZE = 64 * 1024
+HIGH_WATER = 1024 * 1024
+MAX_REQUEST = 16 * 1024
+MAX_FRAME = 1024 * 1024
+TUNNEL_TIMEOUT = 2
+CLOSE_TOO_BIG = 1009
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+class FrameTooLarge(ValueError):
+    pass
+
+
+def find_web_root():
+    for path in NOVNC_DIRS:
+        if os.path.isfile(os.path.join(path, "vnc.html")):
+            return path
+    return None
+
+
+def encode_frame(payload, opcode=OP_BINARY):
+    length = len(payload)
+    if length < 126:
+        header = bytes((0x80 | opcode, length))
+    elif length < 65536:
+        header = bytes((0x80 | opcode, 126)) + length.to_bytes(2, 'big')
+    else:
+        header = bytes((0x80 | opcode, 127)) + length.to_bytes(8, 'big')
+    return header + payload
+
+
+def decode_frame(buffer):
+    if len(buffer) < 2:
+        return None
+    opcode = buffer[0] & 0x0F
+    masked = buffer[1] & 0x80
+    length = buffer[1] & 0x7F
+    offset = 2
+    if length == 126:
+        if len(buffer) < 4:
+            return None
+        length = int.from_bytes(buffer[2:4], 'big')
+        offset = 4
+    elif length == 127:
+        if len(buffer) < 10:
+            return None
+        length = int.from_bytes(buffer[2:10], 'big')
+        offset = 10
+    if not masked:
+        raise ValueError("Client frames must be masked")
+    if length > MAX_FRAME:
+        raise FrameTooLarge(f"Frame of {length} bytes exceeds {MAX_FRAME}")
+    if len(buffer) < offset + 4 + length:
+        return None
+    mask = bytes(buffer[offset:offset + 4])
+    offset += 4
+    data = bytes(buffer[offset:offset + length])
+    if length:
+        key = (mask * (length // 4 + 1))[:length]
+        data = (int.from_bytes(data, 'big') ^ int.from_bytes(key, 'big')).to_bytes(length, 'big')
+    return opcode, data, offset + length
+
+
+def ssh_tunnel(uri, port):
+    parsed = urlparse(uri)
+    target = f"{parsed.username}@{parsed.hostname}" if parsed.username else parsed.hostname
+    if parsed.scheme.endswith('+ssh'):
+        options = ['-p', str(parsed.port)] if parsed.port else []
+    else:
+        options = ['-o', 'BatchMode=yes']
+    ours, theirs = socket.socketpair()
+    try:
+        process = subprocess.Popen(['ssh', '-W', f"localhost:{port}", *options, target],
+                                   stdin=theirs, stdout=theirs, stderr=subprocess.DEVNULL)
+    except OSError as e:
+        ours.close()
+        raise RuntimeError(f"Consoles on {parsed.hostname} listen on its loopback and need ssh access to it: {e}")
+    finally:
+        theirs.close()
+
+    def stop():
+        process.terminate()
+        try:
+            process.wait(TUNNEL_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+    return ours, stop
+
+
+def open_console_socket(manager, uuid, check_state=True):
+    with manager.lease() as conn:
+        dom = conn.lookupByUUIDString(uuid)
+        try:
+            fd = dom.openGraphicsFD(0, libvirt.VIR_DOMAIN_OPEN_GRAPHICS_SKIPAUTH)
+            return socket.socket(fileno=fd), None
+        except (libvirt.libvirtError, AttributeError) as e:
+            logging.debug(f"openGraphicsFD unavailable for {dom.name()}: {e}")
+    host, port = console_address(manager, uuid, check_state=check_state)
+    if is_remote(manager.uri):
+        return ssh_tunnel(manager.uri, port)
+    return socket.create_connection((host, port), timeout=10), None
+
+
+class _Session:
+    def __init__(self, proxy, client):
+        self.proxy = proxy
+        self.client = client
+        self.backend = None
+        self.cleanup = None
+        self.state = 'http'
+        self.label = None
+        self.inbuf = bytearray()
+        self.client_out = bytearray()
+        self.backend_out = bytearray()
+        self.close_after_write = False
+        self.closed = False
+
+    def interest(self):
+        if self.closed:
+            return
+        events = 0
+        if len(self.backend_out) < HIGH_WATER and not self.close_after_write:
+            events |= selectors.EVENT_READ
+        if self.client_out:
+            events |= selectors.EVENT_WRITE
+        self.proxy._set_events(self.client, events, self.on_client)
+        if self.backend is not None:
+            events = selectors.EVENT_READ if len(self.client_out) < HIGH_WATER else 0
+            if self.backend_out:
+                events |= selectors.EVENT_WRITE
+            self.proxy._set_events(self.backend, events, self.on_backend)
+
+    def on_client(self, mask):
+        if mask & selectors.EVENT_READ:
+            try:
+                data = self.client.recv(RECV_SIZE)
+            except (BlockingIOError, InterruptedError):
+                data = None
+            except OSError:
+                data = b""
+            if data == b"":
+                self.close()
+                return
+            if data and self.state != 'closing':
+                self.inbuf += data
+                try:
+                    self.handle_input()
+                except ValueError as e:
+                    logging.warning(f"Console client error: {e}")
+                    self.close()
+                    return
+        if mask & selectors.EVENT_WRITE and self.client_out:
+            try:
+                sent = self.client.send(self.client_out)
+                del self.client_out[:sent]
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError:
+                self.close()
+                return
+            if self.close_after_write and not self.client_out:
+                self.close()
+                return
+        self.interest()
+
+    def on_backend(self, mask):
+        if mask & selectors.EVENT_READ:
+            try:
+                data = self.backend.recv(RECV_SIZE)
+            except (BlockingIOError, InterruptedError):
+                data = None
+            except OSError:
+                data = b""
+            if data == b"":
+                self.client_out += encode_frame(b"", OP_CLOSE)
+                self.close_after_write = True
+                self.proxy._set_events(self.backend, 0, self.on_backend)
+                self.interest()
+                return
+            if data:
+                self.client_out += encode_frame(data)
+        if mask & selectors.EVENT_WRITE and self.backend_out:
+            try:
+                sent = self.backend.send(self.backend_out)
+                del self.backend_out[:sent]
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError:
+                self.close()
+                return
+        self.interest()
+
+    def handle_input(self):
+        if self.state == 'http':
+            end = self.inbuf.find(b"\r\n\r\n")
+            if end < 0:
+                if len(self.inbuf) > MAX_REQUEST:
+                    raise ValueError("Request header too large")
+                return
+            request = bytes(self.inbuf[:end]).decode('latin-1')
+            del self.inbuf[:end + 4]
+            self.handle_request(request)
+        while self.state == 'ws':
+            try:
+                frame = decode_frame(self.inbuf)
+            except FrameTooLarge as e:
+                logging.warning(f"Console client error: {e}")
+                self.inbuf.clear()
+                self.client_out += encode_frame(CLOSE_TOO_BIG.to_bytes(2, 'big'), OP_CLOSE)
+                self.close_after_write = True
+                self.state = 'closing'
+                return
+            if frame is None:
+                return
+            opcode, payload, consumed = frame
+            del self.inbuf[:consumed]
+            if opcode in (OP_BINARY, OP_CONTINUATION):
+                self.backend_out += payload
+            elif opcode == OP_TEXT:
+                self.backend_out += base64.b64decode(payload)
+            elif opcode == OP_PING:
+                self.client_out += encode_frame(payload, OP_PONG)
+            elif opcode == OP_CLOSE:
+                self.client_out += encode_frame(payload[:2], OP_CLOSE)
+                self.close_after_write = True
+                self.state = 'closing'
+
+    def handle_request(self, request):
+        lines = request.split("\r\n")
+        parts = lines[0].split(" ")
+        if len(parts) != 3 or parts[0] != "GET":
+            self.respond(405, "Method Not Allowed")
+            return
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        path = unquote(urlparse(parts[1]).path)
+        if headers.get('upgrade', '').lower() != 'websocket':
+            self.serve_file(path)
+            return
+        target = self.proxy.targets.get(path.strip('/').split('/')[-1])
+        if target is None or 'sec-websocket-key' not in headers:
+            self.respond(404, "Not Found")
+            return
+        accept = base64.b64encode(hashlib.sha1((headers['sec-websocket-key'] + WS_GUID).encode()).digest()).decode()
+        protocols = [p.strip() for p in headers.get('sec-websocket-protocol', '').split(',') if p.strip()]
+        protocol = next((p for p in ('binary', 'base64') if p in protocols), None)
+        response = ("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                    f"Sec-WebSocket-Accept: {accept}\r\n")
+        if protocol:
+            response += f"Sec-WebSocket-Protocol: {protocol}\r\n"
+        self.client_out += (response + "\r\n").encode()
+        self.state = 'ws'
+        self.label, factory = target
+        self.proxy._connect_backend(self, factory)
+
+    def serve_file(self, path):
+        root = self.proxy.web_root
+        if root is None:
+            self.respond(404, "Not Found")
+            return
+        full = os.path.realpath(os.path.join(root, path.lstrip('/') or "vnc.html"))
+        if not full.startswith(os.path.realpath(root) + os.sep) or not os.path.isfile(full):
+            self.respond(404, "Not Found")
+            return
+        with open(full, 'rb') as f:
+            body = f.read()
+        content_type = mimetypes.guess_type(full)[0] or "application/octet-stream"
+        self.respond(200, "OK", body, content_type)
+
+    def respond(self, status, reason, body=None, content_type="text/plain"):
+        body = reason.encode() if body is None else body
+        self.client_out += (f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+                            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode() + body
+        self.close_after_write = True
+
+    def attach(self, backend, cleanup):
+        if self.closed:
+            backend.close()
+            if cleanup:
+                cleanup()
+            return
+        backend.setblocking(False)
+        self.backend = backend
+        self.cleanup = cleanup
+        logging.info(f"Console connected: {self.label}")
+        self.interest()
+
+    def fail(self, error):
+        logging.error(f"Console for {self.label} unavailable: {error}")
+        self.client_out += encode_frame(b"\x03\xf3", OP_CLOSE)
+        self.close_after_write = True
+        self.interest()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for sock in (self.client, self.backend):
+            if sock is None:
+                continue
+            self.proxy._set_events(sock, 0, None)
+            try:
+                sock.close()
+            except OSError:
+                pass
+        if self.cleanup:
+            self.cleanup()
+        self.proxy.sessions.discard(self)
+        if self.backend is not None:
+            logging.info(f"Console closed: {self.label}")
+
+
+class ConsoleProxy:
+    def __init__(self, host="127.0.0.1", port=0, web_root=None, max_workers=4):
+        self.web_root = web_root or find_web_root()
+        self.targets = {}
+        self.sessions = set()
+        self._listener = socket.create_server((host, port))
+        self._listener.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._registered = {}
+        self._calls = queue.SimpleQueue()
+        self._wake_recv, self._wake_send = socket.socketpair()
+        self._wake_recv.setblocking(False)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="console")
+        self._stop = False
+        self._selector.register(self._listener, selectors.EVENT_READ, self._accept)
+        self._selector.register(self._wake_recv, selectors.EVENT_READ, self._drain_calls)
+        self._thread = threading.Thread(target=self._loop, name="console-proxy", daemon=True)
+
+    @property
+    def address(self):
+        return self._listener.getsockname()[:2]
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def add_target(self, label, factory, token=None):
+        token = token or secrets.token_urlsafe(16)
+        self.targets[token] = (label, factory)
+        return token
+
+    def remove_target(self, token):
+        self.targets.pop(token, None)
+
+    def url(self, token):
+        host, port = self.address
+        if self.web_root:
+            return f"http://{host}:{port}/vnc.html?path={token}&autoconnect=1&resize=scale"
+        return f"ws://{host}:{port}/{token}"
+
+    def call_soon(self, func):
+        self._calls.put(func)
+        try:
+            self._wake_send.send(b"\0")
+        except OSError:
+            pass
+
+    def stop(self):
+        self._stop = True
+        self.call_soon(lambda: None)
+        if self._thread.is_alive():
+            self._thread.join(timeout=2)
+        self._executor.shutdown(wait=False)
+
+    def _set_events(self, sock, events, callback):
+        registered = self._registered.get(sock)
+        if events == registered:
+            return
+        if registered is None:
+            if events:
+                self._selector.register(sock, events, callback)
+        elif events:
+            self._selector.modify(sock, events, callback)
+        else:
+            self._selector.unregister(sock)
+        if events:
+            self._registered[sock] = events
+        else:
+            self._registered.pop(sock, None)
+
+    def _connect_backend(self, session, factory):
+        def connect():
+            try:
+                backend, cleanup = factory()
+            except Exception as e:
+                error = e
+                self.call_soon(lambda: session.fail(error))
+                return
+            self.call_soon(lambda: session.attach(backend, cleanup))
+        self._executor.submit(connect)
+
+    def _accept(self, mask):
+        while True:
+            try:
+                client, _ = self._listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            client.setblocking(False)
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            session = _Session(self, client)
+            self.sessions.add(session)
+            session.interest()
+
+    def _drain_calls(self, mask):
+        try:
+            while self._wake_recv.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        while True:
+            try:
+                func = self._calls.get_nowait()
+            except queue.Empty:
+                return
+            func()
+
+    def _loop(self):
+        while not self._stop:
+            for key, mask in self._selector.select(timeout=1.0):
+                try:
+                    key.data(mask)
+                except Exception as e:
+                    logging.error(f"Console proxy error: {e}")
+        for session in list(self.sessions):
+            session.close()
+        self._selector.close()
+        self._listener.close()
+        self._wake_recv.close()
+        self._wake_send.close()
@@ -0,0 +1,716 @@
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import libvirt
+from slugify import slugify
+
+from Hypervisor_Backup import COMPRESSION_LEVEL, SUFFIX as BACKUP_SUFFIX, export_domain, import_domain
+from Hypervisor_Balloon import BalloonController, set_balloon_bounds
+from Hypervisor_DomainXML import build_domain_xml
+from Hypervisor_Events import DomainEventMonitor
+from Hypervisor_Fleet import Fleet
+from Hypervisor_Placement import (SPREAD, STRATEGIES, PlacementError, apply_placement, choose_host, explain_decision,
+                                  format_cpuset, host_state, plan_placement)
+from Hypervisor_Reclaim import DEFAULT_RATE_MB, RECLAIM_SLOTS, reclaim_domain, wait_for_slot
+from Hypervisor_Snapshots import (COMMIT, PULL, create_snapshot, delete_snapshot, list_snapshots, revert_snapshot,
+                                   shorten_chain, snapshot_overlays)
+from Hypervisor_Storage import driver_attributes, storage_profile
+from Hypervisor_Telemetry import TELEMETRY
+from Hypervisor_Templates import clone_disks, flatten_domain, image_chain, template_domain_xml
+from Hypervisor_Volumes import (DEFAULT_POOL, PREALLOCATED, create_volume, domain_disk_usage, is_remote, pool_usage,
+                                remove_volume, remove_volumes, stage_files)
+
+PENDING_LOCK = threading.Lock()
+PENDING_PLACEMENTS = {}
+PLACEMENT_LOCKS = {}
+PENDING_STARTS = {}
+
+
+class NetworkUnavailable(RuntimeError):
+    def __init__(self, network, available):
+        super().__init__(f"Network '{network}' not available")
+        self.network = network
+        self.available = available
+
+
+def lookup_domain(conn, ident):
+    try:
+        return conn.lookupByUUIDString(ident)
+    except libvirt.libvirtError as e:
+        if e.get_error_code() not in (libvirt.VIR_ERR_NO_DOMAIN, libvirt.VIR_ERR_INVALID_ARG):
+            raise
+    return conn.lookupByName(ident)
+
+
+def resolve_domain(manager, ident):
+    with manager.lease() as conn:
+        dom = lookup_domain(conn, ident)
+        return dom.UUIDString(), dom.name()
+
+
+def start_domain(manager, uuid):
+    with manager.lease() as conn:
+        dom = conn.lookupByUUIDString(uuid)
+        if dom.isActive():
+            logging.info(f"VM '{dom.name()}' is already running")
+            return "Already running"
+        dom.create()
+        logging.info(f"VM '{dom.name()}' started")
+    return "Started"
+
+
+def restart_domain(manager, uuid):
+    with manager.lease() as conn:
+        dom = conn.lookupByUUIDString(uuid)
+        if not dom.isActive():
+            logging.info(f"Starting VM '{dom.name()}' as it's not running")
+            dom.create()
+            return "Started"
+        dom.reboot()
+        logging.info(f"VM '{dom.name()}' restarting...")
+    return "Rebooting"
+
+
+def shutdown_domain(manager, uuid):
+    with manager.lease() as conn:
+        dom = conn.lookupByUUIDString(uuid)
+        if not dom.isActive():
+            logging.info(f"VM '{dom.name()}' is not running")
+            return "Not running"
+        dom.shutdown()
+        logging.info(f"VM '{dom.name()}' shutting down...")
+    return "Shutting down"
+
+
+def owned_disk_paths(description, overlays=(), protected_paths=(), local=True):
+    owned = []
+    for disk in description.disks:
+        if disk['device'] != 'disk' or disk['type'] != 'file' or not disk['source']:
+            continue
+        chain = description.backing_chain(disk['target'])
+        if len(chain) < 2 and local:
+            try:
+                chain = image_chain(disk['source'])
+            except (RuntimeError, OSError) as e:
+                logging.warning(f"Cannot read the backing chain of {disk['source']}: {e}")
+        for path in chain or [disk['source']]:
+            if path in protected_paths:
+                break
+            owned.append(path)
+            if path not in overlays:
+                break
+    owned += [path for path in overlays if path not in protected_paths]
+    return list(dict.fromkeys(owned))
+
+
+def delete_domain(manager, uuid, delete_disks=False, protected_paths=(), check_state=True):
+    local = not is_remote(manager.uri)
+    with manager.lease() as conn:
+        dom = conn.lookupByUUIDString(uuid)
+        vm_name = dom.name()
+        paths = []
+        if delete_disks:
+            description = manager.xml_cache.get(dom, check_state=check_state)
+            paths = owned_disk_paths(description, snapshot_overlays(dom), protected_paths, local)
+        if dom.isActive():
+            dom.destroy()
+        dom.undefineFlags(libvirt.VIR_DOMAIN_UNDEFINE_SNAPSHOTS_METADATA)
+        manager.xml_cache.invalidate(uuid)
+    logging.info(f"VM '{vm_name}' undefined")
+    if not delete_disks:
+        return "Deleted"
+    with manager.lease() as conn:
+        errors = remove_volumes(conn, paths, local)
+    if errors:
+        return f"Undefined, {len(errors)} of {len(paths)} disk(s) not deleted: {next(iter(errors.values()))}"
+    return f"Deleted with {len(paths)} disk(s)"
+
+
+def console_address(manager, uuid, kind='vnc', check_state=True, wait=1.0):
+    host = urlparse(manager.uri).hostname or "localhost"
+    deadline = time.monotonic() + wait
+    delay = 0.05
+    while True:
+        with manager.lease() as conn:
+            dom = conn.lookupByUUIDString(uuid)
+            if not dom.isActive():
+                raise RuntimeError(f"VM '{dom.name()}' is not running")
+            description = manager.xml_cache.get(dom, check_state=check_state)
+            if not description.has_graphics(kind):
+                raise RuntimeError(f"{kind.upper()} graphics not configured for {dom.name()}")
+            port = description.graphics_port(kind)
+            if port is not None:
+                return host, port
+            manager.xml_cache.invalidate(uuid)
+            check_state = True
+            name = dom.name()
+        if time.monotonic() + delay > deadline:
+            raise RuntimeError(f"Unable to determine {kind.upper()} port for {name}")
+        time.sleep(delay)
+        delay *= 2
+
+
+def flatten_domain_disks(manager, uuid, on_progress=None, check_cancelled=None, check_state=True):
+    with manager.lease() as conn:
+        dom = conn.lookupByUUIDString(uuid)
+        description = manager.xml_cache.get(dom, check_state=check_state)
+        flattened = flatten_domain(dom, description, on_progress=on_progress, check_cancelled=check_cancelled)
+    manager.xml_cache.invalidate(uuid)
+    if flattened:
+        logging.info(f"Flattened {len(flattened)} disk(s) of '{description.name}'")
+    return flattened
+
+
+def domain_disks(manager, uuid, check_state=True):
+    with manager.lease() as conn:
+        dom = conn.lookupByUUIDString(uuid)
+        return domain_disk_usage(dom, manager.xml_cache.get(dom, check_state=check_state))
+
+
+def storage_usage(manager):
+    with manager.lease() as conn:
+        owners = {}
+        for dom in conn.listAllDomains(0):
+            for disk in manager.xml_cache.get(dom).disks:
+                if disk['source']:
+                    owners.setdefault(disk['source'], dom.name())
+        return pool_usage(conn, owners)
+
+
+def reclaim_domain_space(manager, uuid, rate_mb=DEFAULT_RATE_MB, protected_paths=(), on_progress=None,
+                         check_cancelled=None):
+    wait_for_slot(check_cancelled)
+    try:
+        with manager.lease() as conn:
+            dom = conn.lookupByUUIDString(uuid)
+            manager.xml_cache.invalidate(uuid)
+            description = manager.xml_cache.get(dom)
+            return reclaim_domain(dom, description, not is_remote(manager.uri), rate_mb, protected_paths,
+                                  on_progress, check_cancelled)
+    finally:
+        RECLAIM_SLOTS.release()
+
+
+def export_domain_archive(manager, uuid, path, base=None, workers=None, level=COMPRESSION_LEVEL, protected_paths=(),
+                          on_progress=None, check_cancelled=None):
+    with manager.lease() as conn:
+        dom = conn.lookupByUUIDString(uuid)
+        manager.xml_cache.invalidate(uuid)
+        try:
+            return export_domain(conn, dom, manager.xml_cache.get(dom), path, base, workers, level,
+                                 not is_remote(manager.uri), snapshot_overlays(dom), protected_paths, on_progress,
+                                 check_cancelled)
+        finally:
+            manager.xml_cache.invalidate(uuid)
+
+
+def import_domain_archive(manager, path, name=None, pool=DEFAULT_POOL, workers=None, on_progress=None,
+                          check_cancelled=None):
+    with manager.lease() as conn:
+        return import_domain(conn, path, name, pool, workers, on_progress, check_cancelled)
+
+
+def set_domain_balloon_bounds(manager, uuid, min_mb=None, max_mb=None):
+    with manager.lease() as conn:
+        dom = conn.lookupByUUIDString(uuid)
+        set_balloon_bounds(dom, min_mb, max_mb)
+        logging.info(f"Balloon bounds of '{dom.name()}': min {min_mb or 'default'} MB, max {max_mb or 'default'} MB")
+    manager.xml_cache.invalidate(uuid)
+
+
+def create_domain_snapshot(manager, uuid, name, text="", disk_only=False, quiesce=None, check_state=True):
+    with manager.lease() as conn:
+        dom = conn.lookupByUUIDString(uuid)
+        snapshot = create_snapshot(dom, manager.xml_cache.get(dom, check_state=check_state), name, text,
+                                   disk_only, quiesce)
+    manager.xml_cache.invalidate(uuid)
+    return snapshot
+
+
+def domain_snapshots(manager, uuid):
+    with manager.lease() as conn:
+        return list_snapshots(conn.lookupByUUIDString(uuid))
+
+
+def revert_domain_snapshot(manager, uuid, name):
+    with manager.lease() as conn:
+        revert_snapshot(conn.lookupByUUIDString(uuid), name)
+    manager.xml_cache.invalidate(uuid)
+
+
+def delete_domain_snapshot(manager, uuid, name, children=False):
+    with manager.lease() as conn:
+        delete_snapshot(conn.lookupByUUIDString(uuid), name, children)
+    manager.xml_cache.invalidate(uuid)
+
+
+def shorten_domain_chains(manager, uuid, mode, bandwidth=0, protected_paths=(), on_progress=None,
+                          check_cancelled=None):
+    with manager.lease() as conn:
+        dom = conn.lookupByUUIDString(uuid)
+        manager.xml_cache.invalidate(uuid)
+        description = manager.xml_cache.get(dom)
+        disks = [disk for disk in description.disks
+                 if disk['device'] == 'disk' and disk['type'] == 'file' and disk['target']]
+        overlays = snapshot_overlays(dom)
+        shortened = 0
+        try:
+            for i, disk in enumerate(disks):
+                progress = None
+                if on_progress:
+                    progress = lambda percent, i=i: on_progress((i + percent / 100) / len(disks) * 100)
+                shortened += shorten_chain(dom, description, disk['target'], mode, bandwidth, protected_paths,
+                                           overlays, progress, check_cancelled)
+        finally:
+            manager.xml_cache.invalidate(uuid)
+    return shortened
+
+
+def ensure_network(conn, network):
+    try:
+        net = conn.networkLookupByName(network)
+        if not net.isActive():
+            net.create()
+    except libvirt.libvirtError:
+        raise NetworkUnavailable(network, conn.listNetworks() + conn.listDefinedNetworks())
+
+
+def list_networks(manager):
+    with manager.lease() as conn:
+        return conn.listNetworks() + conn.listDefinedNetworks()
+
+
+def plan_vm(manager, vcpus, memory_mb, placement, pending=()):
+    with manager.lease() as conn:
+        state = host_state(conn, placement.get('reserved_cpus', ()))
+    for xml_config, plan in pending:
+        state.add_pending(xml_config, plan)
+    return plan_placement(state, vcpus, memory_mb, placement.get('hugepages', False),
+                          placement.get('cpu_ratio', 4.0), placement.get('memory_ratio', 1.0))
+
+
+def reserve_capacity(capacities, pending):
+    adjusted = []
+    for capacity in capacities:
+        vcpus, memory_kib, disk_bytes = pending.get(capacity.uri, (0, 0, 0))
+        state = capacity.state
+        state.allocated_vcpus += vcpus
+        state.allocated_memory_kib += memory_kib
+        pool_free = None if capacity.pool_free is None else capacity.pool_free - disk_bytes
+        adjusted.append(capacity._replace(free_kib=capacity.free_kib - memory_kib, pool_free=pool_free))
+    return adjusted
+
+
+def place_domain(fleet, name, vcpus, memory_mb, disk_bytes=0, network=None, strategy=SPREAD, placement=None,
+                 pool=DEFAULT_POOL, uris=None):
+    placement = placement or {}
+    capacities, errors = fleet.capacities(pool, placement.get('reserved_cpus', ()), uris)
+    with PENDING_LOCK:
+        capacities = reserve_capacity(capacities, PENDING_PLACEMENTS)
+        decision = choose_host(capacities, vcpus, memory_mb, disk_bytes, network, strategy, placement, errors)
+        used = PENDING_PLACEMENTS.get(decision.uri, (0, 0, 0))
+        PENDING_PLACEMENTS[decision.uri] = (used[0] + vcpus, used[1] + memory_mb * 1024, used[2] + disk_bytes)
+    for line in explain_decision(decision, name):
+        logging.info(line)
+    return decision
+
+
+def release_placement(decision, vcpus, memory_mb, disk_bytes=0):
+    with PENDING_LOCK:
+        used = PENDING_PLACEMENTS.pop(decision.uri, (0, 0, 0))
+        left = (used[0] - vcpus, used[1] - memory_mb * 1024, used[2] - disk_bytes)
+        if any(value > 0 for value in left):
+            PENDING_PLACEMENTS[decision.uri] = left
+
+
+def placement_lock(uri):
+    with PENDING_LOCK:
+        return PLACEMENT_LOCKS.setdefault(uri, threading.Lock())
+
+
+def define_domain(manager, vm_name, xml_config):
+    with manager.lease() as conn:
+        dom = conn.defineXML(xml_config)
+        if not dom:
+            raise RuntimeError("Failed to define VM")
+        logging.info(f"VM '{vm_name}' defined successfully")
+        return dom.UUIDString()
+
+
+def start_defined(manager, vm_name, uuid, strict=False):
+    with manager.lease() as conn:
+        dom = conn.lookupByUUIDString(uuid)
+        try:
+            dom.create()
+            logging.info(f"VM '{vm_name}' started")
+        except libvirt.libvirtError as e:
+            if strict:
+                dom.undefine()
+                raise
+            logging.error(f"VM defined but failed to start: {e}")
+    return uuid
+
+
+def define_and_start(manager, vm_name, xml_config, vcpus, memory_mb, placement=None, strict=False):
+    if not placement:
+        return start_defined(manager, vm_name, define_domain(manager, vm_name, xml_config), strict)
+    with placement_lock(manager.uri):
+        with PENDING_LOCK:
+            pending = list(PENDING_STARTS.get(manager.uri, {}).values())
+        plan = plan_vm(manager, vcpus, memory_mb, placement, pending)
+        xml_config = apply_placement(xml_config, plan)
+        logging.info(
+            f"Placing '{vm_name}' on NUMA node(s) {format_cpuset(cell for cell, _, _ in plan.cells)} "
+            f"({plan.memory_mode}), vCPUs pinned to {format_cpuset(plan.vcpu_pins)}"
+            f"{', hugepages' if plan.hugepages else ''}")
+        uuid = define_domain(manager, vm_name, xml_config)
+        with PENDING_LOCK:
+            PENDING_STARTS.setdefault(manager.uri, {})[uuid] = (xml_config, plan)
+    try:
+        return start_defined(manager, vm_name, uuid, strict)
+    finally:
+        with PENDING_LOCK:
+            PENDING_STARTS[manager.uri].pop(uuid, None)
+
+
+def create_domain(manager, name, memory_mb, vcpus, disk_gb, network, cdroms=(), profile=None,
+                  placement=None, pool=DEFAULT_POOL, on_progress=None, check_cancelled=None):
+    profile = profile or storage_profile(None)
+    with manager.lease() as conn:
+        ensure_network(conn, network)
+    if placement:
+        plan_vm(manager, vcpus, memory_mb, placement)
+    with manager.lease() as conn:
+        cdroms = stage_files(conn, manager.uri, cdroms, pool, on_progress, check_cancelled)
+        disk_path = create_volume(conn, pool, f"{slugify(name)}.qcow2", disk_gb, profile)
+    try:
+        xml_config = build_domain_xml(name, memory_mb, vcpus, disk_path, network, cdroms=cdroms,
+                                      driver=driver_attributes(profile, vcpus),
+                                      iothreads=profile.get('iothreads', 0))
+        return define_and_start(manager, name, xml_config, vcpus, memory_mb, placement)
+    except (libvirt.libvirtError, PlacementError, RuntimeError):
+        with manager.lease() as conn:
+            remove_volume(conn, disk_path, local=False)
+        raise
+
+
+def create_placed_domain(fleet, name, memory_mb, vcpus, disk_gb, network, cdroms=(), profile=None, placement=None,
+                         settings=None, strategy=SPREAD, pool=DEFAULT_POOL, on_progress=None, check_cancelled=None):
+    profile = profile or storage_profile(None)
+    disk_bytes = disk_gb * 1024 ** 3 if profile.get('preallocation') in PREALLOCATED else 0
+    decision = place_domain(fleet, name, vcpus, memory_mb, disk_bytes, network, strategy, settings or placement, pool)
+    try:
+        uuid = create_domain(fleet.manager(decision.uri), name, memory_mb, vcpus, disk_gb, network, cdroms, profile,
+                             placement, pool, on_progress, check_cancelled)
+    finally:
+        release_placement(decision, vcpus, memory_mb, disk_bytes)
+    return uuid, decision
+
+
+def clone_domain(manager, template, mode, name, memory_mb, vcpus, network, profile=None, placement=None,
+                 check_cancelled=None, pool=DEFAULT_POOL):
+    profile = profile or storage_profile(None)
+    started = time.monotonic()
+    with manager.lease() as conn:
+        ensure_network(conn, network)
+    if placement:
+        plan_vm(manager, vcpus, memory_mb, placement)
+    with manager.lease() as conn:
+        disk_paths = clone_disks(conn, template, slugify(name), mode, pool, check_cancelled, profile)
+    try:
+        xml_config = template_domain_xml(template, name, disk_paths, network, memory_mb, vcpus,
+                                         driver_attributes(profile, vcpus), profile.get('iothreads', 0))
+        uuid = define_and_start(manager, name, xml_config, vcpus, memory_mb, placement)
+    except (libvirt.libvirtError, PlacementError, RuntimeError):
+        with manager.lease() as conn:
+            remove_volumes(conn, [path for path, _ in disk_paths.values()], local=False)
+        raise
+    elapsed = time.monotonic() - started
+    logging.info(f"VM '{name}' cloned from '{template['name']}' ({mode}) in {elapsed:.1f}s")
+    return uuid, elapsed
+
+
+class _LoopQueue:
+    def __init__(self, loop, queue):
+        self.loop = loop
+        self.queue = queue
+
+    def put(self, item):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+
+class HypervisorController:
+    def __init__(self, uri="qemu:///system", fleet_uris=(), timeout=10, max_workers=8):
+        self.uri = uri
+        self.fleet = Fleet([uri, *fleet_uris], timeout=timeout)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="controller")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _run(self, func, *args, **kwargs):
+        return asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def manager(self, uri=None):
+        return self.fleet.manager(uri or self.uri)
+
+    async def connect(self):
+        def ping(manager):
+            with manager.lease():
+                return manager.hostname
+        return dict(zip(self.fleet.uris, await asyncio.gather(
+            *(self._run(ping, self.fleet.manager(uri)) for uri in self.fleet.uris))))
+
+    async def domains(self):
+        inventories = await self._run(self.fleet.collect)
+        rows = [row for inventory in inventories if inventory.rows for row in inventory.rows]
+        errors = {inventory.uri: inventory.error for inventory in inventories if inventory.error}
+        return rows, errors
+
+    async def networks(self, uri=None):
+        return await self._run(list_networks, self.manager(uri))
+
+    async def resolve(self, ident, uri=None):
+        manager = self.manager(uri)
+        uuid, name = await self._run(resolve_domain, manager, ident)
+        return manager, uuid, name
+
+    async def start(self, ident, uri=None):
+        manager, uuid, _ = await self.resolve(ident, uri)
+        return await self._run(start_domain, manager, uuid)
+
+    async def restart(self, ident, uri=None):
+        manager, uuid, _ = await self.resolve(ident, uri)
+        return await self._run(restart_domain, manager, uuid)
+
+    async def shutdown(self, ident, uri=None):
+        manager, uuid, _ = await self.resolve(ident, uri)
+        return await self._run(shutdown_domain, manager, uuid)
+
+    async def delete(self, ident, delete_disks=False, protected_paths=(), uri=None):
+        manager, uuid, _ = await self.resolve(ident, uri)
+        return await self._run(delete_domain, manager, uuid, delete_disks, protected_paths)
+
+    async def disks(self, ident, uri=None):
+        manager, uuid, _ = await self.resolve(ident, uri)
+        return await self._run(domain_disks, manager, uuid)
+
+    async def storage(self, uri=None):
+        return await self._run(storage_usage, self.manager(uri))
+
+    async def reclaim(self, ident, rate_mb=DEFAULT_RATE_MB, protected_paths=(), uri=None):
+        manager, uuid, _ = await self.resolve(ident, uri)
+        return await self._run(reclaim_domain_space, manager, uuid, rate_mb, protected_paths)
+
+    async def export(self, ident, path, base=None, workers=None, level=COMPRESSION_LEVEL, uri=None):
+        manager, uuid, _ = await self.resolve(ident, uri)
+        return await self._run(export_domain_archive, manager, uuid, path, base, workers, level)
+
+    async def import_archive(self, path, name=None, pool=DEFAULT_POOL, workers=None, uri=None):
+        return await self._run(import_domain_archive, self.manager(uri), path, name, pool, workers)
+
+    async def console(self, ident, uri=None):
+        manager, uuid, _ = await self.resolve(ident, uri)
+        return await self._run(console_address, manager, uuid)
+
+    async def balloon(self, ticks=1, apply=False, interval=10.0, settings=None):
+        controller = BalloonController(lambda: self.fleet.managers, interval, dry_run=not apply, settings=settings)
+        decisions = []
+        for tick in range(ticks):
+            if tick:
+                await asyncio.sleep(interval)
+            decisions += await self._run(controller.tick)
+        return {'pressure': controller.pressure, 'decisions': [decision._asdict() for decision in decisions]}
+
+    async def snapshots(self, ident, uri=None):
+        manager, uuid, _ = await self.resolve(ident, uri)
+        return await self._run(domain_snapshots, manager, uuid)
+
+    async def snapshot(self, ident, name, text="", disk_only=False, quiesce=None, uri=None):
+        manager, uuid, _ = await self.resolve(ident, uri)
+        return await self._run(create_domain_snapshot, manager, uuid, name, text, disk_only, quiesce)
+
+    async def revert(self, ident, name, uri=None):
+        manager, uuid, _ = await self.resolve(ident, uri)
+        return await self._run(revert_domain_snapshot, manager, uuid, name)
+
+    async def delete_snapshot(self, ident, name, children=False, uri=None):
+        manager, uuid, _ = await self.resolve(ident, uri)
+        return await self._run(delete_domain_snapshot, manager, uuid, name, children)
+
+    async def shorten(self, ident, mode, bandwidth=0, protected_paths=(), uri=None):
+        manager, uuid, _ = await self.resolve(ident, uri)
+        return await self._run(shorten_domain_chains, manager, uuid, mode, bandwidth, protected_paths)
+
+    async def create(self, name, memory_mb, vcpus, disk_gb, network, cdroms=(), profile=None, placement=None):
+        return await self._run(create_domain, self.manager(), name, memory_mb, vcpus, disk_gb, network,
+                               cdroms, profile, placement)
+
+    async def place(self, vcpus, memory_mb, disk_gb=0, network=None, strategy=SPREAD, settings=None,
+                    pool=DEFAULT_POOL):
+        settings = settings or {}
+        capacities, errors = await self._run(self.fleet.capacities, pool, settings.get('reserved_cpus', ()))
+        return choose_host(capacities, vcpus, memory_mb, disk_gb * 1024 ** 3, network, strategy, settings, errors)
+
+    async def clone(self, template, mode, name, memory_mb, vcpus, network, profile=None, placement=None):
+        return await self._run(clone_domain, self.manager(), template, mode, name, memory_mb, vcpus, network,
+                               profile, placement)
+
+    async def events(self, uris=None):
+        queue = asyncio.Queue()
+        sink = _LoopQueue(asyncio.get_running_loop(), queue)
+        monitors = [DomainEventMonitor(uri, sink) for uri in (uris or self.fleet.uris)]
+        for monitor in monitors:
+            monitor.start()
+        try:
+            while True:
+                event = await queue.get()
+                if event.uuid:
+                    self.manager(event.uri).xml_cache.invalidate(event.uuid)
+                yield event
+        finally:
+            for monitor in monitors:
+                monitor.stop()
+
+    async def close(self):
+        self.fleet.close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_command(args):
+    async with HypervisorController(args.uri, args.host, timeout=args.timeout) as controller:
+        if args.command == 'list':
+            rows, errors = await controller.domains()
+            return {'domains': rows, 'errors': errors}
+        if args.command == 'networks':
+            return {'networks': await controller.networks()}
+        if args.command == 'storage':
+            return {'pools': await controller.storage()}
+        if args.command == 'import':
+            uuid = await controller.import_archive(args.archive, args.name, args.pool, args.workers)
+            return {'archive': args.archive, 'uuid': uuid}
+        if args.command == 'events':
+            count = 0
+            async for event in controller.events():
+                print(json.dumps(event._asdict()), flush=True)
+                count += 1
+                if args.count and count >= args.count:
+                    break
+            return None
+        if args.command == 'console':
+            host, port = await controller.console(args.domain)
+            return {'domain': args.domain, 'host': host, 'port': port}
+        if args.command == 'delete':
+            result = await controller.delete(args.domain, args.delete_disks)
+        elif args.command == 'export':
+            result = await controller.export(args.domain, args.archive, args.base, args.workers, args.level)
+        elif args.command == 'reclaim':
+            result = await controller.reclaim(args.domain, args.rate)
+        elif args.command == 'snapshots':
+            result = await controller.snapshots(args.domain)
+        elif args.command == 'snapshot':
+            result = await controller.snapshot(args.domain, args.name, args.description, args.disk_only)
+        elif args.command == 'revert':
+            result = await controller.revert(args.domain, args.name)
+        elif args.command == 'delete-snapshot':
+            result = await controller.delete_snapshot(args.domain, args.name, args.children)
+        elif args.command == 'balloon':
+            return await controller.balloon(args.ticks, args.apply, args.interval)
+        elif args.command == 'place':
+            decision = await controller.place(args.vcpus, args.memory, args.disk, args.network, args.strategy,
+                                              {'cpu_ratio': args.cpu_ratio, 'memory_ratio': args.memory_ratio})
+            return {**decision._asdict(), 'explain': explain_decision(decision, args.name)}
+        elif args.command in (COMMIT, PULL):
+            result = await controller.shorten(args.domain, args.command, args.bandwidth)
+        else:
+            result = await getattr(controller, args.command)(args.domain)
+        return {'domain': args.domain, 'result': result}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless hypervisor controller; prints JSON")
+    parser.add_argument('--uri', default="qemu:///system")
+    parser.add_argument('--host', action='append', default=[], help="additional libvirt URI (repeatable)")
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--metrics-file', help="write Prometheus call metrics to this file on exit")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list')
+    commands.add_parser('networks')
+    commands.add_parser('storage', help="storage pools and volumes with their owning VMs")
+    events = commands.add_parser('events')
+    events.add_argument('--count', type=int, default=0, help="stop after this many events")
+    for command in ('start', 'restart', 'shutdown', 'console', 'delete', 'disks', 'reclaim'):
+        sub = commands.add_parser(command)
+        sub.add_argument('domain', help="domain name or UUID")
+        if command == 'delete':
+            sub.add_argument('--delete-disks', action='store_true')
+        elif command == 'reclaim':
+            sub.add_argument('--rate', type=int, default=DEFAULT_RATE_MB, help="MiB/s for offline sparsification")
+    for command in ('snapshots', 'snapshot', 'revert', 'delete-snapshot', COMMIT, PULL):
+        sub = commands.add_parser(command)
+        sub.add_argument('domain', help="domain name or UUID")
+        if command in ('snapshot', 'revert', 'delete-snapshot'):
+            sub.add_argument('name', help="snapshot name")
+        if command == 'snapshot':
+            sub.add_argument('--description', default="")
+            sub.add_argument('--disk-only', action='store_true', help="external disk-only snapshot")
+        elif command == 'delete-snapshot':
+            sub.add_argument('--children', action='store_true')
+        elif command in (COMMIT, PULL):
+            sub.add_argument('--bandwidth', type=int, default=0, help="MiB/s, 0 for unlimited")
+    export = commands.add_parser('export', help="back up a VM's definition and disks into one archive")
+    export.add_argument('domain', help="domain name or UUID")
+    export.add_argument('archive', help=f"output file, e.g. web1{BACKUP_SUFFIX}; an interrupted export resumes")
+    export.add_argument('--base', help="earlier archive of the same VM; unchanged chunks are referenced, not stored")
+    export.add_argument('--workers', type=int, help="compression threads (default: all cores)")
+    export.add_argument('--level', type=int, default=COMPRESSION_LEVEL, choices=range(1, 10))
+    restore = commands.add_parser('import', help="define a VM from an exported archive")
+    restore.add_argument('archive')
+    restore.add_argument('--name', help="new VM name; a renamed VM gets a new UUID and MAC addresses")
+    restore.add_argument('--pool', default=DEFAULT_POOL)
+    restore.add_argument('--workers', type=int)
+    place = commands.add_parser('place', help="show which host would run a new VM, without creating it")
+    place.add_argument('--name', default="new-vm")
+    place.add_argument('--vcpus', type=int, default=2)
+    place.add_argument('--memory', type=int, default=2048, help="MB")
+    place.add_argument('--disk', type=int, default=0, help="GB that must be free in the storage pool")
+    place.add_argument('--network')
+    place.add_argument('--strategy', choices=list(STRATEGIES), default=SPREAD)
+    place.add_argument('--cpu-ratio', type=float, default=4.0)
+    place.add_argument('--memory-ratio', type=float, default=1.0)
+    balloon = commands.add_parser('balloon', help="evaluate the memory balloon policy for running VMs")
+    balloon.add_argument('--ticks', type=int, default=1)
+    balloon.add_argument('--interval', type=float, default=10.0)
+    balloon.add_argument('--apply', action='store_true', help="resize balloons instead of a dry run")
+    args = parser.parse_args(argv)
+    if args.metrics_file:
+        TELEMETRY.enable()
+    try:
+        result = asyncio.run(run_command(args))
+    except (libvirt.libvirtError, PlacementError, RuntimeError) as e:
+        print(json.dumps({'error': str(e)}))
+        return 1
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        if args.metrics_file:
+            TELEMETRY.write_prometheus(args.metrics_file)
+    if result is not None:
+        print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
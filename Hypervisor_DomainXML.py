@@ -0,0 +1,332 @@
+import random
+import threading
+import uuid
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from xml.sax.saxutils import escape
+
+from Hypervisor_Telemetry import TELEMETRY
+
+GRAPHICS_LISTEN = "127.0.0.1"
+WILDCARD_ADDRESSES = ('0.0.0.0', '::')
+GUEST_AGENT_CHANNEL = "org.qemu.guest_agent.0"
+BALLOON_STATS_PERIOD = 5
+
+
+class DomainDescription:
+    def __init__(self, xml_desc):
+        self.xml = xml_desc
+        with TELEMETRY.track("xml parse"):
+            self.root = ET.fromstring(xml_desc)
+
+    @property
+    def name(self):
+        return self.root.findtext('name')
+
+    @property
+    def uuid(self):
+        return self.root.findtext('uuid')
+
+    @property
+    def arch(self):
+        os_type = self.root.find('./os/type')
+        return os_type.get('arch') if os_type is not None else None
+
+    @property
+    def memory_kib(self):
+        return int(self.root.findtext('memory', '0'))
+
+    @property
+    def current_memory_kib(self):
+        return int(self.root.findtext('currentMemory', str(self.memory_kib)))
+
+    @property
+    def vcpus(self):
+        return int(self.root.findtext('vcpu', '0'))
+
+    @property
+    def disks(self):
+        disks = []
+        for disk in self.root.findall('./devices/disk'):
+            source = disk.find('source')
+            target = disk.find('target')
+            driver = disk.find('driver')
+            if source is None:
+                path = None
+            else:
+                path = source.get('file') or source.get('dev') or source.get('volume') or source.get('name')
+            disks.append({
+                'type': disk.get('type'),
+                'device': disk.get('device', 'disk'),
+                'source': path,
+                'pool': source.get('pool') if source is not None else None,
+                'target': target.get('dev') if target is not None else None,
+                'bus': target.get('bus') if target is not None else None,
+                'format': driver.get('type') if driver is not None else None,
+            })
+        return disks
+
+    @property
+    def graphics(self):
+        graphics = []
+        for node in self.root.findall('./devices/graphics'):
+            port = node.get('port')
+            graphics.append({
+                'type': node.get('type'),
+                'port': int(port) if port and port != '-1' else None,
+                'autoport': node.get('autoport') == 'yes',
+                'listen': node.get('listen'),
+            })
+        return graphics
+
+    def graphics_port(self, kind='vnc'):
+        for node in self.graphics:
+            if node['type'] == kind:
+                return node['port']
+        return None
+
+    def has_graphics(self, kind='vnc'):
+        return any(node['type'] == kind for node in self.graphics)
+
+    @property
+    def guest_agent_connected(self):
+        for channel in self.root.findall('./devices/channel'):
+            target = channel.find('target')
+            if target is not None and target.get('name') == GUEST_AGENT_CHANNEL:
+                return target.get('state') == 'connected'
+        return False
+
+    def backing_chain(self, target):
+        for disk in self.root.findall('./devices/disk'):
+            node = disk.find('target')
+            if node is None or node.get('dev') != target:
+                continue
+            chain = []
+            while disk is not None:
+                source = disk.find('source')
+                if source is None or not source.get('file'):
+                    break
+                chain.append(source.get('file'))
+                disk = disk.find('backingStore')
+            return chain
+        return []
+
+    @property
+    def interfaces(self):
+        interfaces = []
+        for node in self.root.findall('./devices/interface'):
+            mac = node.find('mac')
+            source = node.find('source')
+            model = node.find('model')
+            interfaces.append({
+                'type': node.get('type'),
+                'mac': mac.get('address') if mac is not None else None,
+                'source': (source.get('network') or source.get('bridge') or source.get('dev')) if source is not None else None,
+                'model': model.get('type') if model is not None else None,
+            })
+        return interfaces
+
+
+class DomainXMLCache:
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def _generation(self, uuid):
+        return (self._epoch, self._generations.get(uuid, 0))
+
+    def get(self, dom, check_state=False):
+        uuid = dom.UUIDString()
+        dom_id = dom.ID()
+        state = dom.state()[0] if check_state else None
+        with self._lock:
+            generation = self._generation(uuid)
+            entry = self._entries.get(uuid)
+            if entry is not None:
+                entry_generation, entry_id, entry_state, description = entry
+                if (entry_generation == generation and entry_id == dom_id
+                        and (not check_state or entry_state == state)):
+                    self._entries.move_to_end(uuid)
+                    return description
+        description = DomainDescription(dom.XMLDesc(0))
+        with self._lock:
+            if self._generation(uuid) == generation:
+                self._entries[uuid] = (generation, dom_id, state, description)
+                self._entries.move_to_end(uuid)
+                while len(self._entries) > self.capacity:
+                    self._entries.popitem(last=False)
+        return description
+
+    def invalidate(self, uuid):
+        with self._lock:
+            self._generations[uuid] = self._generations.get(uuid, 0) + 1
+            self._entries.pop(uuid, None)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._generations.clear()
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def xml_escape(value):
+    return escape(str(value), {"'": "&apos;"})
+
+
+def random_mac():
+    return "52:54:00:" + ":".join(f"{random.randint(0, 255):02x}" for _ in range(3))
+
+
+def driver_xml(disk_format, driver=None):
+    attributes = "".join(f" {key}='{xml_escape(value)}'" for key, value in (driver or {}).items())
+    return f"<driver name='qemu' type='{disk_format}'{attributes}/>"
+
+
+def build_domain_xml(name, memory_mb, vcpus, disk_path, network, cdroms=(), disk_format='qcow2',
+                     driver=None, iothreads=0):
+    iothreads_xml = "\n  <iothreads>1</iothreads>" if iothreads else ""
+    boot = "\n    <boot dev='cdrom'/>" if cdroms else ""
+    cdrom_xml = "".join(f"""
+    <disk type='file' device='cdrom'>
+      <driver name='qemu' type='raw'/>
+      <source file='{xml_escape(path)}'/>
+      <target dev='sd{chr(ord('a') + unit)}' bus='sata'/>
+      <readonly/>
+      <address type='drive' controller='0' bus='0' target='0' unit='{unit}'/>
+    </disk>""" for unit, path in enumerate(cdroms))
+    return f"""<domain type='kvm'>
+  <name>{xml_escape(name)}</name>
+  <memory unit='KiB'>{memory_mb * 1024}</memory>
+  <currentMemory unit='KiB'>{memory_mb * 1024}</currentMemory>
+  <vcpu>{vcpus}</vcpu>{iothreads_xml}
+  <os>
+    <type arch='x86_64'>hvm</type>{boot}
+    <boot dev='hd'/>
+  </os>
+  <features>
+    <acpi/>
+    <apic/>
+    <vmport state='off'/>
+  </features>
+  <cpu mode='host-passthrough'/>
+  <clock offset='localtime'/>
+  <devices>
+    <disk type='file' device='disk'>
+      {driver_xml(disk_format, driver)}
+      <source file='{xml_escape(disk_path)}'/>
+      <target dev='vda' bus='virtio'/>
+      <address type='pci' domain='0x0000' bus='0x00' slot='0x04' function='0x0'/>
+    </disk>{cdrom_xml}
+    <controller type='sata' index='0'>
+      <address type='pci' domain='0x0000' bus='0x00' slot='0x05' function='0x0'/>
+    </controller>
+    <interface type='network'>
+      <source network='{xml_escape(network)}'/>
+      <model type='virtio'/>
+      <address type='pci' domain='0x0000' bus='0x00' slot='0x03' function='0x0'/>
+    </interface>
+    <graphics type='vnc' port='-1' autoport='yes' listen='{GRAPHICS_LISTEN}'/>
+    <video>
+      <model type='virtio'/>
+      <address type='pci' domain='0x0000' bus='0x00' slot='0x02' function='0x0'/>
+    </video>
+    <input type='tablet' bus='usb'/>
+    <input type='keyboard' bus='ps2'/>
+    <input type='mouse' bus='ps2'/>
+    <controller type='usb' index='0' model='ich9-ehci1'/>
+    <controller type='pci' index='0' model='pci-root'/>
+    <memballoon model='virtio'>
+      <stats period='{BALLOON_STATS_PERIOD}'/>
+    </memballoon>
+  </devices>
+</domain>"""
+
+
+def clone_domain_xml(xml_desc, name, disk_paths, network=None, memory_mb=None, vcpus=None,
+                     driver=None, iothreads=0):
+    root = ET.fromstring(xml_desc)
+    root.attrib.pop('id', None)
+    root.find('name').text = name
+    if memory_mb is not None:
+        for tag in ('memory', 'currentMemory'):
+            node = root.find(tag)
+            if node is not None:
+                node.set('unit', 'KiB')
+                node.text = str(memory_mb * 1024)
+    if vcpus is not None:
+        node = root.find('vcpu')
+        node.attrib.pop('current', None)
+        node.text = str(vcpus)
+    uuid_node = root.find('uuid')
+    if uuid_node is None:
+        uuid_node = ET.SubElement(root, 'uuid')
+    uuid_node.text = str(uuid.uuid4())
+    for node in root.findall('./os/boot'):
+        if node.get('dev') == 'cdrom':
+            root.find('os').remove(node)
+    devices = root.find('devices')
+    virtio_disks = 0
+    for disk in devices.findall('disk'):
+        source = disk.find('source')
+        if disk.get('device') == 'cdrom':
+            if source is not None:
+                disk.remove(source)
+            continue
+        path = source.get('file') if source is not None else None
+        if path in disk_paths:
+            new_path, new_format = disk_paths[path]
+            source.set('file', new_path)
+            driver_node = disk.find('driver')
+            if driver_node is None:
+                driver_node = ET.Element('driver', name='qemu')
+                disk.insert(0, driver_node)
+            driver_node.set('type', new_format)
+            if driver:
+                virtio = disk.find('target').get('bus') == 'virtio'
+                for key, value in driver.items():
+                    if key in ('queues', 'iothread') and not virtio:
+                        continue
+                    if key == 'iothread' and iothreads:
+                        value = str(virtio_disks % iothreads + 1)
+                    driver_node.set(key, value)
+                virtio_disks += virtio
+            backing = disk.find('backingStore')
+            if backing is not None:
+                disk.remove(backing)
+        elif source is not None and disk.find('readonly') is None and disk.find('shareable') is None:
+            raise RuntimeError(f"Disk {disk.find('target').get('dev')} has no copy for the clone and would be shared "
+                               "writable with its source; copy it or mark it <shareable/>")
+    if iothreads:
+        node = root.find('iothreads')
+        if node is None:
+            node = ET.Element('iothreads')
+            root.insert(list(root).index(root.find('vcpu')) + 1, node)
+        node.text = str(max(1, min(iothreads, virtio_disks)))
+    for interface in devices.findall('interface'):
+        mac = interface.find('mac')
+        if mac is not None:
+            mac.set('address', random_mac())
+        source = interface.find('source')
+        if network and interface.get('type') == 'network' and source is not None:
+            source.set('network', network)
+        target = interface.find('target')
+        if target is not None:
+            interface.remove(target)
+    for graphics in devices.findall('graphics'):
+        if graphics.get('autoport') != 'no':
+            graphics.set('port', '-1')
+            graphics.set('autoport', 'yes')
+        if graphics.get('listen') in WILDCARD_ADDRESSES:
+            graphics.set('listen', GRAPHICS_LISTEN)
+        for listen in graphics.findall('listen'):
+            if listen.get('address') in WILDCARD_ADDRESSES:
+                listen.set('address', GRAPHICS_LISTEN)
+    for node in root.findall('seclabel'):
+        root.remove(node)
+    return ET.tostring(root, encoding='unicode')
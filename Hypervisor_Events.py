@@ -0,0 +1,133 @@
+import logging
+import threading
+from collections import namedtuple
+
+import libvirt
+
+from Hypervisor_Inventory import is_unsupported
+
+DomainEvent = namedtuple('DomainEvent', 'uri kind uuid name event detail')
+
+_event_loop_lock = threading.Lock()
+_event_loop_thread = None
+
+
+def start_event_loop():
+    global _event_loop_thread
+    with _event_loop_lock:
+        if _event_loop_thread is None:
+            libvirt.virEventRegisterDefaultImpl()
+
+            def run_event_loop():
+                while True:
+                    if libvirt.virEventRunDefaultImpl() < 0:
+                        logging.error("libvirt event loop iteration failed")
+
+            _event_loop_thread = threading.Thread(target=run_event_loop, name="libvirt-events", daemon=True)
+            _event_loop_thread.start()
+    return _event_loop_thread
+
+
+class DomainEventMonitor:
+    def __init__(self, uri, events, keepalive_interval=5, keepalive_count=3, max_backoff=30):
+        self.uri = uri
+        self.events = events
+        self.keepalive_interval = keepalive_interval
+        self.keepalive_count = keepalive_count
+        self.max_backoff = max_backoff
+        self.conn = None
+        self.connected = False
+        self.callback_ids = []
+        self._stop = threading.Event()
+        self._dropped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        start_event_loop()
+        self._thread = threading.Thread(target=self._run, name=f"events-{self.uri}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._dropped.set()
+
+    def _run(self):
+        delay = 1
+        while not self._stop.is_set():
+            try:
+                self._connect()
+            except libvirt.libvirtError as e:
+                logging.warning(f"Event connection to {self.uri} failed, retrying in {delay}s: {e}")
+                self._disconnect()
+                self._stop.wait(delay)
+                delay = min(delay * 2, self.max_backoff)
+                continue
+            delay = 1
+            self._dropped.wait()
+            self._dropped.clear()
+            self._disconnect()
+
+    def _connect(self):
+        self.conn = libvirt.openReadOnly(self.uri)
+        try:
+            self.conn.setKeepAlive(self.keepalive_interval, self.keepalive_count)
+        except libvirt.libvirtError as e:
+            if not is_unsupported(e):
+                raise
+        self.conn.registerCloseCallback(self._on_close, None)
+        callbacks = [
+            (libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE, self._on_lifecycle),
+            (libvirt.VIR_DOMAIN_EVENT_ID_REBOOT, self._on_reboot),
+            (libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_ADDED, self._on_device_added),
+            (libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_REMOVED, self._on_device_removed),
+        ]
+        for event_id, callback in callbacks:
+            self.callback_ids.append(self.conn.domainEventRegisterAny(None, event_id, callback, None))
+        self.connected = True
+        self.events.put(DomainEvent(self.uri, 'connected', None, None, None, None))
+        logging.info(f"Listening for domain events on {self.uri}")
+
+    def _disconnect(self):
+        conn, self.conn = self.conn, None
+        was_connected, self.connected = self.connected, False
+        if conn is not None:
+            for callback_id in self.callback_ids:
+                try:
+                    conn.domainEventDeregisterAny(callback_id)
+                except libvirt.libvirtError:
+                    pass
+            try:
+                conn.unregisterCloseCallback()
+            except libvirt.libvirtError:
+                pass
+            try:
+                conn.close()
+            except libvirt.libvirtError:
+                pass
+        self.callback_ids = []
+        if was_connected:
+            self.events.put(DomainEvent(self.uri, 'disconnected', None, None, None, None))
+
+    def _emit(self, kind, dom, event=None, detail=None):
+        self.events.put(DomainEvent(self.uri, kind, dom.UUIDString(), dom.name(), event, detail))
+
+    def _on_close(self, conn, reason, opaque):
+        logging.warning(f"Event connection to {self.uri} closed (reason {reason})")
+        self._dropped.set()
+
+    def _on_lifecycle(self, conn, dom, event, detail, opaque):
+        if event == libvirt.VIR_DOMAIN_EVENT_DEFINED:
+            self._emit('defined', dom, event, detail)
+        elif event == libvirt.VIR_DOMAIN_EVENT_UNDEFINED:
+            self._emit('undefined', dom, event, detail)
+        else:
+            self._emit('lifecycle', dom, event, detail)
+
+    def _on_reboot(self, conn, dom, opaque):
+        self._emit('reboot', dom)
+
+    def _on_device_added(self, conn, dom, dev_alias, opaque):
+        self._emit('device-added', dom, detail=dev_alias)
+
+    def _on_device_removed(self, conn, dom, dev_alias, opaque):
+        self._emit('device-removed', dom, detail=dev_alias)
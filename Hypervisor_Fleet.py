@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import libvirt
+
+from Hypervisor_Connection import ConnectionManager
+from Hypervisor_Inventory import collect_domains, collect_domain_rows, row_key, tag_rows
+from Hypervisor_Placement import host_capacity
+
+HostInventory = namedtuple('HostInventory', 'uri host rows error elapsed')
+
+
+class Fleet:
+    def __init__(self, uris, timeout=10, max_workers=None, on_state=None):
+        self.uris = list(dict.fromkeys(uris))
+        self.timeout = timeout
+        self.managers = {}
+        for uri in self.uris:
+            notify = (lambda message, uri=uri: on_state(uri, message)) if on_state else None
+            self.managers[uri] = ConnectionManager(uri, lease_timeout=timeout, on_state=notify)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or len(self.uris),
+                                            thread_name_prefix="fleet")
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def manager(self, uri):
+        return self.managers[uri]
+
+    def hostname(self, uri):
+        return self.managers[uri].hostname or uri
+
+    def _collect_host(self, uri, on_error):
+        manager = self.managers[uri]
+        start = time.perf_counter()
+        with manager.lease() as conn:
+            rows = collect_domains(conn, on_error)
+        return HostInventory(uri, self.hostname(uri), tag_rows(rows, uri, self.hostname(uri)),
+                             None, time.perf_counter() - start)
+
+    def collect(self, on_error=None):
+        futures = {}
+        with self._lock:
+            for uri in self.uris:
+                future = self._inflight.get(uri)
+                if future is None or future.done():
+                    future = self._executor.submit(self._collect_host, uri, on_error)
+                    self._inflight[uri] = future
+                futures[future] = uri
+        done, _ = wait(futures, timeout=self.timeout)
+        inventories = []
+        for future, uri in futures.items():
+            if future not in done:
+                inventories.append(HostInventory(uri, self.hostname(uri), None,
+                                                 f"timed out after {self.timeout}s", None))
+                continue
+            try:
+                inventories.append(future.result())
+            except libvirt.libvirtError as e:
+                inventories.append(HostInventory(uri, self.hostname(uri), None, str(e), None))
+        return inventories
+
+    def collect_host_domains(self, uri, uuids, on_error=None):
+        manager = self.managers[uri]
+        domains = []
+        gone = set()
+        with manager.lease() as conn:
+            for uuid in uuids:
+                try:
+                    domains.append(conn.lookupByUUIDString(uuid))
+                except libvirt.libvirtError as e:
+                    if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                        raise
+                    gone.add(row_key(uri, uuid))
+            rows = collect_domain_rows(conn, domains, on_error)
+        return tag_rows(rows, uri, self.hostname(uri)), gone
+
+    def _host_capacity(self, uri, pool_name, reserved_cpus):
+        with self.managers[uri].lease() as conn:
+            return host_capacity(conn, uri, self.hostname(uri), pool_name, reserved_cpus)
+
+    def capacities(self, pool_name=None, reserved_cpus=(), uris=None):
+        futures = {self._executor.submit(self._host_capacity, uri, pool_name, reserved_cpus): uri
+                   for uri in (uris or self.uris)}
+        done, _ = wait(futures, timeout=self.timeout)
+        capacities = []
+        errors = {}
+        for future, uri in futures.items():
+            if future not in done:
+                errors[self.hostname(uri)] = f"timed out after {self.timeout}s"
+                continue
+            try:
+                capacities.append(future.result())
+            except libvirt.libvirtError as e:
+                errors[self.hostname(uri)] = str(e)
+        return capacities, errors
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        for manager in self.managers.values():
+            manager.close()
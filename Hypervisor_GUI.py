@@ -1,18 +1,48 @@
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox, scrolledtext
+from tkinter import ttk, filedialog, messagebox, scrolledtext, simpledialog
 import subprocess
 import os
 import libvirt
 import threading
+import queue
 from datetime import datetime
-import xml.etree.ElementTree as ET
 import logging
 import re
+import sqlite3
 import time
-from slugify import slugify
+import webbrowser
+import numpy as np
+from Hypervisor_Inventory import DomainListModel, DomainIndex, row_key
+from Hypervisor_Balloon import BalloonController, DEFAULT_SETTINGS as BALLOON_SETTINGS, HOLD
+from Hypervisor_Cache import InventoryCache
+from Hypervisor_Console import ConsoleProxy, open_console_socket
+from Hypervisor_Events import DomainEventMonitor, start_event_loop
+from Hypervisor_Fleet import Fleet
+from Hypervisor_Jobs import JobScheduler, RUNNING, FINISHED_STATES
+from Hypervisor_Metrics import MetricsStore, MetricsSampler, derived_metrics, sparkline
+from Hypervisor_Widgets import VirtualTreeview
+from Hypervisor_Log import LogEntry, LogQueue, ActivityLogHandler, json_file_handler
+from Hypervisor_Telemetry import TELEMETRY
+from Hypervisor_Placement import SPREAD, STRATEGIES, parse_cpuset, format_cpuset
+from Hypervisor_Storage import STORAGE_PROFILES, DEFAULT_PROFILE, storage_profile
+from Hypervisor_Manifest import (ManifestError, CREATE, UPDATE, SKIP, load_manifest, validate_manifest, provision,
+                                 report_path, write_report)
+from Hypervisor_Snapshots import COMMIT, PULL, snapshot_tree
+from Hypervisor_Templates import TemplateCatalog, LINKED, FULL, template_from_domain, template_from_image
+from Hypervisor_Controller import (NetworkUnavailable, list_networks, start_domain, restart_domain, shutdown_domain,
+                                   delete_domain, console_address, flatten_domain_disks, create_domain, clone_domain,
+                                   domain_snapshots, create_domain_snapshot, revert_domain_snapshot,
+                                   delete_domain_snapshot, shorten_domain_chains, create_placed_domain,
+                                   set_domain_balloon_bounds, storage_usage, reclaim_domain_space,
+                                   export_domain_archive, import_domain_archive)
+from Hypervisor_Backup import SUFFIX as BACKUP_SUFFIX
+from Hypervisor_Reclaim import DEFAULT_RATE_MB
+from Hypervisor_Volumes import domain_disk_usage
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+AUTO_HOST = "Auto"
+
 class Tooltip:
     def __init__(self, widget, text):
         self.widget = widget
@@ -37,8 +67,11 @@ class Tooltip:
             self.tip_window.destroy()
         self.tip_window = None
 
+ISO_INSTALL = "(Install from ISO)"
+
 class EnhancedHypervisorManagerGUI:
     def __init__(self, root):
+        self.started = time.perf_counter()
         self.root = root
         self.root.title("Narender's Project - Hypervisor ")
         self.root.geometry("1000x700")
@@ -52,10 +85,88 @@ class EnhancedHypervisorManagerGUI:
         self.status_bar.pack(side=tk.BOTTOM, fill=tk.X)
         self.connection_status = tk.StringVar()
         self.connection_status.set("Connecting...")
-        self.conn = None
+        self.fleet = None
+        self.connections = None
+        self.fleet_timeout = 10
+        self.vm_model = DomainListModel()
+        self.vm_index = DomainIndex(self.vm_model)
+        self.domain_events = queue.Queue()
+        self.event_monitors = {}
+        self.job_updates = queue.Queue()
+        self.scheduler = JobScheduler(max_workers=4, on_update=self.job_updates.put)
+        self.metrics = MetricsStore(capacity=120)
+        self.metrics_sampler = MetricsSampler(lambda: self.fleet.managers, self.metrics, interval=2.0)
+        self.metrics_sort = 'cpu'
+        self.balloon = BalloonController(lambda: self.fleet.managers if self.fleet else {}, interval=10.0, dry_run=True)
+        self.templates = TemplateCatalog()
+        self.console_proxy = None
+        self.snapshot_row = None
+        self.console_tokens = {}
+        self.stats_interval = 30000
+        self.cached_rows = 0
+        try:
+            self.cache = InventoryCache()
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"Inventory cache unavailable: {e}")
+            self.cache = None
+        self.cpu_ratio = 4.0
+        self.memory_ratio = 1.0
+        self.reserved_cpus = set()
+        self.log_max_lines = 2000
+        self.log_batch = 500
+        self.log_interval = 50
+        self.log_queue = LogQueue()
+        self.log_handler = ActivityLogHandler(self.log_queue)
+        self.log_file_handler = None
+        self.logger = logging.getLogger("hypervisor")
+        logging.getLogger().addHandler(self.log_handler)
+        start_event_loop()
         self.connect_to_hypervisor()
         self.init_ui()
+        self.load_cached_inventory()
+        self.root.after_idle(self.report_first_frame)
+        self.metrics_sampler.start()
         self.refresh_vm_list()
+        self.root.after(100, self.process_domain_events)
+        self.root.after(200, self.process_job_updates)
+        self.root.after(1000, self.render_metrics)
+        self.root.after(self.log_interval, self.process_log_queue)
+        self.root.after(self.stats_interval, self.save_metrics_snapshot)
+        self.root.after(1000, self.render_diagnostics)
+        self.root.after(2000, self.render_balloon)
+
+    def load_cached_inventory(self):
+        if not self.cache:
+            return
+        try:
+            rows = self.cache.load_domains(self.fleet.uris)
+            hostname, synced = self.cache.last_sync(self.connections.uri)
+        except sqlite3.Error as e:
+            logging.warning(f"Cannot read inventory cache: {e}")
+            return
+        self.cached_rows = len(rows)
+        if rows:
+            self.apply_vm_diff(self.vm_model.diff(rows), persist=False)
+        if synced:
+            self.connection_status.set(
+                f"Cached from {hostname}, {datetime.fromtimestamp(synced).strftime('%Y-%m-%d %H:%M')}")
+
+    def report_first_frame(self):
+        self.root.update_idletasks()
+        elapsed = (time.perf_counter() - self.started) * 1000
+        self.log_to_console(f"First frame in {elapsed:.0f} ms ({self.cached_rows} cached VMs)")
+
+    def save_metrics_snapshot(self):
+        self.root.after(self.stats_interval, self.save_metrics_snapshot)
+        if not self.cache:
+            return
+        keys, rates = self.metrics.latest()
+        if rates is None or not keys:
+            return
+        metrics = derived_metrics(rates)
+        self.cache.store_stats({key: {column: None if np.isnan(values[i]) else float(values[i])
+                                      for column, values in metrics.items()}
+                                for i, key in enumerate(keys)})
 
     def configure_styles(self):
         self.style.configure('TButton', padding=5)
@@ -67,30 +178,110 @@ class EnhancedHypervisorManagerGUI:
         self.style.configure('Error.TLabel', foreground='red')
         self.style.configure('Accent.TButton', foreground='white', background='#305680')
 
-    def connect_to_hypervisor(self):
+    def connect_to_hypervisor(self, uri="qemu:///system", fleet_uris=()):
+        old_fleet = self.fleet
+        self.fleet = Fleet([uri, *fleet_uris], timeout=self.fleet_timeout, on_state=self.set_host_status)
+        self.connections = self.fleet.manager(uri)
+        if old_fleet:
+            old_fleet.close()
+        manager = self.connections
         def connect_thread():
             try:
-                self.conn = libvirt.open("qemu:///system")
-                if self.conn:
-                    self.root.after(0, lambda: self.connection_status.set(f"Connected to {self.conn.getHostname()}"))
-                    logging.info("Connected to hypervisor")
-                else:
-                    self.root.after(0, lambda: self.connection_status.set("Not connected"))
-                    logging.error("Failed to connect to hypervisor")
+                with manager.lease():
+                    pass
+                logging.info(f"Connected to hypervisor at {uri}")
             except libvirt.libvirtError as e:
-                self.root.after(0, lambda: self.connection_status.set("Connection failed"))
                 logging.error(f"Connection error: {e}")
         threading.Thread(target=connect_thread).start()
+        self.start_event_monitors(self.fleet.uris)
+
+    def set_host_status(self, uri, message):
+        if self.connections and uri == self.connections.uri:
+            self.set_connection_status(message)
+        else:
+            logging.info(f"{uri}: {message}")
+
+    def set_connection_status(self, message):
+        self.root.after(0, lambda: self.connection_status.set(message))
+
+    def start_event_monitors(self, uris):
+        for monitor in self.event_monitors.values():
+            monitor.stop()
+        self.event_monitors = {}
+        for uri in uris:
+            self.event_monitors[uri] = DomainEventMonitor(uri, self.domain_events)
+            self.event_monitors[uri].start()
+
+    def process_domain_events(self):
+        changed = {}
+        removed = set()
+        resync = False
+        try:
+            while True:
+                event = self.domain_events.get_nowait()
+                if event.uri not in self.event_monitors:
+                    continue
+                if event.kind == 'connected':
+                    resync = True
+                    continue
+                if event.kind == 'disconnected':
+                    self.log_to_console(f"Domain event stream for {event.uri} disconnected, reconnecting...", error=True)
+                    continue
+                self.fleet.manager(event.uri).xml_cache.invalidate(event.uuid)
+                key = row_key(event.uri, event.uuid)
+                if event.kind == 'undefined':
+                    changed.get(event.uri, set()).discard(event.uuid)
+                    removed.add(key)
+                else:
+                    removed.discard(key)
+                    changed.setdefault(event.uri, set()).add(event.uuid)
+        except queue.Empty:
+            pass
+        if resync:
+            self.refresh_vm_list()
+        elif changed or removed:
+            self.refresh_domains(changed, removed)
+        self.root.after(100, self.process_domain_events)
+
+    def events_connected(self, uri=None):
+        monitors = [self.event_monitors.get(uri)] if uri else list(self.event_monitors.values())
+        return bool(monitors) and all(monitor and monitor.connected for monitor in monitors)
+
+    def refresh_after_action(self):
+        if not self.events_connected():
+            self.refresh_vm_list()
+
+    def domain_description(self, manager, dom):
+        return manager.xml_cache.get(dom, check_state=not self.events_connected(manager.uri))
 
     def init_ui(self):
         notebook = ttk.Notebook(self.root)
         notebook.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        self.notebook = notebook
         vm_list_frame = ttk.Frame(notebook)
         notebook.add(vm_list_frame, text="Virtual Machines")
         self.setup_vm_list_tab(vm_list_frame)
         create_vm_frame = ttk.Frame(notebook)
         notebook.add(create_vm_frame, text="Create VM")
         self.setup_create_vm_tab(create_vm_frame)
+        jobs_frame = ttk.Frame(notebook)
+        notebook.add(jobs_frame, text="Jobs")
+        self.setup_jobs_tab(jobs_frame)
+        self.snapshots_frame = ttk.Frame(notebook)
+        notebook.add(self.snapshots_frame, text="Snapshots")
+        self.setup_snapshots_tab(self.snapshots_frame)
+        self.metrics_frame = ttk.Frame(notebook)
+        notebook.add(self.metrics_frame, text="Metrics")
+        self.setup_metrics_tab(self.metrics_frame)
+        self.memory_frame = ttk.Frame(notebook)
+        notebook.add(self.memory_frame, text="Memory")
+        self.setup_memory_tab(self.memory_frame)
+        self.storage_frame = ttk.Frame(notebook)
+        notebook.add(self.storage_frame, text="Storage")
+        self.setup_storage_tab(self.storage_frame)
+        self.diagnostics_frame = ttk.Frame(notebook)
+        notebook.add(self.diagnostics_frame, text="Diagnostics")
+        self.setup_diagnostics_tab(self.diagnostics_frame)
         settings_frame = ttk.Frame(notebook)
         notebook.add(settings_frame, text="Settings")
         self.setup_settings_tab(settings_frame)
@@ -100,6 +291,7 @@ class EnhancedHypervisorManagerGUI:
         self.console.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
         self.console.config(state=tk.DISABLED)
         self.console.tag_config('error', foreground='red')
+        self.console.tag_config('warning', foreground='#b36b00')
         self.log_to_console(f"Application started at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
     def setup_vm_list_tab(self, parent):
@@ -107,43 +299,691 @@ class EnhancedHypervisorManagerGUI:
         header_frame.pack(fill=tk.X, padx=10, pady=5)
         ttk.Label(header_frame, text="Virtual Machine Manager", style='Title.TLabel').pack(side=tk.LEFT)
         ttk.Label(header_frame, textvariable=self.connection_status, style='Installer.TLabel').pack(side=tk.RIGHT)
+        filter_frame = ttk.Frame(parent)
+        filter_frame.pack(fill=tk.X, padx=10)
+        ttk.Label(filter_frame, text="Filter:").pack(side=tk.LEFT)
+        self.vm_filter_var = tk.StringVar()
+        self.vm_filter_entry = ttk.Entry(filter_frame, textvariable=self.vm_filter_var, width=40)
+        self.vm_filter_entry.pack(side=tk.LEFT, padx=5)
+        self.vm_filter_entry.bind('<KeyRelease>', self.filter_vm_list)
+        self.vm_regex_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(filter_frame, text="Regex", variable=self.vm_regex_var,
+                        command=self.filter_vm_list).pack(side=tk.LEFT, padx=5)
+        self.vm_count_var = tk.StringVar(value="Showing 0 of 0")
+        ttk.Label(filter_frame, textvariable=self.vm_count_var).pack(side=tk.RIGHT)
         list_frame = ttk.Frame(parent)
         list_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
-        columns = ('name', 'status', 'id', 'memory', 'vcpu', 'autostart')
-        self.vm_tree = ttk.Treeview(list_frame, columns=columns, show='headings')
-        self.vm_tree.heading('name', text='VM Name')
-        self.vm_tree.heading('status', text='Status')
-        self.vm_tree.heading('id', text='ID')
-        self.vm_tree.heading('memory', text='Memory (MB)')
-        self.vm_tree.heading('vcpu', text='vCPUs')
-        self.vm_tree.heading('autostart', text='Autostart')
-        self.vm_tree.column('name', width=200, anchor=tk.W)
-        self.vm_tree.column('status', width=100, anchor=tk.CENTER)
-        self.vm_tree.column('id', width=50, anchor=tk.CENTER)
-        self.vm_tree.column('memory', width=100, anchor=tk.CENTER)
-        self.vm_tree.column('vcpu', width=70, anchor=tk.CENTER)
-        self.vm_tree.column('autostart', width=80, anchor=tk.CENTER)
-        scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.vm_tree.yview)
-        self.vm_tree.configure(yscroll=scrollbar.set)
-        self.vm_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.vm_tree.bind('<Double-1>', self.show_vm_details)
+        columns = self.vm_model.fields
+        self.vm_list = VirtualTreeview(list_frame, columns, self.vm_row_values)
+        self.vm_headings = {
+            'name': 'VM Name',
+            'host': 'Host',
+            'status': 'Status',
+            'id': 'ID',
+            'memory': 'Memory (MB)',
+            'vcpu': 'vCPUs',
+            'disk': 'Disk (GB)',
+            'autostart': 'Autostart',
+        }
+        for column, text in self.vm_headings.items():
+            self.vm_list.heading(column, text=text, command=lambda column=column: self.sort_vm_list(column))
+        self.vm_list.column('name', width=200, anchor=tk.W)
+        self.vm_list.column('host', width=120, anchor=tk.W)
+        self.vm_list.column('status', width=100, anchor=tk.CENTER)
+        self.vm_list.column('id', width=50, anchor=tk.CENTER)
+        self.vm_list.column('memory', width=100, anchor=tk.CENTER)
+        self.vm_list.column('vcpu', width=70, anchor=tk.CENTER)
+        self.vm_list.column('disk', width=100, anchor=tk.CENTER)
+        self.vm_list.column('autostart', width=80, anchor=tk.CENTER)
+        self.vm_list.pack(fill=tk.BOTH, expand=True)
+        self.vm_list.bind_rows('<Double-1>', self.show_vm_details)
+        self.update_vm_headings()
         btn_frame = ttk.Frame(parent)
         btn_frame.pack(fill=tk.X, padx=10, pady=10)
         controls = [
             ("Refresh", self.refresh_vm_list, 'Accent.TButton'),
             ("Start VM", self.start_vm),
             ("Restart VM", self.restart_vm),
+            ("Shutdown VM", self.shutdown_vm),
             ("VM Details", self.show_vm_details),
             ("Delete VM", self.delete_vm),
             ("Deploy", self.open_console),
+            ("Make Template", self.make_template),
+            ("Flatten Disk", self.flatten_vm),
+            ("Reclaim Space", self.reclaim_vm),
+            ("Export...", self.export_vm),
+            ("Snapshots", self.show_snapshots),
         ]
         for i, (text, command, *style) in enumerate(controls):
             btn = ttk.Button(btn_frame, text=text, command=command, style=style[0] if style else None)
             btn.pack(side=tk.LEFT, padx=5, pady=2)
-            if i == 2: 
+            if i == 3:
                 ttk.Separator(btn_frame, orient=tk.VERTICAL).pack(side=tk.LEFT, padx=5, fill=tk.Y)
 
+    def setup_jobs_tab(self, parent):
+        header_frame = ttk.Frame(parent)
+        header_frame.pack(fill=tk.X, padx=10, pady=5)
+        ttk.Label(header_frame, text="Jobs", style='Title.TLabel').pack(side=tk.LEFT)
+        self.job_stats_var = tk.StringVar(value="Queued: 0  Running: 0")
+        ttk.Label(header_frame, textvariable=self.job_stats_var).pack(side=tk.RIGHT)
+        list_frame = ttk.Frame(parent)
+        list_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        columns = ('id', 'job', 'state', 'wait', 'runtime', 'result')
+        self.jobs_tree = ttk.Treeview(list_frame, columns=columns, show='headings', selectmode='extended')
+        for column, text, width, anchor in (
+            ('id', '#', 50, tk.CENTER),
+            ('job', 'Job', 220, tk.W),
+            ('state', 'State', 90, tk.CENTER),
+            ('wait', 'Queued (s)', 90, tk.CENTER),
+            ('runtime', 'Run (s)', 80, tk.CENTER),
+            ('result', 'Result', 300, tk.W),
+        ):
+            self.jobs_tree.heading(column, text=text)
+            self.jobs_tree.column(column, width=width, anchor=anchor)
+        scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.jobs_tree.yview)
+        self.jobs_tree.configure(yscroll=scrollbar.set)
+        self.jobs_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        btn_frame = ttk.Frame(parent)
+        btn_frame.pack(fill=tk.X, padx=10, pady=10)
+        ttk.Label(btn_frame, text="Concurrency:").pack(side=tk.LEFT)
+        self.concurrency_var = tk.IntVar(value=self.scheduler.max_workers)
+        concurrency = ttk.Spinbox(btn_frame, from_=1, to=64, width=5, textvariable=self.concurrency_var,
+                                  command=self.change_concurrency)
+        concurrency.pack(side=tk.LEFT, padx=5)
+        concurrency.bind('<Return>', self.change_concurrency)
+        Tooltip(concurrency, "Maximum number of VM operations that run at the same time")
+        ttk.Button(btn_frame, text="Cancel Selected", command=self.cancel_selected_jobs).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Cancel Queued", command=self.cancel_queued_jobs).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Clear Finished", command=self.clear_finished_jobs).pack(side=tk.LEFT, padx=5)
+
+    def setup_snapshots_tab(self, parent):
+        header_frame = ttk.Frame(parent)
+        header_frame.pack(fill=tk.X, padx=10, pady=5)
+        ttk.Label(header_frame, text="Snapshots", style='Title.TLabel').pack(side=tk.LEFT)
+        self.snapshot_vm_var = tk.StringVar(value="Select a VM and click Snapshots")
+        ttk.Label(header_frame, textvariable=self.snapshot_vm_var).pack(side=tk.RIGHT)
+        list_frame = ttk.Frame(parent)
+        list_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        columns = ('created', 'state', 'kind', 'description')
+        self.snapshots_tree = ttk.Treeview(list_frame, columns=columns, selectmode='browse')
+        self.snapshots_tree.heading('#0', text='Name')
+        self.snapshots_tree.column('#0', width=220, anchor=tk.W)
+        for column, text, width, anchor in (
+            ('created', 'Created', 150, tk.CENTER),
+            ('state', 'VM State', 90, tk.CENTER),
+            ('kind', 'Type', 80, tk.CENTER),
+            ('description', 'Description', 300, tk.W),
+        ):
+            self.snapshots_tree.heading(column, text=text)
+            self.snapshots_tree.column(column, width=width, anchor=anchor)
+        self.snapshots_tree.tag_configure('current', font=('Helvetica', 9, 'bold'))
+        scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.snapshots_tree.yview)
+        self.snapshots_tree.configure(yscroll=scrollbar.set)
+        self.snapshots_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        btn_frame = ttk.Frame(parent)
+        btn_frame.pack(fill=tk.X, padx=10, pady=10)
+        ttk.Button(btn_frame, text="Refresh", command=self.load_snapshots).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Create...", command=self.create_snapshot).pack(side=tk.LEFT, padx=5)
+        self.snapshot_disk_only_var = tk.BooleanVar(value=True)
+        disk_only = ttk.Checkbutton(btn_frame, text="Disk-only (external)", variable=self.snapshot_disk_only_var)
+        disk_only.pack(side=tk.LEFT, padx=5)
+        Tooltip(disk_only, "External overlays are instant; the guest is quiesced when its agent is connected")
+        ttk.Button(btn_frame, text="Revert", command=self.revert_snapshot).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Delete", command=self.delete_snapshot).pack(side=tk.LEFT, padx=5)
+        ttk.Separator(btn_frame, orient=tk.VERTICAL).pack(side=tk.LEFT, padx=5, fill=tk.Y)
+        ttk.Button(btn_frame, text="Commit Chain", command=lambda: self.shorten_chains(COMMIT)).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Pull Chain", command=lambda: self.shorten_chains(PULL)).pack(side=tk.LEFT, padx=5)
+        ttk.Label(btn_frame, text="Bandwidth (MiB/s):").pack(side=tk.LEFT, padx=(10, 0))
+        self.block_bandwidth_var = tk.IntVar(value=0)
+        bandwidth = ttk.Spinbox(btn_frame, from_=0, to=10000, increment=10, width=6,
+                                textvariable=self.block_bandwidth_var)
+        bandwidth.pack(side=tk.LEFT, padx=5)
+        Tooltip(bandwidth, "Limit for block commit/pull jobs, 0 for unlimited")
+
+    def show_snapshots(self):
+        row = self.vm_model.get(self.vm_list.focus())
+        if not row:
+            messagebox.showwarning("No Selection", "Please select a VM from the list.")
+            return
+        self.snapshot_row = row
+        self.notebook.select(self.snapshots_frame)
+        self.load_snapshots()
+
+    def load_snapshots(self):
+        row = self.snapshot_row
+        if not row or not self.ensure_connection():
+            return
+        self.snapshot_vm_var.set(f"{row['name']} ({row['host'] or row['uri']})")
+        manager = self.fleet.manager(row['uri'])
+        def load_thread():
+            try:
+                snapshots = domain_snapshots(manager, row['uuid'])
+            except libvirt.libvirtError as e:
+                self.log_to_console(f"Error listing snapshots of {row['name']}: {e}", error=True)
+                return
+            self.root.after(0, lambda: self.render_snapshots(row, snapshots))
+        threading.Thread(target=load_thread, daemon=True).start()
+
+    def render_snapshots(self, row, snapshots):
+        if not self.snapshot_row or row['key'] != self.snapshot_row['key']:
+            return
+        self.snapshots_tree.delete(*self.snapshots_tree.get_children())
+        children = snapshot_tree(snapshots)
+        pending = [('', snapshot) for snapshot in children.get(None, [])]
+        while pending:
+            parent, snapshot = pending.pop(0)
+            self.snapshots_tree.insert(parent, tk.END, iid=snapshot['name'], open=True,
+                                       text=f"{snapshot['name']}{' (current)' if snapshot['current'] else ''}",
+                                       tags=('current',) if snapshot['current'] else (),
+                                       values=(datetime.fromtimestamp(snapshot['created']).strftime('%Y-%m-%d %H:%M:%S'),
+                                               snapshot['state'], snapshot['kind'], snapshot['description']))
+            pending += [(snapshot['name'], child) for child in children.get(snapshot['name'], [])]
+
+    def selected_snapshot(self):
+        selection = self.snapshots_tree.selection()
+        if not self.snapshot_row or not selection:
+            messagebox.showwarning("No Selection", "Please select a snapshot.")
+            return None
+        return selection[0]
+
+    def submit_snapshot_job(self, action, func):
+        row = self.snapshot_row
+        manager = self.fleet.manager(row['uri'])
+        def run(job):
+            try:
+                return func(job, manager, row)
+            finally:
+                self.root.after(0, self.load_snapshots)
+        self.scheduler.submit(row['key'], f"{action} {row['name']}", run)
+        self.log_to_console(f"Queued {action.lower()} for {row['name']}")
+
+    def create_snapshot(self):
+        if not self.snapshot_row or not self.ensure_connection():
+            return
+        name = simpledialog.askstring("Create Snapshot", "Snapshot name:", parent=self.root,
+                                      initialvalue=datetime.now().strftime('snap-%Y%m%d-%H%M%S'))
+        if not name:
+            return
+        text = simpledialog.askstring("Create Snapshot", "Description (optional):", parent=self.root) or ""
+        disk_only = self.snapshot_disk_only_var.get()
+        check_state = not self.events_connected(self.snapshot_row['uri'])
+        self.submit_snapshot_job("Snapshot", lambda job, manager, row: create_domain_snapshot(
+            manager, row['uuid'], name.strip(), text, disk_only, check_state=check_state))
+
+    def revert_snapshot(self):
+        name = self.selected_snapshot()
+        if not name or not self.ensure_connection():
+            return
+        if not messagebox.askyesno("Revert Snapshot",
+                                   f"Revert {self.snapshot_row['name']} to '{name}'? Changes since then are lost."):
+            return
+        self.submit_snapshot_job("Revert", lambda job, manager, row: revert_domain_snapshot(manager, row['uuid'], name))
+
+    def delete_snapshot(self):
+        name = self.selected_snapshot()
+        if not name or not self.ensure_connection():
+            return
+        children = bool(self.snapshots_tree.get_children(name))
+        if children:
+            answer = messagebox.askyesnocancel("Delete Snapshot", f"Also delete the snapshots derived from '{name}'?")
+            if answer is None:
+                return
+            children = answer
+        elif not messagebox.askyesno("Delete Snapshot", f"Delete snapshot '{name}'?"):
+            return
+        self.submit_snapshot_job("Delete snapshot", lambda job, manager, row: delete_domain_snapshot(
+            manager, row['uuid'], name, children))
+
+    def shorten_chains(self, mode):
+        if not self.snapshot_row or not self.ensure_connection():
+            return
+        try:
+            bandwidth = max(0, self.block_bandwidth_var.get())
+        except tk.TclError:
+            bandwidth = 0
+        protected = self.templates.base_paths()
+        def run(job, manager, row):
+            shortened = shorten_domain_chains(manager, row['uuid'], mode, bandwidth, protected,
+                                              on_progress=lambda percent: setattr(job, 'progress', percent),
+                                              check_cancelled=job.check_cancelled)
+            return f"Shortened {shortened} disk chain(s)" if shortened else "No backing chains to shorten"
+        self.submit_snapshot_job(f"Block {mode}", run)
+
+    def change_concurrency(self, event=None):
+        try:
+            self.scheduler.set_max_workers(self.concurrency_var.get())
+        except (tk.TclError, ValueError):
+            self.concurrency_var.set(self.scheduler.max_workers)
+
+    def cancel_selected_jobs(self):
+        cancelled = sum(1 for item in self.jobs_tree.selection() if self.scheduler.cancel(int(item)))
+        self.log_to_console(f"Cancelled {cancelled} queued job(s)")
+
+    def cancel_queued_jobs(self):
+        self.log_to_console(f"Cancelled {self.scheduler.cancel_queued()} queued job(s)")
+
+    def clear_finished_jobs(self):
+        for job_id in self.scheduler.clear_finished():
+            if self.jobs_tree.exists(str(job_id)):
+                self.jobs_tree.delete(str(job_id))
+
+    def process_job_updates(self):
+        updated = {}
+        try:
+            while True:
+                job = self.job_updates.get_nowait()
+                updated[job.id] = job
+        except queue.Empty:
+            pass
+        for job in self.scheduler.jobs():
+            if job.state == RUNNING:
+                updated[job.id] = job
+        for job in updated.values():
+            self.update_job_row(job)
+        stats = self.scheduler.stats()
+        self.job_stats_var.set(f"Queued: {stats['queued']}  Running: {stats['running']}  Workers: {stats['max_workers']}")
+        if any(job.state in FINISHED_STATES for job in updated.values()) and not self.events_connected():
+            self.refresh_vm_list()
+        self.root.after(200, self.process_job_updates)
+
+    def update_job_row(self, job):
+        result = job.message
+        if job.state == RUNNING and job.progress is not None:
+            result = f"{job.progress:.0f}% {job.message}".strip()
+        values = (
+            job.id,
+            job.label,
+            job.state,
+            f"{job.wait_time:.2f}",
+            "" if job.run_time is None else f"{job.run_time:.2f}",
+            result,
+        )
+        iid = str(job.id)
+        if self.jobs_tree.exists(iid):
+            self.jobs_tree.item(iid, values=values)
+        else:
+            self.jobs_tree.insert('', tk.END, iid=iid, values=values)
+
+    def setup_metrics_tab(self, parent):
+        header_frame = ttk.Frame(parent)
+        header_frame.pack(fill=tk.X, padx=10, pady=5)
+        ttk.Label(header_frame, text="Performance Metrics", style='Title.TLabel').pack(side=tk.LEFT)
+        self.metrics_top_var = tk.IntVar(value=20)
+        ttk.Spinbox(header_frame, from_=5, to=500, width=5, textvariable=self.metrics_top_var).pack(side=tk.RIGHT, padx=5)
+        ttk.Label(header_frame, text="Top N:").pack(side=tk.RIGHT)
+        self.metrics_interval_var = tk.DoubleVar(value=self.metrics_sampler.interval)
+        interval = ttk.Spinbox(header_frame, from_=0.5, to=60, increment=0.5, width=5,
+                               textvariable=self.metrics_interval_var, command=self.change_metrics_interval)
+        interval.pack(side=tk.RIGHT, padx=5)
+        interval.bind('<Return>', self.change_metrics_interval)
+        ttk.Label(header_frame, text="Interval (s):").pack(side=tk.RIGHT)
+        list_frame = ttk.Frame(parent)
+        list_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        columns = ('name', 'host', 'cpu', 'rd', 'wr', 'rx', 'tx', 'mem', 'trend')
+        self.metrics_tree = ttk.Treeview(list_frame, columns=columns, show='headings')
+        for column, text, width, anchor in (
+            ('name', 'VM Name', 160, tk.W),
+            ('host', 'Host', 110, tk.W),
+            ('cpu', 'CPU %', 70, tk.CENTER),
+            ('rd', 'Disk Read MB/s', 105, tk.CENTER),
+            ('wr', 'Disk Write MB/s', 105, tk.CENTER),
+            ('rx', 'Net RX MB/s', 90, tk.CENTER),
+            ('tx', 'Net TX MB/s', 90, tk.CENTER),
+            ('mem', 'Memory Used (MB)', 120, tk.CENTER),
+            ('trend', 'CPU Trend', 200, tk.W),
+        ):
+            self.metrics_tree.heading(column, text=text)
+            self.metrics_tree.column(column, width=width, anchor=anchor)
+            if column not in ('name', 'host', 'trend'):
+                self.metrics_tree.heading(column, command=lambda column=column: self.sort_metrics(column))
+        scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.metrics_tree.yview)
+        self.metrics_tree.configure(yscroll=scrollbar.set)
+        self.metrics_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+    def setup_memory_tab(self, parent):
+        header_frame = ttk.Frame(parent)
+        header_frame.pack(fill=tk.X, padx=10, pady=5)
+        ttk.Label(header_frame, text="Memory Balloon", style='Title.TLabel').pack(side=tk.LEFT)
+        self.balloon_enabled_var = tk.BooleanVar(value=False)
+        self.balloon_dry_run_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(header_frame, text="Enable controller", variable=self.balloon_enabled_var,
+                        command=self.toggle_balloon).pack(side=tk.LEFT, padx=10)
+        dry_run = ttk.Checkbutton(header_frame, text="Dry run", variable=self.balloon_dry_run_var,
+                                  command=self.toggle_balloon)
+        dry_run.pack(side=tk.LEFT)
+        Tooltip(dry_run, "Log the balloon changes the controller would make without resizing any VM")
+        self.balloon_pressure_var = tk.StringVar(value="Host pressure: -")
+        ttk.Label(header_frame, textvariable=self.balloon_pressure_var).pack(side=tk.RIGHT)
+        settings_frame = ttk.Frame(parent)
+        settings_frame.pack(fill=tk.X, padx=10, pady=5)
+        self.balloon_setting_vars = {}
+        for key, text, tip in (
+            ('low_free', "Grow below free %:", "Grow a VM when less than this share of its memory is free"),
+            ('high_free', "Shrink above free %:", "Shrink a VM when more than this share of its memory is free"),
+            ('reclaim_pressure', "Reclaim at host %:", "Above this host memory use, shrink VMs down to a tighter target"),
+            ('min_ratio', "Floor %:", "Never shrink a VM below this share of its maximum memory unless it has its own bounds"),
+        ):
+            ttk.Label(settings_frame, text=text).pack(side=tk.LEFT, padx=(10, 0))
+            var = tk.IntVar(value=round(BALLOON_SETTINGS[key] * 100))
+            spinbox = ttk.Spinbox(settings_frame, from_=1, to=99, width=4, textvariable=var)
+            spinbox.pack(side=tk.LEFT, padx=5)
+            Tooltip(spinbox, tip)
+            self.balloon_setting_vars[key] = var
+        ttk.Button(settings_frame, text="Apply", command=self.apply_balloon_settings).pack(side=tk.LEFT, padx=10)
+        bounds_btn = ttk.Button(settings_frame, text="Set VM Bounds...", command=self.set_balloon_bounds)
+        bounds_btn.pack(side=tk.RIGHT, padx=5)
+        Tooltip(bounds_btn, "Set the minimum and maximum balloon size of the VM selected in the VM list")
+        self.balloon_changes_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(settings_frame, text="Changes only", variable=self.balloon_changes_var,
+                        command=lambda: self.render_balloon(reschedule=False)).pack(side=tk.RIGHT, padx=10)
+        list_frame = ttk.Frame(parent)
+        list_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        columns = ('time', 'host', 'name', 'action', 'current', 'target', 'reason')
+        self.balloon_tree = ttk.Treeview(list_frame, columns=columns, show='headings')
+        for column, text, width, anchor in (
+            ('time', 'Time', 80, tk.W),
+            ('host', 'Host', 110, tk.W),
+            ('name', 'VM Name', 160, tk.W),
+            ('action', 'Action', 80, tk.CENTER),
+            ('current', 'Current (MB)', 95, tk.CENTER),
+            ('target', 'Target (MB)', 95, tk.CENTER),
+            ('reason', 'Reason', 360, tk.W),
+        ):
+            self.balloon_tree.heading(column, text=text)
+            self.balloon_tree.column(column, width=width, anchor=anchor)
+        scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.balloon_tree.yview)
+        self.balloon_tree.configure(yscroll=scrollbar.set)
+        self.balloon_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+    def toggle_balloon(self):
+        self.balloon.dry_run = self.balloon_dry_run_var.get()
+        if self.balloon_enabled_var.get():
+            self.balloon.start()
+            self.log_to_console(f"Balloon controller running{' (dry run)' if self.balloon.dry_run else ''}")
+        elif self.balloon.running:
+            self.balloon.stop()
+            self.log_to_console("Balloon controller stopped")
+
+    def apply_balloon_settings(self):
+        try:
+            settings = {key: var.get() / 100 for key, var in self.balloon_setting_vars.items()}
+        except tk.TclError:
+            messagebox.showerror("Error", "Balloon thresholds must be whole percentages")
+            return
+        if not settings['low_free'] < settings['high_free']:
+            messagebox.showerror("Error", "The shrink threshold must be above the grow threshold")
+            return
+        settings['target_free'] = (settings['low_free'] + settings['high_free']) / 2
+        self.balloon.settings.update(settings)
+        self.log_to_console(f"Balloon: grow below {settings['low_free']:.0%} free, shrink above "
+                            f"{settings['high_free']:.0%}, reclaim at {settings['reclaim_pressure']:.0%} host memory")
+
+    def set_balloon_bounds(self):
+        if not self.ensure_connection():
+            return
+        row = self.vm_model.get(self.vm_list.focus())
+        if not row:
+            messagebox.showwarning("No Selection", "Please select a VM from the list.")
+            return
+        min_mb = simpledialog.askinteger("Balloon Bounds", f"Minimum memory for {row['name']} in MB (blank for default):",
+                                         parent=self.root, minvalue=128)
+        max_mb = simpledialog.askinteger("Balloon Bounds", f"Maximum memory for {row['name']} in MB (blank for default):",
+                                         parent=self.root, minvalue=min_mb or 128)
+        self.submit_vm_jobs("Balloon bounds", [row], lambda job, manager, row: set_domain_balloon_bounds(
+            manager, row['uuid'], min_mb, max_mb))
+
+    def render_balloon(self, reschedule=True):
+        if reschedule:
+            self.root.after(2000, self.render_balloon)
+        if self.notebook.select() != str(self.memory_frame):
+            return
+        pressure = self.balloon.pressure
+        if pressure:
+            self.balloon_pressure_var.set("Host pressure: " + "  ".join(
+                f"{self.fleet.hostname(uri) if self.fleet else uri} {value:.0%}" for uri, value in pressure.items()))
+        decisions = self.balloon.recent(changes_only=self.balloon_changes_var.get())
+        self.balloon_tree.delete(*self.balloon_tree.get_children())
+        for decision in reversed(decisions):
+            action = decision.action if decision.applied or decision.action == HOLD else f"{decision.action} (dry)"
+            self.balloon_tree.insert('', tk.END, values=(
+                datetime.fromtimestamp(decision.time).strftime('%H:%M:%S'),
+                decision.host,
+                decision.name,
+                action,
+                decision.current // 1024 if decision.current else "-",
+                decision.target // 1024 if decision.target else "-",
+                decision.reason,
+            ))
+
+    def setup_storage_tab(self, parent):
+        header_frame = ttk.Frame(parent)
+        header_frame.pack(fill=tk.X, padx=10, pady=5)
+        ttk.Label(header_frame, text="Storage Pools", style='Title.TLabel').pack(side=tk.LEFT)
+        ttk.Button(header_frame, text="Refresh", command=self.load_storage).pack(side=tk.LEFT, padx=10)
+        self.storage_summary_var = tk.StringVar(value="")
+        ttk.Label(header_frame, textvariable=self.storage_summary_var).pack(side=tk.LEFT, padx=10)
+        self.reclaim_rate_var = tk.IntVar(value=DEFAULT_RATE_MB)
+        rate = ttk.Spinbox(header_frame, from_=1, to=10000, width=6, textvariable=self.reclaim_rate_var)
+        rate.pack(side=tk.RIGHT, padx=5)
+        Tooltip(rate, "Throughput limit for Reclaim Space on shut-off VMs, so sparsifying does not starve other VMs")
+        ttk.Label(header_frame, text="Sparsify MB/s:").pack(side=tk.RIGHT)
+        list_frame = ttk.Frame(parent)
+        list_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        columns = ('capacity', 'allocation', 'physical', 'owner', 'path')
+        self.storage_tree = ttk.Treeview(list_frame, columns=columns, show='tree headings')
+        self.storage_tree.heading('#0', text='Name')
+        self.storage_tree.column('#0', width=220, anchor=tk.W)
+        for column, text, width, anchor in (
+            ('capacity', 'Capacity', 90, tk.CENTER),
+            ('allocation', 'Allocated', 90, tk.CENTER),
+            ('physical', 'Physical / Free', 110, tk.CENTER),
+            ('owner', 'VM', 150, tk.W),
+            ('path', 'Path', 320, tk.W),
+        ):
+            self.storage_tree.heading(column, text=text)
+            self.storage_tree.column(column, width=width, anchor=anchor)
+        self.storage_tree.tag_configure('orphan', foreground='#b36b00')
+        self.storage_tree.tag_configure('inactive', foreground='gray')
+        scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.storage_tree.yview)
+        self.storage_tree.configure(yscroll=scrollbar.set)
+        self.storage_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+    def load_storage(self):
+        if not self.ensure_connection():
+            return
+        manager = self.fleet.manager(self.connections.uri)
+        def load_thread():
+            try:
+                pools = storage_usage(manager)
+            except libvirt.libvirtError as e:
+                self.log_to_console(f"Error listing storage pools: {e}", error=True)
+                return
+            self.root.after(0, lambda: self.render_storage(pools))
+        threading.Thread(target=load_thread, daemon=True).start()
+
+    def render_storage(self, pools):
+        self.storage_tree.delete(*self.storage_tree.get_children())
+        orphans = 0
+        for pool in pools:
+            parent = self.storage_tree.insert('', tk.END, open=True, text=pool['name'],
+                                              tags=() if pool['active'] else ('inactive',),
+                                              values=(self.format_bytes(pool['capacity']),
+                                                      self.format_bytes(pool['allocation']),
+                                                      self.format_bytes(pool['available']), "",
+                                                      "" if pool['active'] else "inactive"))
+            for volume in pool['volumes']:
+                orphan = not volume['owner'] and not volume['name'].lower().endswith('.iso')
+                orphans += orphan
+                self.storage_tree.insert(parent, tk.END, text=volume['name'], tags=('orphan',) if orphan else (),
+                                         values=(self.format_bytes(volume['capacity']),
+                                                 self.format_bytes(volume['allocation']),
+                                                 self.format_bytes(volume['physical']),
+                                                 volume['owner'] or "-", volume['path']))
+        self.storage_summary_var.set(f"{orphans} volume(s) not attached to any VM" if orphans else "")
+
+    def setup_diagnostics_tab(self, parent):
+        header_frame = ttk.Frame(parent)
+        header_frame.pack(fill=tk.X, padx=10, pady=5)
+        ttk.Label(header_frame, text="Diagnostics", style='Title.TLabel').pack(side=tk.LEFT)
+        self.instrumentation_var = tk.BooleanVar(value=TELEMETRY.enabled)
+        self.tracing_var = tk.BooleanVar(value=TELEMETRY.tracing)
+        ttk.Checkbutton(header_frame, text="Instrument calls", variable=self.instrumentation_var,
+                        command=self.toggle_instrumentation).pack(side=tk.LEFT, padx=10)
+        ttk.Checkbutton(header_frame, text="Trace spans", variable=self.tracing_var,
+                        command=self.toggle_instrumentation).pack(side=tk.LEFT)
+        ttk.Button(header_frame, text="Reset", command=self.reset_diagnostics).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(header_frame, text="Export...", command=self.export_diagnostics).pack(side=tk.RIGHT, padx=5)
+        self.metrics_port_entry = ttk.Entry(header_frame, width=6)
+        self.metrics_port_entry.insert(0, "9177")
+        self.metrics_serve_btn = ttk.Button(header_frame, text="Serve", command=self.toggle_metrics_server)
+        self.metrics_serve_btn.pack(side=tk.RIGHT, padx=5)
+        self.metrics_port_entry.pack(side=tk.RIGHT)
+        ttk.Label(header_frame, text="HTTP port:").pack(side=tk.RIGHT)
+        Tooltip(self.metrics_port_entry, "Serve Prometheus metrics at http://127.0.0.1:<port>/metrics")
+        panes = ttk.PanedWindow(parent, orient=tk.VERTICAL)
+        panes.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        columns = ('operation', 'count', 'errors', 'in_flight', 'mean', 'p50', 'p95', 'max', 'total')
+        self.diagnostics_tree = ttk.Treeview(panes, columns=columns, show='headings', height=10)
+        for column, text, width, anchor in (
+            ('operation', 'Operation', 220, tk.W),
+            ('count', 'Calls', 70, tk.CENTER),
+            ('errors', 'Errors', 60, tk.CENTER),
+            ('in_flight', 'In Flight', 70, tk.CENTER),
+            ('mean', 'Mean ms', 80, tk.CENTER),
+            ('p50', 'p50 ms', 80, tk.CENTER),
+            ('p95', 'p95 ms', 80, tk.CENTER),
+            ('max', 'Max ms', 80, tk.CENTER),
+            ('total', 'Total s', 80, tk.CENTER),
+        ):
+            self.diagnostics_tree.heading(column, text=text)
+            self.diagnostics_tree.column(column, width=width, anchor=anchor)
+        panes.add(self.diagnostics_tree, weight=2)
+        span_columns = ('time', 'job', 'operation', 'duration', 'error')
+        self.spans_tree = ttk.Treeview(panes, columns=span_columns, show='headings', height=6)
+        for column, text, width, anchor in (
+            ('time', 'Time', 90, tk.W),
+            ('job', 'Job', 60, tk.CENTER),
+            ('operation', 'Operation', 260, tk.W),
+            ('duration', 'Duration ms', 100, tk.CENTER),
+            ('error', 'Error', 200, tk.W),
+        ):
+            self.spans_tree.heading(column, text=text)
+            self.spans_tree.column(column, width=width, anchor=anchor)
+        panes.add(self.spans_tree, weight=1)
+
+    def toggle_instrumentation(self):
+        if self.instrumentation_var.get():
+            TELEMETRY.enable(tracing=self.tracing_var.get())
+            self.log_to_console(f"Instrumentation enabled{' with tracing' if TELEMETRY.tracing else ''}")
+        else:
+            TELEMETRY.disable()
+            self.tracing_var.set(False)
+            self.log_to_console("Instrumentation disabled")
+
+    def reset_diagnostics(self):
+        TELEMETRY.reset()
+        self.render_diagnostics(reschedule=False)
+
+    def export_diagnostics(self):
+        path = filedialog.asksaveasfilename(title="Export Prometheus metrics", defaultextension=".prom",
+                                            filetypes=(("Prometheus text", "*.prom"), ("All files", "*.*")))
+        if not path:
+            return
+        try:
+            TELEMETRY.write_prometheus(path)
+        except OSError as e:
+            self.log_to_console(f"Cannot export metrics to {path}: {e}", error=True)
+            return
+        self.log_to_console(f"Metrics exported to {path}")
+
+    def toggle_metrics_server(self):
+        if self.metrics_serve_btn['text'] == "Stop":
+            TELEMETRY.stop_serving()
+            self.metrics_serve_btn.config(text="Serve")
+            self.log_to_console("Metrics endpoint stopped")
+            return
+        try:
+            host, port = TELEMETRY.serve(int(self.metrics_port_entry.get()))
+        except (ValueError, OSError) as e:
+            self.log_to_console(f"Cannot serve metrics: {e}", error=True)
+            return
+        self.metrics_serve_btn.config(text="Stop")
+        self.log_to_console(f"Serving metrics at http://{host}:{port}/metrics")
+
+    def render_diagnostics(self, reschedule=True):
+        if reschedule:
+            self.root.after(1000, self.render_diagnostics)
+        if self.notebook.select() != str(self.diagnostics_frame):
+            return
+        rows = sorted(TELEMETRY.snapshot(), key=lambda row: -row['total'])
+        self.diagnostics_tree.delete(*self.diagnostics_tree.get_children())
+        for row in rows:
+            self.diagnostics_tree.insert('', tk.END, values=(
+                row['operation'], row['count'], row['errors'], row['in_flight'],
+                *(f"{row[column] * 1000:.2f}" for column in ('mean', 'p50', 'p95', 'max')),
+                f"{row['total']:.2f}"))
+        self.spans_tree.delete(*self.spans_tree.get_children())
+        for span in reversed(TELEMETRY.recent_spans()):
+            self.spans_tree.insert('', tk.END, values=(
+                datetime.fromtimestamp(span.started).strftime('%H:%M:%S.%f')[:-3], span.job or "",
+                span.operation, f"{span.duration * 1000:.2f}", span.error or ""))
+
+    def change_metrics_interval(self, event=None):
+        try:
+            interval = float(self.metrics_interval_var.get())
+            if interval <= 0:
+                raise ValueError
+        except (tk.TclError, ValueError):
+            self.metrics_interval_var.set(self.metrics_sampler.interval)
+            return
+        self.metrics_sampler.interval = interval
+
+    def sort_metrics(self, column):
+        self.metrics_sort = column
+        self.render_metrics(reschedule=False)
+
+    def render_metrics(self, reschedule=True):
+        if reschedule:
+            self.root.after(int(self.metrics_sampler.interval * 1000), self.render_metrics)
+        if self.notebook.select() != str(self.metrics_frame):
+            return
+        keys, rates = self.metrics.latest()
+        if rates is None or not keys:
+            return
+        metrics = derived_metrics(rates)
+        try:
+            top_n = max(1, int(self.metrics_top_var.get()))
+        except (tk.TclError, ValueError):
+            top_n = 20
+        ranking = np.nan_to_num(metrics[self.metrics_sort], nan=-np.inf)
+        if top_n < len(ranking):
+            candidates = np.argpartition(-ranking, top_n)[:top_n]
+        else:
+            candidates = np.arange(len(ranking))
+        order = candidates[np.argsort(-ranking[candidates])]
+        for rank, i in enumerate(order):
+            key = keys[i]
+            row = self.vm_model.get(key)
+            values = [
+                self.metrics.names.get(key, key),
+                row['host'] if row else "",
+                *("-" if np.isnan(metrics[column][i]) else f"{metrics[column][i]:.1f}"
+                  for column in ('cpu', 'rd', 'wr', 'rx', 'tx', 'mem')),
+                sparkline(self.metrics.series(key, 'cpu_time')[-40:]),
+            ]
+            iid = f"top{rank}"
+            if self.metrics_tree.exists(iid):
+                self.metrics_tree.item(iid, values=values)
+            else:
+                self.metrics_tree.insert('', tk.END, iid=iid, values=values)
+        for rank in range(len(order), len(self.metrics_tree.get_children())):
+            self.metrics_tree.delete(f"top{rank}")
+
     def setup_create_vm_tab(self, parent):
         form_frame = ttk.Frame(parent)
         form_frame.pack(fill=tk.BOTH, expand=True, padx=20, pady=20)
@@ -184,39 +1024,234 @@ class EnhancedHypervisorManagerGUI:
             entry.grid(row=0, column=i*2+1, sticky=tk.W, pady=5, padx=5)
             setattr(self, attr, entry)
             Tooltip(entry, f"Enter {label.split(':')[0].lower()} (must be positive integer)")
+        ttk.Label(resource_frame, text="Storage profile:").grid(row=1, column=0, sticky=tk.W, pady=5, padx=5)
+        self.storage_profile_combo = ttk.Combobox(resource_frame, state="readonly", width=12,
+                                                  values=list(STORAGE_PROFILES))
+        self.storage_profile_combo.set(DEFAULT_PROFILE)
+        self.storage_profile_combo.grid(row=1, column=1, columnspan=2, sticky=tk.W, pady=5, padx=5)
+        self.storage_profile_var = tk.StringVar(value=STORAGE_PROFILES[DEFAULT_PROFILE]['description'])
+        ttk.Label(resource_frame, textvariable=self.storage_profile_var).grid(row=1, column=3, columnspan=3, sticky=tk.W, pady=5, padx=5)
+        self.storage_profile_combo.bind('<<ComboboxSelected>>', lambda event: self.storage_profile_var.set(
+            storage_profile(self.storage_profile_combo.get())['description']))
+        self.numa_var = tk.BooleanVar(value=False)
+        numa_check = ttk.Checkbutton(resource_frame, text="NUMA placement", variable=self.numa_var)
+        numa_check.grid(row=2, column=0, columnspan=2, sticky=tk.W, pady=5, padx=5)
+        Tooltip(numa_check, "Pin vCPUs and memory to the least loaded NUMA node and reject VMs the host cannot fit")
+        self.hugepages_var = tk.BooleanVar(value=False)
+        hugepages_check = ttk.Checkbutton(resource_frame, text="Hugepages (2 MB)", variable=self.hugepages_var)
+        hugepages_check.grid(row=2, column=2, columnspan=2, sticky=tk.W, pady=5, padx=5)
+        Tooltip(hugepages_check, "Back guest memory with preallocated 2 MB hugepages (requires NUMA placement)")
+        ttk.Label(resource_frame, text="Host:").grid(row=3, column=0, sticky=tk.W, pady=5, padx=5)
+        self.host_combo = ttk.Combobox(resource_frame, state="readonly", width=28, values=[AUTO_HOST],
+                                       postcommand=self.update_host_choices)
+        self.host_combo.set(AUTO_HOST)
+        self.host_combo.grid(row=3, column=1, columnspan=2, sticky=tk.W, pady=5, padx=5)
+        Tooltip(self.host_combo, "Auto scores every connected host and creates the VM on the best one")
+        ttk.Label(resource_frame, text="Strategy:").grid(row=3, column=3, sticky=tk.W, pady=5, padx=5)
+        self.strategy_combo = ttk.Combobox(resource_frame, state="readonly", width=10, values=list(STRATEGIES))
+        self.strategy_combo.set(SPREAD)
+        self.strategy_combo.grid(row=3, column=4, sticky=tk.W, pady=5, padx=5)
+        Tooltip(self.strategy_combo, "spread: most headroom; pack: fill busy hosts first; numa-fit: tightest single NUMA node")
         network_frame = ttk.LabelFrame(form_frame, text="Network Settings")
         network_frame.grid(row=5, column=0, columnspan=2, sticky=tk.W+tk.E, pady=10, padx=5)
         ttk.Label(network_frame, text="Network:").grid(row=0, column=0, sticky=tk.W, pady=5, padx=5)
         self.network_combo = ttk.Combobox(network_frame, state="readonly")
         self.load_available_networks()
         Tooltip(self.network_combo, "Select network type for the VM")
+        template_frame = ttk.LabelFrame(form_frame, text="Template")
+        template_frame.grid(row=6, column=0, columnspan=2, sticky=tk.W+tk.E, pady=10, padx=5)
+        ttk.Label(template_frame, text="Source:").grid(row=0, column=0, sticky=tk.W, pady=5, padx=5)
+        self.template_combo = ttk.Combobox(template_frame, state="readonly", width=30)
+        self.template_combo.grid(row=0, column=1, sticky=tk.W, pady=5, padx=5)
+        self.template_combo.bind('<<ComboboxSelected>>', self.select_template)
+        Tooltip(self.template_combo, "Install from the ISOs above, or clone a golden image in seconds")
+        ttk.Label(template_frame, text="Clone:").grid(row=0, column=2, sticky=tk.W, pady=5, padx=5)
+        self.clone_mode_combo = ttk.Combobox(template_frame, state="readonly", width=14,
+                                             values=["Linked clone", "Full clone"])
+        self.clone_mode_combo.set("Linked clone")
+        self.clone_mode_combo.grid(row=0, column=3, sticky=tk.W, pady=5, padx=5)
+        Tooltip(self.clone_mode_combo, "Linked clones are qcow2 overlays on the template; full clones copy the whole image")
+        ttk.Button(template_frame, text="Add Image...", command=self.add_image_template).grid(row=0, column=4, padx=5)
+        ttk.Button(template_frame, text="Remove", command=self.remove_template).grid(row=0, column=5, padx=5)
+        self.load_templates()
         create_btn_frame = ttk.Frame(form_frame)
-        create_btn_frame.grid(row=6, column=0, columnspan=2, pady=20)
+        create_btn_frame.grid(row=7, column=0, columnspan=2, pady=20)
         self.create_btn = ttk.Button(create_btn_frame, text="Create VM", command=self.create_vm, style='Accent.TButton')
-        self.create_btn.pack(pady=10, ipadx=20, ipady=5)
+        self.create_btn.pack(side=tk.LEFT, padx=5, pady=10, ipadx=20, ipady=5)
+        manifest_btn = ttk.Button(create_btn_frame, text="Load Manifest...", command=self.load_manifest)
+        manifest_btn.pack(side=tk.LEFT, padx=5, pady=10, ipady=5)
+        Tooltip(manifest_btn, "Create many VMs in parallel from a JSON or YAML manifest")
+        import_btn = ttk.Button(create_btn_frame, text="Import VM...", command=self.import_vm)
+        import_btn.pack(side=tk.LEFT, padx=5, pady=10, ipady=5)
+        Tooltip(import_btn, f"Define a VM and restore its disks from an exported {BACKUP_SUFFIX} archive")
         self.progress_bar = ttk.Progressbar(form_frame, mode='indeterminate')
-        self.progress_bar.grid(row=7, column=0, columnspan=2, sticky=tk.W+tk.E, pady=5)
+        self.progress_bar.grid(row=8, column=0, columnspan=2, sticky=tk.W+tk.E, pady=5)
+
+    def update_host_choices(self):
+        self.host_combo['values'] = [AUTO_HOST, *(self.fleet.uris if self.fleet else ())]
 
     def load_available_networks(self):
+        manager = self.connections
+        cached = []
+        if self.cache:
+            try:
+                cached = self.cache.load_networks(manager.uri)
+            except sqlite3.Error as e:
+                logging.warning(f"Cannot read cached networks: {e}")
+        self.set_available_networks(cached or ["default"])
+        def load_thread():
+            try:
+                networks = list_networks(manager)
+            except libvirt.libvirtError as e:
+                self.log_to_console(f"Error loading networks: {e}", error=True)
+                return
+            if not networks:
+                self.log_to_console("No networks available, using default", error=True)
+                return
+            if self.cache:
+                self.cache.store_networks(manager.uri, networks)
+            self.root.after(0, lambda: self.set_available_networks(networks))
+        threading.Thread(target=load_thread).start()
+
+    def set_available_networks(self, networks):
+        current = self.network_combo.get()
+        self.network_combo['values'] = networks
+        self.network_combo.set(current if current in networks else networks[0])
+
+    def load_templates(self):
         try:
-            if self.conn and self.conn.isAlive():
-                active_nets = self.conn.listNetworks()
-                inactive_nets = self.conn.listDefinedNetworks()
-                networks = active_nets + inactive_nets
-                if not networks:
-                    networks = ["default"]
-                    self.log_to_console("No networks available, using default", error=True)
-                self.network_combo['values'] = networks
-                if networks:
-                    self.network_combo.set(networks[0])
-            else:
-                self.network_combo['values'] = ["default"]
-                self.network_combo.set("default")
-                self.log_to_console("Connection not available, using default network", error=True)
-        except libvirt.libvirtError as e:
-            self.log_to_console(f"Error loading networks: {e}", error=True)
-            self.network_combo['values'] = ["default"]
-            self.network_combo.set("default")
+            names = [template['name'] for template in self.templates.templates()]
+        except (OSError, ValueError) as e:
+            self.log_to_console(f"Error loading templates: {e}", error=True)
+            names = []
+        current = self.template_combo.get()
+        self.template_combo['values'] = [ISO_INSTALL, *names]
+        self.template_combo.set(current if current in names else ISO_INSTALL)
+
+    def selected_template(self):
+        name = self.template_combo.get()
+        return None if name in ("", ISO_INSTALL) else self.templates.get(name)
+
+    def select_template(self, event=None):
+        template = self.selected_template()
+        if not template:
+            return
+        for entry, value in ((self.memory_entry, template['memory']), (self.vcpu_entry, template['vcpus'])):
+            entry.delete(0, tk.END)
+            entry.insert(0, str(value))
+
+    def ask_template_name(self, default=""):
+        name = simpledialog.askstring("Template Name", "Name for the new template:",
+                                      initialvalue=default, parent=self.root)
+        if name is None:
+            return None
+        name = name.strip()
+        if not re.match(r'^[\w-]+$', name):
+            messagebox.showerror("Error", "Template name can only contain letters, numbers, underscores, and hyphens")
+            return None
+        if self.templates.get(name):
+            messagebox.showerror("Error", f"Template '{name}' already exists")
+            return None
+        return name
+
+    def add_template_job(self, key, name, build):
+        def template_thread(job):
+            template = build()
+            self.templates.add(template)
+            self.log_to_console(f"Template '{name}' added ({len(template['disks'])} disk(s), base images set read-only)")
+            self.root.after(0, self.load_templates)
+            return "Template added"
+        self.scheduler.submit(key, f"Template {name}", template_thread)
+
+    def make_template(self):
+        if not self.ensure_connection():
+            return
+        rows = self.get_selected_vms()
+        if not rows:
+            return
+        row = rows[0]
+        if row['uri'] != self.connections.uri:
+            messagebox.showerror("Error", "Templates can only be made from VMs on the primary host")
+            return
+        if row['active']:
+            messagebox.showerror("Error", f"Shut down '{row['name']}' before using it as a template")
+            return
+        name = self.ask_template_name(f"{row['name']}-template")
+        if not name:
+            return
+        manager = self.connections
+        def build():
+            with manager.lease() as conn:
+                return template_from_domain(name, row['uri'], conn.lookupByUUIDString(row['uuid']))
+        self.add_template_job(row['key'], name, build)
+
+    def add_image_template(self):
+        if not self.ensure_connection():
+            return
+        path = filedialog.askopenfilename(
+            title="Select golden disk image",
+            initialdir="/var/lib/libvirt/images",
+            filetypes=(("Disk images", "*.qcow2 *.img *.raw"), ("All files", "*.*"))
+        )
+        if not path:
+            return
+        name = self.ask_template_name(os.path.splitext(os.path.basename(path))[0])
+        if not name:
+            return
+        try:
+            memory_mb = int(self.memory_entry.get())
+            vcpus = int(self.vcpu_entry.get())
+        except ValueError:
+            memory_mb, vcpus = 2048, 2
+        uri = self.connections.uri
+        self.add_template_job(f"template:{name}", name,
+                              lambda: template_from_image(name, uri, path, memory_mb, vcpus))
+
+    def remove_template(self):
+        template = self.selected_template()
+        if not template:
+            return
+        if not messagebox.askyesno("Remove Template",
+                                   f"Remove template '{template['name']}' from the catalog? "
+                                   "The base image is kept because linked clones depend on it."):
+            return
+        self.templates.remove(template['name'])
+        self.log_to_console(f"Template '{template['name']}' removed; base image left in place")
+        self.load_templates()
+
+    def flatten_vm(self):
+        if not self.ensure_connection():
+            return
+        rows = [row for row in self.get_selected_vms() if row['uri'] == self.connections.uri]
+        if rows:
+            self.submit_vm_jobs("Flatten", rows, self.flatten_disks)
+
+    def flatten_disks(self, job, manager, row):
+        flattened = flatten_domain_disks(manager, row['uuid'],
+                                         on_progress=lambda percent: setattr(job, 'progress', percent),
+                                         check_cancelled=job.check_cancelled,
+                                         check_state=not self.events_connected(manager.uri))
+        return f"Flattened {len(flattened)} disk(s)" if flattened else "No linked disks"
+
+    def reclaim_vm(self):
+        if not self.ensure_connection():
+            return
+        rows = self.get_selected_vms()
+        if not rows:
+            return
+        try:
+            rate_mb = self.reclaim_rate_var.get()
+        except tk.TclError:
+            rate_mb = DEFAULT_RATE_MB
+        protected = self.templates.base_paths()
+        self.submit_vm_jobs("Reclaim", rows, lambda job, manager, row: self.reclaim_disks(
+            job, manager, row, rate_mb, protected))
+
+    def reclaim_disks(self, job, manager, row, rate_mb, protected):
+        job.message = "Waiting for other reclaim jobs"
+        return reclaim_domain_space(manager, row['uuid'], rate_mb, protected,
+                                    on_progress=lambda percent: setattr(job, 'progress', percent),
+                                    check_cancelled=job.check_cancelled)
 
     def setup_settings_tab(self, parent):
         settings_frame = ttk.Frame(parent)
@@ -235,6 +1270,13 @@ class EnhancedHypervisorManagerGUI:
         log_frame.pack(fill=tk.X, pady=5)
         self.timestamp_var = tk.BooleanVar(value=True)
         ttk.Checkbutton(log_frame, text="Show timestamps in log", variable=self.timestamp_var).pack(anchor=tk.W)
+        log_file_frame = ttk.Frame(settings_frame)
+        log_file_frame.pack(fill=tk.X, pady=5)
+        ttk.Label(log_file_frame, text="JSON log file:").pack(side=tk.LEFT)
+        self.log_file_entry = ttk.Entry(log_file_frame, width=40)
+        self.log_file_entry.pack(side=tk.LEFT, padx=5)
+        ttk.Button(log_file_frame, text="Apply", command=self.set_log_file).pack(side=tk.LEFT)
+        Tooltip(self.log_file_entry, "Structured log (one JSON object per line), rotated at 10 MB; leave empty to disable")
         conn_frame = ttk.LabelFrame(settings_frame, text="Hypervisor Connection")
         conn_frame.pack(fill=tk.X, pady=10)
         ttk.Label(conn_frame, text="URI:").grid(row=0, column=0, sticky=tk.W, pady=5, padx=5)
@@ -242,9 +1284,52 @@ class EnhancedHypervisorManagerGUI:
         self.uri_entry.insert(0, "qemu:///system")
         self.uri_entry.grid(row=0, column=1, sticky=tk.W+tk.E, pady=5, padx=5)
         ttk.Button(conn_frame, text="Reconnect", command=self.reconnect_hypervisor).grid(row=0, column=2, padx=5)
+        ttk.Label(conn_frame, text="Fleet hosts:").grid(row=1, column=0, sticky=tk.NW, pady=5, padx=5)
+        self.fleet_text = tk.Text(conn_frame, height=4, width=50)
+        self.fleet_text.grid(row=1, column=1, sticky=tk.W+tk.E, pady=5, padx=5)
+        Tooltip(self.fleet_text, "Additional libvirt URIs, one per line (e.g. qemu+ssh://host2/system)")
+        ttk.Label(conn_frame, text="Host timeout (s):").grid(row=2, column=0, sticky=tk.W, pady=5, padx=5)
+        self.fleet_timeout_entry = ttk.Entry(conn_frame, width=10)
+        self.fleet_timeout_entry.insert(0, str(self.fleet_timeout))
+        self.fleet_timeout_entry.grid(row=2, column=1, sticky=tk.W, pady=5, padx=5)
+        conn_frame.columnconfigure(1, weight=1)
+        placement_frame = ttk.LabelFrame(settings_frame, text="Placement")
+        placement_frame.pack(fill=tk.X, pady=10)
+        placement_entries = [
+            ("CPU overcommit ratio:", "cpu_ratio_entry", str(self.cpu_ratio),
+             "Maximum vCPUs per host CPU before new VMs are rejected"),
+            ("Memory overcommit ratio:", "memory_ratio_entry", str(self.memory_ratio),
+             "Maximum guest memory per host memory before new VMs are rejected"),
+            ("Reserved host CPUs:", "reserved_cpus_entry", format_cpuset(self.reserved_cpus),
+             "Host CPUs never used for vCPU pinning, e.g. 0-1"),
+        ]
+        for i, (label, attr, default, tip) in enumerate(placement_entries):
+            ttk.Label(placement_frame, text=label).grid(row=i, column=0, sticky=tk.W, pady=5, padx=5)
+            entry = ttk.Entry(placement_frame, width=10)
+            entry.insert(0, default)
+            entry.grid(row=i, column=1, sticky=tk.W, pady=5, padx=5)
+            setattr(self, attr, entry)
+            Tooltip(entry, tip)
+        ttk.Button(placement_frame, text="Apply", command=self.apply_placement_settings).grid(row=0, column=2, padx=5)
+
+    def apply_placement_settings(self):
+        try:
+            cpu_ratio = float(self.cpu_ratio_entry.get())
+            memory_ratio = float(self.memory_ratio_entry.get())
+            reserved_cpus = parse_cpuset(self.reserved_cpus_entry.get())
+            if cpu_ratio <= 0 or memory_ratio <= 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Error", "Overcommit ratios must be positive numbers and reserved CPUs a cpuset like 0-1,4")
+            return
+        self.cpu_ratio = cpu_ratio
+        self.memory_ratio = memory_ratio
+        self.reserved_cpus = reserved_cpus
+        self.log_to_console(f"Placement: CPU overcommit {cpu_ratio}, memory overcommit {memory_ratio}, "
+                            f"reserved CPUs {format_cpuset(reserved_cpus) or 'none'}")
 
     def ensure_connection(self):
-        if not self.conn or not self.conn.isAlive():
+        if not self.fleet or self.connections.closed:
             self.log_to_console("Connection lost, attempting to reconnect...", error=True)
             self.reconnect_hypervisor()
             return False
@@ -254,48 +1339,65 @@ class EnhancedHypervisorManagerGUI:
         self.style.theme_use(self.theme_var.get())
 
     def reconnect_hypervisor(self):
-        uri = self.uri_entry.get()
-        def reconnect_thread():
-            try:
-                if self.conn:
-                    self.conn.close()
-                self.conn = libvirt.open(uri)
-                if self.conn:
-                    self.root.after(0, lambda: self.connection_status.set(f"Connected to {self.conn.getHostname()}"))
-                    self.log_to_console(f"Reconnected to {uri}")
-                    self.load_available_networks()
-                    self.refresh_vm_list()
-                else:
-                    self.root.after(0, lambda: self.connection_status.set("Connection failed"))
-                    self.log_to_console("Reconnection failed", error=True)
-            except libvirt.libvirtError as e:
-                self.root.after(0, lambda: self.connection_status.set("Connection failed"))
-                self.log_to_console(f"Reconnection error: {e}", error=True)
-        threading.Thread(target=reconnect_thread).start()
+        uri = self.uri_entry.get().strip()
+        fleet_uris = [line.strip() for line in self.fleet_text.get('1.0', tk.END).splitlines() if line.strip()]
+        try:
+            self.fleet_timeout = float(self.fleet_timeout_entry.get())
+            if self.fleet_timeout <= 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Error", "Host timeout must be a positive number")
+            return
+        self.log_to_console(f"Reconnecting to {', '.join([uri, *fleet_uris])}")
+        self.connect_to_hypervisor(uri, fleet_uris)
+        self.load_available_networks()
+        self.refresh_after_action()
 
     def show_vm_details(self, event=None):
         if not self.ensure_connection():
             return
-        selected_item = self.vm_tree.focus()
-        values = self.vm_tree.item(selected_item, 'values')
-        if values:
-            vm_name = values[0]
+        row = self.vm_model.get(self.vm_list.focus())
+        if not row:
+            return
+        manager = self.fleet.manager(row['uri'])
+        def details_thread():
             try:
-                dom = self.conn.lookupByName(vm_name)
-                xml_desc = dom.XMLDesc(0)
-                root = ET.fromstring(xml_desc)
-                details = [
-                    f"Name: {vm_name}",
-                    f"Status: {values[1]}",
-                    f"Memory: {values[3]} MB",
-                    f"vCPUs: {values[4]}",
-                    f"Autostart: {values[5]}",
-                    f"UUID: {dom.UUIDString()}",
-                    f"OSType: {root.find('./os/type').get('arch')}"
-                ]
-                messagebox.showinfo("VM Details", "\n".join(details))
+                with manager.lease() as conn:
+                    dom = conn.lookupByUUIDString(row['uuid'])
+                    description = self.domain_description(manager, dom)
+                    disks = domain_disk_usage(dom, description)
             except libvirt.libvirtError as e:
                 self.log_to_console(f"Error getting VM details: {e}", error=True)
+                return
+            details = [
+                f"Name: {row['name']}",
+                f"Host: {row['host']}",
+                f"Status: {row['status']}",
+                f"Memory: {row['memory']} MB",
+                f"vCPUs: {row['vcpu']}",
+                f"Autostart: {self.format_vm_cell('autostart', row['autostart'])}",
+                f"UUID: {row['uuid']}",
+                f"OSType: {description.arch}"
+            ]
+            for disk in disks:
+                details.append(f"Disk {disk['target']}: {self.format_bytes(disk['physical'])} used of "
+                               f"{self.format_bytes(disk['capacity'])} ({disk['source']})")
+            if self.cache:
+                stats, updated = self.cache.load_stats(row['key'])
+                if stats:
+                    details.append(f"Last stats ({datetime.fromtimestamp(updated).strftime('%H:%M:%S')}): "
+                                   f"CPU {self.format_stat(stats['cpu'], '%')}, "
+                                   f"Memory {self.format_stat(stats['mem'], ' MB')}, "
+                                   f"Disk {self.format_stat(stats['rd'])}/{self.format_stat(stats['wr'], ' MB/s')}, "
+                                   f"Net {self.format_stat(stats['rx'])}/{self.format_stat(stats['tx'], ' MB/s')}")
+            self.root.after(0, lambda: messagebox.showinfo("VM Details", "\n".join(details)))
+        threading.Thread(target=details_thread).start()
+
+    def format_bytes(self, value):
+        return f"{value / 1073741824:.1f} GB"
+
+    def format_stat(self, value, unit=""):
+        return "-" if value is None else f"{value:.1f}{unit}"
 
     def browse_iso(self):
         filename = filedialog.askopenfilename(
@@ -318,160 +1420,258 @@ class EnhancedHypervisorManagerGUI:
             self.virtio_path = filename
 
     def log_to_console(self, message, error=False):
-        def update_console():
-            timestamp = datetime.now().strftime('%H:%M:%S') if self.timestamp_var.get() else ""
-            log_message = f"[{timestamp}] {message}" if timestamp else message
+        self.logger.log(logging.ERROR if error else logging.INFO, message)
+
+    def process_log_queue(self):
+        entries, dropped = self.log_queue.drain(self.log_batch)
+        if dropped:
+            entries.insert(0, LogEntry(time.time(), logging.WARNING, f"{dropped} log messages dropped"))
+        if entries:
+            self.write_log_entries(entries)
+        self.root.after(self.log_interval, self.process_log_queue)
+
+    def write_log_entries(self, entries):
+        show_time = self.timestamp_var.get()
+        chunks = []
+        for entry in entries:
+            if show_time:
+                line = f"[{datetime.fromtimestamp(entry.created).strftime('%H:%M:%S')}] {entry.message}\n"
+            else:
+                line = f"{entry.message}\n"
+            if entry.level >= logging.ERROR:
+                tag = 'error'
+            elif entry.level >= logging.WARNING:
+                tag = 'warning'
+            else:
+                tag = ''
+            chunks.extend((line, tag))
+        with TELEMETRY.track("tk activity log"):
             self.console.config(state=tk.NORMAL)
-            self.console.insert(tk.END, log_message + "\n", 'error' if error else '')
+            self.console.insert(tk.END, *chunks)
+            lines = int(self.console.index('end-1c').split('.')[0])
+            if lines > self.log_max_lines:
+                self.console.delete('1.0', f"{lines - self.log_max_lines + 1}.0")
             self.console.see(tk.END)
             self.console.config(state=tk.DISABLED)
-            self.status_var.set(message[:100])
-        self.root.after(0, update_console)
+        self.status_var.set(entries[-1].message[:100])
+
+    def set_log_file(self):
+        path = self.log_file_entry.get().strip()
+        root_logger = logging.getLogger()
+        if self.log_file_handler:
+            root_logger.removeHandler(self.log_file_handler)
+            self.log_file_handler.close()
+            self.log_file_handler = None
+        if not path:
+            self.log_to_console("JSON log file disabled")
+            return
+        try:
+            self.log_file_handler = json_file_handler(path)
+        except OSError as e:
+            self.log_to_console(f"Cannot open log file {path}: {e}", error=True)
+            return
+        root_logger.addHandler(self.log_file_handler)
+        self.log_to_console(f"Writing JSON log to {path}")
 
     def refresh_vm_list(self):
         if not self.ensure_connection():
             return
-        for item in self.vm_tree.get_children():
-            self.vm_tree.delete(item)
-        try:
-            all_domains = []
-            try:
-                active_ids = self.conn.listDomainsID()
-                for dom_id in active_ids:
-                    try:
-                        dom = self.conn.lookupByID(dom_id)
-                        all_domains.append((dom, True))
-                    except libvirt.libvirtError as e:
-                        self.log_to_console(f"Error looking up domain ID {dom_id}: {e}", error=True)
-            except libvirt.libvirtError as e:
-                self.log_to_console(f"Error listing active domains: {e}", error=True)
-            try:
-                inactive_names = self.conn.listDefinedDomains()
-                for name in inactive_names:
-                    try:
-                        dom = self.conn.lookupByName(name)
-                        all_domains.append((dom, False))
-                    except libvirt.libvirtError as e:
-                        self.log_to_console(f"Error looking up domain name {name}: {e}", error=True)
-            except libvirt.libvirtError as e:
-                self.log_to_console(f"Error listing inactive domains: {e}", error=True)
-            inactive_counter = 1000
-            for dom, is_active in all_domains:
+        fleet = self.fleet
+        def refresh_thread():
+            inventories = fleet.collect(on_error=lambda name, e: self.log_to_console(
+                f"Error processing domain {name}: {e}", error=True))
+            self.root.after(0, lambda: self.apply_fleet_inventory(fleet, inventories))
+        threading.Thread(target=refresh_thread).start()
+
+    def apply_fleet_inventory(self, fleet, inventories):
+        if fleet is not self.fleet:
+            return
+        rows = []
+        for inventory in inventories:
+            if inventory.error is None:
+                rows.extend(inventory.rows)
+                if self.cache:
+                    self.cache.store_sync(inventory.uri, inventory.host)
+                continue
+            self.log_to_console(f"Error refreshing VMs on {inventory.host}: {inventory.error}", error=True)
+            rows.extend(self.vm_model.rows_for_uri(inventory.uri))
+        self.apply_vm_rows(rows)
+
+    def refresh_domains(self, changed, removed):
+        if not self.fleet:
+            return
+        fleet = self.fleet
+        def refresh_thread():
+            rows = []
+            gone = set(removed)
+            for uri, uuids in changed.items():
                 try:
-                    name = dom.name()
-                    autostart = dom.autostart()
-                    dom_id = dom.ID() if is_active else inactive_counter
-                    if not is_active:
-                        inactive_counter += 1
-                    self.vm_tree.insert('', tk.END, values=(
-                        name, 
-                        "Running" if is_active else "Stopped", 
-                        dom_id, 
-                        dom.maxMemory() // 1024,
-                        dom.maxVcpus(),
-                        "Yes" if autostart else "No"
-                    ))
+                    host_rows, host_gone = fleet.collect_host_domains(uri, uuids, on_error=lambda name, e: self.log_to_console(
+                        f"Error processing domain {name}: {e}", error=True))
                 except libvirt.libvirtError as e:
-                    self.log_to_console(f"Error processing domain {dom.name() if hasattr(dom, 'name') else 'unknown'}: {e}", error=True)
-            self.log_to_console("VM list refreshed successfully")
-        except libvirt.libvirtError as e:
-            self.log_to_console(f"Error refreshing VM list: {e}", error=True)
-
-    def get_selected_vm(self):
-        selected_items = self.vm_tree.selection()
-        if not selected_items:
-            messagebox.showwarning("No Selection", "Please select a VM from the list.")
-            return None
-        return self.vm_tree.item(selected_items[0])['values'][0]
+                    self.log_to_console(f"Error updating VM list for {uri}: {e}", error=True)
+                    continue
+                rows.extend(host_rows)
+                gone.update(host_gone)
+            self.root.after(0, lambda: self.apply_domain_rows(fleet, rows, gone))
+        threading.Thread(target=refresh_thread).start()
+
+    def apply_domain_rows(self, fleet, rows, removed):
+        if fleet is self.fleet:
+            self.apply_vm_diff(self.vm_model.patch(rows, removed))
+
+    def apply_vm_rows(self, rows):
+        self.apply_vm_diff(self.vm_model.diff(rows))
+        self.log_to_console("VM list refreshed successfully")
+
+    def apply_vm_diff(self, diff, persist=True):
+        if not (diff.added or diff.removed or diff.changed):
+            return
+        self.vm_index.apply(diff)
+        self.show_vm_view()
+        if persist and self.cache:
+            self.cache.store_rows([self.vm_model.get(key) for key in (*diff.added, *diff.changed)], diff.removed)
+
+    def show_vm_view(self):
+        with TELEMETRY.track("tk vm list"):
+            self.vm_list.set_keys(self.vm_index.view)
+            self.vm_count_var.set(f"Showing {len(self.vm_index.view)} of {len(self.vm_model.rows)}")
+
+    def vm_row_values(self, key):
+        row = self.vm_model.get(key)
+        return tuple(self.format_vm_cell(field, row.get(field)) for field in self.vm_model.fields)
+
+    def sort_vm_list(self, column):
+        reverse = not self.vm_index.reverse if column == self.vm_index.sort_column else False
+        self.vm_index.set_sort(column, reverse)
+        self.update_vm_headings()
+        self.show_vm_view()
+
+    def update_vm_headings(self):
+        for column, text in self.vm_headings.items():
+            if column == self.vm_index.sort_column:
+                text = f"{text} {'▼' if self.vm_index.reverse else '▲'}"
+            self.vm_list.heading(column, text=text)
+
+    def filter_vm_list(self, event=None):
+        pattern = self.vm_filter_var.get()
+        regex = self.vm_regex_var.get()
+        if pattern == self.vm_index.pattern and regex == self.vm_index.regex:
+            return
+        try:
+            self.vm_index.set_filter(pattern, regex)
+        except re.error as e:
+            self.status_var.set(f"Invalid filter: {e}")
+            return
+        self.show_vm_view()
+
+    def format_vm_cell(self, field, value):
+        if field == 'id':
+            return "-" if value is None else value
+        if field == 'autostart':
+            return "Yes" if value else "No"
+        if field == 'disk':
+            return "-" if not value else f"{value[0]} / {value[1]}"
+        return value
+
+    def get_selected_vms(self):
+        rows = [self.vm_model.get(key) for key in self.vm_list.selection()]
+        rows = [row for row in rows if row]
+        if not rows:
+            messagebox.showwarning("No Selection", "Please select one or more VMs from the list.")
+        return rows
+
+    def submit_vm_jobs(self, action, rows, func):
+        for row in rows:
+            manager = self.fleet.manager(row['uri'])
+            self.scheduler.submit(row['key'], f"{action} {row['name']}",
+                                  lambda job, manager=manager, row=row: func(job, manager, row))
+        self.log_to_console(f"Queued {action.lower()} for {len(rows)} VM(s)")
 
     def start_vm(self):
         if not self.ensure_connection():
             return
-        vm_name = self.get_selected_vm()
-        if not vm_name:
-            return
-        def start_thread():
-            try:
-                dom = self.conn.lookupByName(vm_name)
-                if dom.isActive():
-                    self.log_to_console(f"VM '{vm_name}' is already running")
-                    return
-                dom.create()
-                self.log_to_console(f"VM '{vm_name}' started")
-                self.refresh_vm_list()
-            except libvirt.libvirtError as e:
-                self.log_to_console(f"Error starting VM: {e}", error=True)
-        threading.Thread(target=start_thread).start()
+        rows = self.get_selected_vms()
+        if rows:
+            self.submit_vm_jobs("Start", rows, lambda job, manager, row: start_domain(manager, row['uuid']))
 
     def restart_vm(self):
         if not self.ensure_connection():
             return
-        vm_name = self.get_selected_vm()
-        if not vm_name:
+        rows = self.get_selected_vms()
+        if rows:
+            self.submit_vm_jobs("Restart", rows, lambda job, manager, row: restart_domain(manager, row['uuid']))
+
+    def shutdown_vm(self):
+        if not self.ensure_connection():
             return
-        def restart_thread():
-            try:
-                dom = self.conn.lookupByName(vm_name)
-                if not dom.isActive():
-                    self.log_to_console(f"Starting VM '{vm_name}' as it's not running")
-                    dom.create()
-                else:
-                    dom.reboot()
-                    self.log_to_console(f"VM '{vm_name}' restarting...")
-                self.refresh_vm_list()
-            except libvirt.libvirtError as e:
-                self.log_to_console(f"Error restarting VM: {e}", error=True)
-        threading.Thread(target=restart_thread).start()
+        rows = self.get_selected_vms()
+        if rows:
+            self.submit_vm_jobs("Shutdown", rows, lambda job, manager, row: shutdown_domain(manager, row['uuid']))
 
     def open_console(self):
         if not self.ensure_connection():
             return
-        selected = self.vm_tree.selection()
-        if not selected:
+        rows = self.get_selected_vms()
+        if not rows:
             return
-        vm_name = self.vm_tree.item(selected)['values'][0]
-        try:
-            dom = self.conn.lookupByName(vm_name)
-            if not dom.isActive():
-                self.log_to_console(f"VM '{vm_name}' is not running", error=True)
-                return
-            xml_desc = dom.XMLDesc(0)
-            root = ET.fromstring(xml_desc)
-            graphics = root.find('.//graphics[@type="vnc"]')
-            if graphics is None:
-                self.log_to_console(f"VNC graphics not configured for {vm_name}", error=True)
+        if self.console_proxy is None:
+            try:
+                self.console_proxy = ConsoleProxy().start()
+            except OSError as e:
+                self.log_to_console(f"Error starting console proxy: {e}", error=True)
                 return
-            port = graphics.get('port')
-            if port == '-1' or not port:
-                time.sleep(1)
-                xml_desc = dom.XMLDesc(0)
-                root = ET.fromstring(xml_desc)
-                graphics = root.find('.//graphics[@type="vnc"]')
-                port = graphics.get('port')
-            if port and port != '-1':
-                subprocess.Popen(["vncviewer", f"localhost:{port}"])
+        if not self.console_proxy.web_root:
+            self.log_to_console("noVNC not found, falling back to vncviewer. Install novnc for in-browser consoles.")
+            for row in rows:
+                self.open_vncviewer(row)
+            return
+        urls = []
+        for row in rows:
+            token = self.console_tokens.get(row['key'])
+            if token is None:
+                manager = self.fleet.manager(row['uri'])
+                check_state = not self.events_connected(row['uri'])
+                factory = lambda manager=manager, uuid=row['uuid'], check_state=check_state: \
+                    open_console_socket(manager, uuid, check_state)
+                token = self.console_tokens[row['key']] = self.console_proxy.add_target(row['name'], factory)
+            urls.append((row['name'], self.console_proxy.url(token)))
+        def browser_thread():
+            for vm_name, url in urls:
+                webbrowser.open_new_tab(url)
+                self.log_to_console(f"Opened console for {vm_name}: {url}")
+        threading.Thread(target=browser_thread, daemon=True).start()
+
+    def open_vncviewer(self, row):
+        vm_name = row['name']
+        manager = self.fleet.manager(row['uri'])
+        check_state = not self.events_connected(row['uri'])
+        def console_thread():
+            try:
+                host, port = console_address(manager, row['uuid'], check_state=check_state)
+                subprocess.Popen(["vncviewer", f"{host}:{port}"])
                 self.log_to_console(f"Opened VNC console for {vm_name} on port {port}")
-            else:
-                self.log_to_console(f"Unable to determine VNC port for {vm_name}", error=True)
-        except libvirt.libvirtError as e:
-            self.log_to_console(f"Error opening console: {e}", error=True)
-        except FileNotFoundError:
-            self.log_to_console("vncviewer not found. Ensure it is installed.", error=True)
+            except (libvirt.libvirtError, RuntimeError) as e:
+                self.log_to_console(f"Error opening console: {e}", error=True)
+            except FileNotFoundError:
+                self.log_to_console("vncviewer not found. Ensure it is installed.", error=True)
+        threading.Thread(target=console_thread).start()
 
     def create_vm(self):
         vm_name = self.vm_name_entry.get().strip()
         iso_path = self.iso_path_entry.get().strip()
         virtio_path = self.virtio_path_entry.get().strip()
+        template = self.selected_template()
         if not vm_name:
             messagebox.showerror("Error", "VM name is required")
             return
         if not re.match(r'^[\w-]+$', vm_name):
             messagebox.showerror("Error", "VM name can only contain letters, numbers, underscores, and hyphens")
             return
-        if not os.path.exists(iso_path):
+        if not template and not os.path.exists(iso_path):
             messagebox.showerror("Error", f"Windows ISO file '{iso_path}' does not exist")
             return
-        if not os.path.exists(virtio_path):
+        if not template and not os.path.exists(virtio_path):
             messagebox.showerror("Error", f"VirtIO ISO file '{virtio_path}' does not exist")
             return
         try:
@@ -483,117 +1683,180 @@ class EnhancedHypervisorManagerGUI:
         except ValueError:
             messagebox.showerror("Error", "Memory, vCPUs, and Disk size must be positive integers")
             return
-        disk_dir = "/var/lib/libvirt/images"
-        if not os.access(disk_dir, os.W_OK):
-            messagebox.showerror("Error", f"No write permission for {disk_dir}")
+        if not self.ensure_connection():
             return
-        try:
-            network = self.network_combo.get()
-            net = self.conn.networkLookupByName(network)
-            if not net.isActive():
-                net.create()
-        except libvirt.libvirtError as e:
-            available_nets = self.conn.listNetworks() + self.conn.listDefinedNetworks()
-            messagebox.showerror("Network Error",
-                f"Network '{network}' not available.\n"
-                f"Available networks: {', '.join(available_nets) if available_nets else 'None'}")
+        if template and template['uri'] != self.connections.uri:
+            messagebox.showerror("Error", f"Template '{template['name']}' belongs to {template['uri']}")
             return
+        network = self.network_combo.get()
+        profile = storage_profile(self.storage_profile_combo.get())
+        settings = {**self.placement_settings(), 'hugepages': self.hugepages_var.get()}
+        placement = settings if self.numa_var.get() or self.hugepages_var.get() else None
+        host = self.host_combo.get()
+        strategy = self.strategy_combo.get()
+        manager = self.connections if template or host == AUTO_HOST else self.fleet.manager(host)
         self.create_btn.config(state=tk.DISABLED)
         self.progress_bar.start()
-        def create_thread():
-            safe_vm_name = slugify(vm_name)
-            disk_path = f"/var/lib/libvirt/images/{safe_vm_name}.qcow2"
+        if template:
+            mode = LINKED if self.clone_mode_combo.get() == "Linked clone" else FULL
+            self.create_from_template(manager, template, mode, vm_name, memory_mb, vcpus, network, profile, placement)
+            return
+        def create_thread(job):
             try:
-                cmd = ['qemu-img', 'create', '-f', 'qcow2', disk_path, f'{disk_gb}G']
-                process = subprocess.run(cmd, capture_output=True, text=True)
-                if process.returncode != 0:
-                    self.log_to_console(f"Error creating disk: {process.stderr}", error=True)
-                    return
-                xml_config = f"""<domain type='kvm'>
-  <name>{vm_name}</name>
-  <memory unit='KiB'>{memory_mb * 1024}</memory>
-  <vcpu>{vcpus}</vcpu>
-  <os>
-    <type arch='x86_64'>hvm</type>
-    <boot dev='cdrom'/>
-    <boot dev='hd'/>
-  </os>
-  <features>
-    <acpi/>
-    <apic/>
-    <vmport state='off'/>
-  </features>
-  <cpu mode='host-passthrough'/>
-  <clock offset='localtime'/>
-  <devices>
-    <disk type='file' device='disk'>
-      <driver name='qemu' type='qcow2'/>
-      <source file='{disk_path}'/>
-      <target dev='vda' bus='virtio'/>
-      <address type='pci' domain='0x0000' bus='0x00' slot='0x04' function='0x0'/>
-    </disk>
-    <disk type='file' device='cdrom'>
-      <driver name='qemu' type='raw'/>
-      <source file='{iso_path}'/>
-      <target dev='sda' bus='sata'/>
-      <readonly/>
-      <address type='drive' controller='0' bus='0' target='0' unit='0'/>
-    </disk>
-    <disk type='file' device='cdrom'>
-      <driver name='qemu' type='raw'/>
-      <source file='{virtio_path}'/>
-      <target dev='sdb' bus='sata'/>
-      <readonly/>
-      <address type='drive' controller='0' bus='0' target='0' unit='1'/>
-    </disk>
-    <controller type='sata' index='0'>
-      <address type='pci' domain='0x0000' bus='0x00' slot='0x05' function='0x0'/>
-    </controller>
-    <interface type='network'>
-      <source network='{network}'/>
-      <model type='virtio'/>
-      <address type='pci' domain='0x0000' bus='0x00' slot='0x03' function='0x0'/>
-    </interface>
-    <graphics type='vnc' port='-1' autoport='yes' listen='0.0.0.0'/>
-    <video>
-      <model type='virtio'/>
-      <address type='pci' domain='0x0000' bus='0x00' slot='0x02' function='0x0'/>
-    </video>
-    <input type='tablet' bus='usb'/>
-    <input type='keyboard' bus='ps2'/>
-    <input type='mouse' bus='ps2'/>
-    <controller type='usb' index='0' model='ich9-ehci1'/>
-    <controller type='pci' index='0' model='pci-root'/>
-  </devices>
-</domain>"""
-                dom = self.conn.defineXML(xml_config)
-                if dom:
-                    self.log_to_console(f"VM '{vm_name}' defined successfully")
-                    self.log_to_console(
-                        "To install Windows: In the Windows installer, click 'Load driver', "
-                        "select the VirtIO CDROM, and navigate to 'vioscsi\\<WindowsVersion>\\amd64' "
-                        "(e.g., 'vioscsi\\w10\\amd64' for Windows 10 64-bit).")
-                    try:
-                        dom.create()
-                        self.log_to_console(f"VM '{vm_name}' started")
-                    except libvirt.libvirtError as e:
-                        self.log_to_console(f"VM defined but failed to start: {e}", error=True)
-                    self.root.after(0, self.clear_creation_form)
-                    self.refresh_vm_list()
+                on_progress = lambda percent, rate: self.upload_progress(job, percent, rate)
+                if host == AUTO_HOST:
+                    job.message = f"Scoring hosts ({strategy})"
+                    _, decision = create_placed_domain(self.fleet, vm_name, memory_mb, vcpus, disk_gb, network,
+                                                       (iso_path, virtio_path), profile, placement, settings, strategy,
+                                                       on_progress=on_progress, check_cancelled=job.check_cancelled)
+                    job.message = f"Placed on {decision.host}"
                 else:
-                    self.log_to_console("Failed to define VM", error=True)
-            except libvirt.libvirtError as e:
-                self.log_to_console(f"VM creation error: {e}", error=True)
-                try:
-                    if os.path.exists(disk_path):
-                        os.unlink(disk_path)
-                        self.log_to_console(f"Removed disk file: {disk_path}")
-                except OSError as e:
-                    self.log_to_console(f"Error removing disk file: {e}", error=True)
+                    create_domain(manager, vm_name, memory_mb, vcpus, disk_gb, network,
+                                  cdroms=(iso_path, virtio_path), profile=profile, placement=placement,
+                                  on_progress=on_progress, check_cancelled=job.check_cancelled)
+            except NetworkUnavailable as e:
+                self.show_network_error(e)
+                raise
+            finally:
+                self.root.after(0, lambda: self.progress_bar.stop())
+                self.root.after(0, lambda: self.create_btn.config(state=tk.NORMAL))
+            self.root.after(0, self.clear_creation_form)
+            self.log_to_console(
+                "To install Windows: In the Windows installer, click 'Load driver', "
+                "select the VirtIO CDROM, and navigate to 'vioscsi\\<WindowsVersion>\\amd64' "
+                "(e.g., 'vioscsi\\w10\\amd64' for Windows 10 64-bit).")
+            return f"Created on {decision.host}" if host == AUTO_HOST else "Created"
+        self.scheduler.submit(f"{manager.uri}#create:{vm_name}", f"Create {vm_name}", create_thread)
+
+    def export_vm(self):
+        if not self.ensure_connection():
+            return
+        rows = self.get_selected_vms()
+        if not rows:
+            return
+        directory = filedialog.askdirectory(title="Export VMs to folder")
+        if not directory:
+            return
+        incremental = messagebox.askyesno("Export VMs", "Store only the chunks that changed since the latest export "
+                                                        "of each VM in this folder?")
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        protected = self.templates.base_paths()
+        self.submit_vm_jobs("Export", rows, lambda job, manager, row: self.export_disks(
+            job, manager, row, directory, stamp, incremental, protected))
+
+    def export_disks(self, job, manager, row, directory, stamp, incremental, protected):
+        prefix = re.sub(r'[^\w.-]+', '_', row['name'])
+        pattern = re.compile(rf"{re.escape(prefix)}-\d{{8}}-\d{{6}}{re.escape(BACKUP_SUFFIX)}")
+        archives = sorted(name for name in os.listdir(directory) if pattern.fullmatch(name))
+        partial = [name for name in archives if os.path.exists(os.path.join(directory, f"{name}.partial.json"))]
+        finished = [name for name in archives if name not in partial]
+        path = os.path.join(directory, partial[-1] if partial else f"{prefix}-{stamp}{BACKUP_SUFFIX}")
+        base = os.path.join(directory, finished[-1]) if incremental and finished else None
+        result = export_domain_archive(manager, row['uuid'], path, base, protected_paths=protected,
+                           on_progress=lambda percent, rate: self.transfer_progress(job, "Exporting", percent, rate),
+                           check_cancelled=job.check_cancelled)
+        return (f"{result['read'] / 1073741824:.1f} GB read, {result['stored'] / 1073741824:.1f} GB stored, "
+                f"{result['read'] / 1048576 / max(result['elapsed'], 1e-6):.0f} MB/s")
+
+    def import_vm(self):
+        path = filedialog.askopenfilename(
+            title="Select VM archive",
+            filetypes=(("VM archives", f"*{BACKUP_SUFFIX}"), ("All files", "*.*"))
+        )
+        if not path or not self.ensure_connection():
+            return
+        name = simpledialog.askstring("Import VM", "Name for the imported VM (blank keeps the original name, "
+                                                   "UUID and MAC addresses):", parent=self.root)
+        manager = self.fleet.manager(self.connections.uri)
+        def import_thread(job):
+            import_domain_archive(manager, path, name or None,
+                      on_progress=lambda percent, rate: self.transfer_progress(job, "Restoring", percent, rate),
+                      check_cancelled=job.check_cancelled)
+            self.root.after(0, self.refresh_vm_list)
+            return "Imported"
+        self.scheduler.submit(f"{manager.uri}#import:{path}", f"Import {os.path.basename(path)}", import_thread)
+
+    def transfer_progress(self, job, verb, percent, rate):
+        job.progress = percent
+        job.message = f"{verb}, {rate / 1048576:.0f} MB/s"
+
+    def upload_progress(self, job, percent, rate):
+        job.progress = percent
+        job.message = f"Uploading ISOs, {rate / 1048576:.0f} MB/s"
+
+    def show_network_error(self, error):
+        available = ', '.join(error.available) if error.available else 'None'
+        self.root.after(0, lambda: messagebox.showerror("Network Error",
+            f"Network '{error.network}' not available.\nAvailable networks: {available}"))
+
+    def create_from_template(self, manager, template, mode, vm_name, memory_mb, vcpus, network, profile, placement=None):
+        def clone_thread(job):
+            try:
+                _, elapsed = clone_domain(manager, template, mode, vm_name, memory_mb, vcpus, network,
+                                          profile=profile, placement=placement,
+                                          check_cancelled=job.check_cancelled)
+            except NetworkUnavailable as e:
+                self.show_network_error(e)
+                raise
             finally:
                 self.root.after(0, lambda: self.progress_bar.stop())
                 self.root.after(0, lambda: self.create_btn.config(state=tk.NORMAL))
-        threading.Thread(target=create_thread).start()
+            self.root.after(0, self.clear_creation_form)
+            return f"Cloned in {elapsed:.1f}s"
+        self.scheduler.submit(f"{manager.uri}#create:{vm_name}", f"Clone {vm_name} from {template['name']}", clone_thread)
+
+    def placement_settings(self):
+        return {'cpu_ratio': self.cpu_ratio, 'memory_ratio': self.memory_ratio, 'reserved_cpus': set(self.reserved_cpus)}
+
+    def load_manifest(self):
+        path = filedialog.askopenfilename(
+            title="Select VM manifest",
+            filetypes=(("Manifests", "*.json *.yaml *.yml"), ("All files", "*.*"))
+        )
+        if not path or not self.ensure_connection():
+            return
+        manager = self.connections
+        settings = self.placement_settings()
+        def validate_thread():
+            try:
+                manifest = load_manifest(path)
+                plans = validate_manifest(manager, manifest, self.templates, settings)
+            except ManifestError as e:
+                errors = e.errors
+                self.log_to_console(f"Manifest {os.path.basename(path)} is invalid: {'; '.join(errors)}", error=True)
+                self.root.after(0, lambda: messagebox.showerror("Manifest Error", "\n".join(errors[:20])))
+                return
+            except (OSError, libvirt.libvirtError) as e:
+                self.log_to_console(f"Error reading manifest {path}: {e}", error=True)
+                return
+            self.root.after(0, lambda: self.confirm_manifest(manager, manifest, plans, settings))
+        threading.Thread(target=validate_thread).start()
+
+    def confirm_manifest(self, manager, manifest, plans, settings):
+        counts = {action: sum(1 for plan in plans if plan['action'] == action) for action in (CREATE, UPDATE, SKIP)}
+        if not messagebox.askyesno("Provision VMs",
+                f"Create {counts[CREATE]}, update {counts[UPDATE]} and skip {counts[SKIP]} VMs on {manager.uri}?\n"
+                f"Disk concurrency {manifest['disk_concurrency']}, start concurrency {manifest['start_concurrency']}."):
+            return
+        name = os.path.basename(manifest['path'])
+        def provision_thread(job):
+            report = provision(manager, manifest, plans, self.templates, settings,
+                               on_progress=lambda percent: setattr(job, 'progress', percent),
+                               check_cancelled=job.check_cancelled)
+            path = report_path(manifest['path'])
+            try:
+                write_report(report, path)
+                self.log_to_console(f"Provisioning report written to {path}")
+            except OSError as e:
+                self.log_to_console(f"Cannot write report {path}: {e}", error=True)
+            for result in report['vms']:
+                if result['status'] == "failed":
+                    self.log_to_console(f"{result['name']}: {result['error']}", error=True)
+            summary = ", ".join(f"{count} {status}" for status, count in report['summary'].items())
+            if 'failed' in report['summary']:
+                raise RuntimeError(summary)
+            return f"{summary} in {report['elapsed']:.1f}s"
+        self.scheduler.submit(f"{manager.uri}#manifest:{manifest['path']}", f"Provision {name}", provision_thread)
 
     def clear_creation_form(self):
         self.vm_name_entry.delete(0, tk.END)
@@ -611,42 +1874,33 @@ class EnhancedHypervisorManagerGUI:
     def delete_vm(self):
         if not self.ensure_connection():
             return
-        vm_name = self.get_selected_vm()
-        if not vm_name:
+        rows = self.get_selected_vms()
+        if not rows:
             return
-        if not messagebox.askyesno("Confirm Delete", f"Delete VM '{vm_name}'? This cannot be undone."):
+        names = ", ".join(row['name'] for row in rows[:5]) + (", ..." if len(rows) > 5 else "")
+        if not messagebox.askyesno("Confirm Delete", f"Delete {len(rows)} VM(s) ({names})? This cannot be undone."):
             return
-        def delete_thread():
-            try:
-                dom = self.conn.lookupByName(vm_name)
-                xml_desc = dom.XMLDesc(0)
-                root = ET.fromstring(xml_desc)
-                disk_path = ""
-                for disk in root.findall('.//devices/disk/source'):
-                    disk_path = disk.get('file')
-                    if disk_path:
-                        break
-                if dom.isActive():
-                    dom.destroy()
-                dom.undefine()
-                self.log_to_console(f"VM '{vm_name}' undefined")
-                if disk_path and messagebox.askyesno("Delete Disk", f"Delete associated disk file at {disk_path}?"):
-                    try:
-                        os.unlink(disk_path)
-                        self.log_to_console(f"Deleted disk: {disk_path}")
-                    except OSError as e:
-                        self.log_to_console(f"Error deleting disk: {e}", error=True)
-                self.refresh_vm_list()
-            except libvirt.libvirtError as e:
-                self.log_to_console(f"Error deleting VM: {e}", error=True)
-        threading.Thread(target=delete_thread).start()
+        delete_disks = messagebox.askyesno("Delete Disk", "Also delete the associated disk files?")
+        protected = self.templates.base_paths() if delete_disks else set()
+        self.submit_vm_jobs("Delete", rows, lambda job, manager, row: delete_domain(
+            manager, row['uuid'], delete_disks, protected, check_state=not self.events_connected(manager.uri)))
 
     def on_closing(self):
-        if self.conn:
-            try:
-                self.conn.close()
-            except libvirt.libvirtError:
-                pass
+        self.metrics_sampler.stop()
+        self.balloon.stop()
+        logging.getLogger().removeHandler(self.log_handler)
+        if self.log_file_handler:
+            logging.getLogger().removeHandler(self.log_file_handler)
+            self.log_file_handler.close()
+        for monitor in self.event_monitors.values():
+            monitor.stop()
+        TELEMETRY.stop_serving()
+        if self.console_proxy:
+            self.console_proxy.stop()
+        if self.fleet:
+            self.fleet.close()
+        if self.cache:
+            self.cache.close()
         self.root.destroy()
 
 def main():
@@ -0,0 +1,315 @@
+import re
+from bisect import bisect_left, insort
+
+import libvirt
+
+STATE_NAMES = {
+    libvirt.VIR_DOMAIN_NOSTATE: "No State",
+    libvirt.VIR_DOMAIN_RUNNING: "Running",
+    libvirt.VIR_DOMAIN_BLOCKED: "Blocked",
+    libvirt.VIR_DOMAIN_PAUSED: "Paused",
+    libvirt.VIR_DOMAIN_SHUTDOWN: "Shutting Down",
+    libvirt.VIR_DOMAIN_SHUTOFF: "Stopped",
+    libvirt.VIR_DOMAIN_CRASHED: "Crashed",
+    libvirt.VIR_DOMAIN_PMSUSPENDED: "Suspended",
+}
+
+BULK_STATS = (libvirt.VIR_DOMAIN_STATS_STATE |
+              libvirt.VIR_DOMAIN_STATS_BALLOON |
+              libvirt.VIR_DOMAIN_STATS_VCPU |
+              libvirt.VIR_DOMAIN_STATS_BLOCK)
+GIB = 1024 ** 3
+
+UNSUPPORTED_ERRORS = (libvirt.VIR_ERR_NO_SUPPORT, libvirt.VIR_ERR_ARGUMENT_UNSUPPORTED)
+
+
+def is_unsupported(error):
+    return error.get_error_code() in UNSUPPORTED_ERRORS
+
+
+def row_key(uri, uuid):
+    return f"{uri}#{uuid}" if uri else uuid
+
+
+def tag_rows(rows, uri, host):
+    for row in rows:
+        row['uri'] = uri
+        row['host'] = host
+        row['key'] = row_key(uri, row['uuid'])
+    return rows
+
+
+def disk_usage(stats):
+    used = capacity = 0
+    for i in range(stats.get('block.count', 0)):
+        path = stats.get(f"block.{i}.path") or ""
+        if path.lower().endswith('.iso'):
+            continue
+        used += stats.get(f"block.{i}.physical", stats.get(f"block.{i}.allocation", 0))
+        capacity += stats.get(f"block.{i}.capacity", 0)
+    if not capacity:
+        return None
+    return [round(used / GIB, 1), round(capacity / GIB)]
+
+
+def make_row(dom, state, memory_kib, vcpus, autostart, disk=None):
+    active = dom.ID() != -1
+    uuid = dom.UUIDString()
+    return {
+        'key': uuid,
+        'uri': None,
+        'host': None,
+        'uuid': uuid,
+        'name': dom.name(),
+        'status': STATE_NAMES.get(state, "Running" if active else "Stopped"),
+        'active': active,
+        'id': dom.ID() if active else None,
+        'memory': memory_kib // 1024,
+        'vcpu': vcpus,
+        'autostart': autostart,
+        'disk': disk,
+    }
+
+
+def row_from_stats(dom, stats, autostart):
+    state = stats.get('state.state', libvirt.VIR_DOMAIN_NOSTATE)
+    memory_kib = stats.get('balloon.maximum', stats.get('balloon.current'))
+    vcpus = stats.get('vcpu.maximum', stats.get('vcpu.current'))
+    if memory_kib is None or vcpus is None:
+        info = dom.info()
+        memory_kib = info[1] if memory_kib is None else memory_kib
+        vcpus = info[3] if vcpus is None else vcpus
+    return make_row(dom, state, memory_kib, vcpus, autostart, disk_usage(stats))
+
+
+def row_from_info(dom, autostart):
+    state, max_mem, _, nr_vcpus, _ = dom.info()
+    return make_row(dom, state, max_mem, nr_vcpus, autostart)
+
+
+def list_autostart_uuids(conn):
+    try:
+        domains = conn.listAllDomains(libvirt.VIR_CONNECT_LIST_DOMAINS_AUTOSTART)
+    except libvirt.libvirtError as e:
+        if not is_unsupported(e):
+            raise
+        return None
+    return {dom.UUIDString() for dom in domains}
+
+
+def domain_autostart(dom, autostart_uuids):
+    if autostart_uuids is None:
+        return bool(dom.autostart())
+    return dom.UUIDString() in autostart_uuids
+
+
+def rows_from_records(records, autostart_uuids, on_error=None):
+    rows = []
+    for dom, stats in records:
+        try:
+            rows.append(row_from_stats(dom, stats, domain_autostart(dom, autostart_uuids)))
+        except libvirt.libvirtError as e:
+            if on_error:
+                on_error(dom.name(), e)
+    return rows
+
+
+def rows_from_info(domains, autostart_uuids, on_error=None):
+    rows = []
+    for dom in domains:
+        try:
+            rows.append(row_from_info(dom, domain_autostart(dom, autostart_uuids)))
+        except libvirt.libvirtError as e:
+            if on_error:
+                on_error(dom.name(), e)
+    return rows
+
+
+def collect_domains(conn, on_error=None):
+    autostart_uuids = list_autostart_uuids(conn)
+    try:
+        records = conn.getAllDomainStats(BULK_STATS)
+    except libvirt.libvirtError as e:
+        if not is_unsupported(e):
+            raise
+        return rows_from_info(conn.listAllDomains(0), autostart_uuids, on_error)
+    return rows_from_records(records, autostart_uuids, on_error)
+
+
+def collect_domain_rows(conn, domains, on_error=None):
+    if not domains:
+        return []
+    autostart_uuids = list_autostart_uuids(conn)
+    try:
+        records = conn.domainListGetStats(domains, BULK_STATS)
+    except libvirt.libvirtError as e:
+        if not is_unsupported(e):
+            raise
+        return rows_from_info(domains, autostart_uuids, on_error)
+    return rows_from_records(records, autostart_uuids, on_error)
+
+
+class DomainDiff:
+    def __init__(self, added, removed, changed):
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+
+class DomainListModel:
+    def __init__(self, fields=('name', 'host', 'status', 'id', 'memory', 'vcpu', 'disk', 'autostart')):
+        self.fields = fields
+        self.rows = {}
+
+    def diff(self, rows):
+        current = {row['key']: row for row in rows}
+        added = [key for key in current if key not in self.rows]
+        removed = [key for key in self.rows if key not in current]
+        changed = {}
+        for key, row in current.items():
+            old = self.rows.get(key)
+            if old is None:
+                continue
+            fields = {field: row.get(field) for field in self.fields if old.get(field) != row.get(field)}
+            if fields:
+                changed[key] = fields
+        self.rows = current
+        return DomainDiff(added, removed, changed)
+
+    def patch(self, rows, removed=()):
+        added = []
+        changed = {}
+        for row in rows:
+            key = row['key']
+            old = self.rows.get(key)
+            self.rows[key] = row
+            if old is None:
+                added.append(key)
+                continue
+            fields = {field: row.get(field) for field in self.fields if old.get(field) != row.get(field)}
+            if fields:
+                changed[key] = fields
+        gone = [key for key in removed if self.rows.pop(key, None) is not None]
+        return DomainDiff(added, gone, changed)
+
+    def get(self, key):
+        return self.rows.get(key)
+
+    def rows_for_uri(self, uri):
+        return [row for row in self.rows.values() if row['uri'] == uri]
+
+
+SORT_KEYS = {
+    'name': lambda row: row['name'].lower(),
+    'host': lambda row: (row['host'] or "").lower(),
+    'status': lambda row: row['status'],
+    'id': lambda row: -1 if row['id'] is None else row['id'],
+    'memory': lambda row: row['memory'],
+    'vcpu': lambda row: row['vcpu'],
+    'disk': lambda row: (row.get('disk') or [0])[0],
+    'autostart': lambda row: bool(row['autostart']),
+}
+
+SEARCH_FIELDS = ('name', 'host', 'status')
+
+
+class DomainIndex:
+    def __init__(self, model, sort_column='name'):
+        self.model = model
+        self.sort_column = sort_column
+        self.reverse = False
+        self.pattern = ""
+        self.regex = False
+        self._matcher = None
+        self._entries = {}
+        self._sorted = []
+        self._search = {}
+        self._matches = set()
+        self.view = []
+
+    def _entry(self, key):
+        row = self.model.rows[key]
+        return (SORT_KEYS[self.sort_column](row), row['name'].lower(), key)
+
+    def _search_text(self, key):
+        row = self.model.rows[key]
+        return "\n".join(str(row.get(field) or "") for field in SEARCH_FIELDS).lower()
+
+    def _match(self, key):
+        return self._matcher is None or self._matcher(self._search[key])
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            del self._sorted[bisect_left(self._sorted, entry)]
+
+    def _insert(self, key):
+        entry = self._entry(key)
+        self._entries[key] = entry
+        insort(self._sorted, entry)
+
+    def rebuild(self):
+        self._entries = {key: self._entry(key) for key in self.model.rows}
+        self._sorted = sorted(self._entries.values())
+        self._search = {key: self._search_text(key) for key in self.model.rows}
+        self._matches = {key for key in self._search if self._match(key)}
+        self._build_view()
+
+    def apply(self, diff):
+        for key in diff.removed:
+            self._remove(key)
+            self._search.pop(key, None)
+            self._matches.discard(key)
+        for key, fields in diff.changed.items():
+            if self.sort_column in fields or 'name' in fields:
+                self._remove(key)
+                self._insert(key)
+            if any(field in fields for field in SEARCH_FIELDS):
+                self._search[key] = self._search_text(key)
+                if self._match(key):
+                    self._matches.add(key)
+                else:
+                    self._matches.discard(key)
+        for key in diff.added:
+            self._insert(key)
+            self._search[key] = self._search_text(key)
+            if self._match(key):
+                self._matches.add(key)
+        self._build_view()
+
+    def set_sort(self, column, reverse=False):
+        if column != self.sort_column:
+            self.sort_column = column
+            self._entries = {key: self._entry(key) for key in self.model.rows}
+            self._sorted = sorted(self._entries.values())
+        self.reverse = reverse
+        self._build_view()
+
+    def set_filter(self, pattern, regex=False):
+        if regex:
+            compiled = re.compile(pattern, re.IGNORECASE) if pattern else None
+            matcher = compiled.search if compiled else None
+        else:
+            needle = pattern.lower()
+            matcher = (lambda text: needle in text) if needle else None
+        narrowing = (not regex and not self.regex and self.pattern
+                     and pattern.lower().startswith(self.pattern.lower()))
+        candidates = self._matches if narrowing else self._search.keys()
+        self.pattern = pattern
+        self.regex = regex
+        self._matcher = matcher
+        self._matches = {key for key in candidates if self._match(key)}
+        self._build_view()
+
+    def _build_view(self):
+        if self._matcher is None:
+            view = [entry[2] for entry in self._sorted]
+        else:
+            matches = self._matches
+            view = [entry[2] for entry in self._sorted if entry[2] in matches]
+        if self.reverse:
+            view.reverse()
+        self.view = view
@@ -0,0 +1,177 @@
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+from Hypervisor_Telemetry import TELEMETRY
+
+QUEUED = "Queued"
+RUNNING = "Running"
+SUCCEEDED = "Done"
+FAILED = "Failed"
+CANCELLED = "Cancelled"
+
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, job_id, key, label, func):
+        self.id = job_id
+        self.key = key
+        self.label = label
+        self.func = func
+        self.state = QUEUED
+        self.message = ""
+        self.progress = None
+        self.cancel_requested = False
+        self.submitted = time.monotonic()
+        self.started = None
+        self.finished = None
+
+    @property
+    def wait_time(self):
+        if self.started is None:
+            return (self.finished or time.monotonic()) - self.submitted
+        return self.started - self.submitted
+
+    @property
+    def run_time(self):
+        if self.started is None:
+            return None
+        return (self.finished or time.monotonic()) - self.started
+
+    def check_cancelled(self):
+        if self.cancel_requested:
+            raise JobCancelled(f"{self.label} cancelled")
+
+
+class JobScheduler:
+    def __init__(self, max_workers=4, on_update=None, history=500):
+        self.max_workers = max_workers
+        self.on_update = on_update
+        self.history = history
+        self._lock = threading.Lock()
+        self._ready = deque()
+        self._waiting = {}
+        self._busy_keys = set()
+        self._running = 0
+        self._jobs = OrderedDict()
+        self._ids = itertools.count(1)
+
+    def _notify(self, jobs):
+        if self.on_update:
+            for job in jobs:
+                self.on_update(job)
+
+    def submit(self, key, label, func):
+        with self._lock:
+            job = Job(next(self._ids), key, label, func)
+            self._jobs[job.id] = job
+            if key in self._busy_keys:
+                self._waiting.setdefault(key, deque()).append(job)
+            else:
+                self._busy_keys.add(key)
+                self._ready.append(job)
+            started = self._dispatch_locked()
+        self._notify([job, *started])
+        return job
+
+    def _dispatch_locked(self):
+        started = []
+        while self._ready and self._running < self.max_workers:
+            job = self._ready.popleft()
+            self._running += 1
+            job.state = RUNNING
+            job.started = time.monotonic()
+            threading.Thread(target=self._run, args=(job,), name=f"job-{job.id}", daemon=True).start()
+            started.append(job)
+        return started
+
+    def _release_key_locked(self, key):
+        waiting = self._waiting.get(key)
+        if waiting:
+            self._ready.append(waiting.popleft())
+            if not waiting:
+                del self._waiting[key]
+        else:
+            self._busy_keys.discard(key)
+
+    def _run(self, job):
+        try:
+            with TELEMETRY.job(job.id, job.label):
+                result = job.func(job)
+            job.message = result if isinstance(result, str) else job.message
+            job.state = SUCCEEDED
+        except JobCancelled as e:
+            job.message = str(e)
+            job.state = CANCELLED
+        except Exception as e:
+            logging.error(f"Job {job.id} ({job.label}) failed: {e}")
+            job.message = str(e)
+            job.state = FAILED
+        with self._lock:
+            job.finished = time.monotonic()
+            self._running -= 1
+            self._release_key_locked(job.key)
+            started = self._dispatch_locked()
+            self._prune_locked()
+        self._notify([job, *started])
+
+    def _prune_locked(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.state in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.state in FINISHED_STATES:
+                return False
+            if job.state == RUNNING:
+                job.cancel_requested = True
+                return False
+            if job in self._ready:
+                self._ready.remove(job)
+                self._release_key_locked(job.key)
+            else:
+                waiting = self._waiting.get(job.key)
+                waiting.remove(job)
+                if not waiting:
+                    del self._waiting[job.key]
+            job.state = CANCELLED
+            job.finished = time.monotonic()
+            started = self._dispatch_locked()
+        self._notify([job, *started])
+        return True
+
+    def cancel_queued(self):
+        with self._lock:
+            queued = [job.id for job in self._jobs.values() if job.state == QUEUED]
+        return sum(1 for job_id in queued if self.cancel(job_id))
+
+    def set_max_workers(self, max_workers):
+        with self._lock:
+            self.max_workers = max(1, int(max_workers))
+            started = self._dispatch_locked()
+        self._notify(started)
+
+    def clear_finished(self):
+        with self._lock:
+            finished = [job_id for job_id, job in self._jobs.items() if job.state in FINISHED_STATES]
+            for job_id in finished:
+                del self._jobs[job_id]
+        return finished
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def stats(self):
+        with self._lock:
+            queued = len(self._ready) + sum(len(waiting) for waiting in self._waiting.values())
+            return {'queued': queued, 'running': self._running, 'max_workers': self.max_workers}
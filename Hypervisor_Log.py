@@ -0,0 +1,70 @@
+import json
+import logging
+import threading
+from collections import deque, namedtuple
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+LogEntry = namedtuple('LogEntry', 'created level message')
+
+
+class LogQueue:
+    def __init__(self, capacity=5000):
+        self.capacity = capacity
+        self.dropped = 0
+        self._entries = deque()
+        self._lock = threading.Lock()
+
+    def put(self, entry):
+        with self._lock:
+            if len(self._entries) >= self.capacity:
+                self._entries.popleft()
+                self.dropped += 1
+            self._entries.append(entry)
+
+    def drain(self, limit=None):
+        with self._lock:
+            count = len(self._entries) if limit is None else min(limit, len(self._entries))
+            batch = [self._entries.popleft() for _ in range(count)]
+            dropped, self.dropped = self.dropped, 0
+        return batch, dropped
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ActivityLogHandler(logging.Handler):
+    def __init__(self, log_queue, level=logging.INFO):
+        super().__init__(level)
+        self.log_queue = log_queue
+
+    def emit(self, record):
+        try:
+            message = record.getMessage()
+            if record.exc_info:
+                message = f"{message}: {record.exc_info[1]}"
+            self.log_queue.put(LogEntry(record.created, record.levelno, message))
+        except Exception:
+            self.handleError(record)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def json_file_handler(path, max_bytes=10 * 1024 * 1024, backup_count=5, level=logging.INFO):
+    handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                  encoding='utf-8', delay=True)
+    handler.setLevel(level)
+    handler.setFormatter(JsonLinesFormatter())
+    return handler
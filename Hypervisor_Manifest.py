@@ -0,0 +1,412 @@
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import libvirt
+from slugify import slugify
+
+from Hypervisor_Connection import ConnectionManager
+from Hypervisor_Controller import define_and_start, ensure_network
+from Hypervisor_DomainXML import build_domain_xml
+from Hypervisor_Jobs import JobCancelled
+from Hypervisor_Placement import PlacementError, check_admission, host_state
+from Hypervisor_Storage import STORAGE_PROFILES, DEFAULT_PROFILE, driver_attributes, storage_profile
+from Hypervisor_Templates import CLONE_MODES, LINKED, TemplateCatalog, clone_disks, template_domain_xml
+from Hypervisor_Volumes import DEFAULT_POOL, PREALLOCATED, create_volume, remove_volume, stage_files, storage_pool
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+CREATE = "create"
+UPDATE = "update"
+SKIP = "skip"
+FAIL = "fail"
+ON_EXISTING = (SKIP, UPDATE, FAIL)
+
+NAME_RE = re.compile(r'^[\w-]+$')
+
+DEFAULTS = {
+    'memory': 2048,
+    'vcpus': 2,
+    'disk': 20,
+    'network': "default",
+    'profile': DEFAULT_PROFILE,
+    'iso': None,
+    'virtio': None,
+    'template': None,
+    'mode': LINKED,
+    'numa': False,
+    'hugepages': False,
+}
+SPEC_KEYS = set(DEFAULTS) | {'name', 'count'}
+
+
+class ManifestError(Exception):
+    def __init__(self, errors):
+        super().__init__("\n".join(errors))
+        self.errors = errors
+
+
+def load_manifest(path):
+    with open(path) as f:
+        text = f.read()
+    if path.endswith(('.yaml', '.yml')):
+        if yaml is None:
+            raise ManifestError([f"PyYAML is required to read {path}"])
+        try:
+            data = yaml.safe_load(text)
+        except yaml.YAMLError as e:
+            raise ManifestError([f"{path}: {e}"])
+    else:
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ManifestError([f"{path}: {e}"])
+    if isinstance(data, list):
+        data = {'vms': data}
+    if not isinstance(data, dict) or not isinstance(data.get('vms'), list):
+        raise ManifestError([f"{path}: expected a list of VMs or a mapping with a 'vms' list"])
+    manifest = {
+        'path': path,
+        'on_existing': data.get('on_existing', SKIP),
+        'pool': data.get('pool', DEFAULT_POOL),
+        'disk_concurrency': data.get('disk_concurrency', 4),
+        'start_concurrency': data.get('start_concurrency', 2),
+        'vms': expand_specs(data['vms'], {**DEFAULTS, **data.get('defaults', {})}),
+    }
+    errors = []
+    if manifest['on_existing'] not in ON_EXISTING:
+        errors.append(f"on_existing must be one of {', '.join(ON_EXISTING)}")
+    for key in ('disk_concurrency', 'start_concurrency'):
+        if not _positive_int(manifest[key]):
+            errors.append(f"{key} must be a positive integer")
+    if errors:
+        raise ManifestError(errors)
+    return manifest
+
+
+def expand_specs(entries, defaults):
+    specs = []
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            raise ManifestError([f"VM #{i + 1}: expected a mapping"])
+        unknown = set(entry) - SPEC_KEYS
+        if unknown:
+            raise ManifestError([f"VM #{i + 1}: unknown field(s) {', '.join(sorted(unknown))}"])
+        spec = {**defaults, **entry}
+        count = spec.pop('count', None)
+        if count is None:
+            specs.append(spec)
+            continue
+        if not _positive_int(count):
+            raise ManifestError([f"VM #{i + 1}: count must be a positive integer"])
+        if not spec.get('name'):
+            raise ManifestError([f"VM #{i + 1}: count needs a name to number the VMs"])
+        width = max(2, len(str(count)))
+        specs.extend({**spec, 'name': f"{spec.get('name')}-{n:0{width}d}"} for n in range(1, count + 1))
+    return specs
+
+
+def _positive_int(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+def volume_name(name):
+    return f"{slugify(name)}.qcow2"
+
+
+def _spec_errors(spec, catalog, networks, uri):
+    name = spec.get('name')
+    errors = []
+    if not isinstance(name, str) or not NAME_RE.match(name):
+        return [f"{name!r}: name can only contain letters, numbers, underscores, and hyphens"]
+    for key in ('memory', 'vcpus', 'disk'):
+        if not _positive_int(spec[key]):
+            errors.append(f"{name}: {key} must be a positive integer")
+    if spec['profile'] not in STORAGE_PROFILES:
+        errors.append(f"{name}: unknown storage profile '{spec['profile']}'")
+    if spec['network'] not in networks:
+        errors.append(f"{name}: network '{spec['network']}' not available (have {', '.join(networks) or 'none'})")
+    if spec['template']:
+        template = catalog.get(spec['template'])
+        if template is None:
+            errors.append(f"{name}: unknown template '{spec['template']}'")
+        elif template['uri'] != uri:
+            errors.append(f"{name}: template '{spec['template']}' belongs to {template['uri']}")
+        if spec['mode'] not in CLONE_MODES:
+            errors.append(f"{name}: clone mode must be one of {', '.join(CLONE_MODES)}")
+    elif not spec['iso']:
+        errors.append(f"{name}: either 'iso' or 'template' is required")
+    for key in ('iso', 'virtio'):
+        if spec[key] and not spec['template'] and not os.path.exists(spec[key]):
+            errors.append(f"{name}: {key} file '{spec[key]}' does not exist")
+    if spec['hugepages'] and not spec['numa']:
+        errors.append(f"{name}: hugepages require numa: true")
+    return errors
+
+
+def validate_manifest(manager, manifest, catalog, settings=None):
+    settings = settings or {}
+    errors = []
+    seen = set()
+    with manager.lease() as conn:
+        networks = conn.listNetworks() + conn.listDefinedNetworks()
+        existing = {dom.name(): dom for dom in conn.listAllDomains(0)}
+        state = host_state(conn, settings.get('reserved_cpus', ()))
+        try:
+            pool = storage_pool(conn, manifest['pool'])
+            volumes = set(pool.listVolumes())
+            pool_free = pool.info()[3]
+        except RuntimeError as e:
+            pool = None
+            errors.append(str(e))
+        plans = []
+        for spec in manifest['vms']:
+            spec_errors = _spec_errors(spec, catalog, networks, manager.uri)
+            if spec['name'] in seen:
+                spec_errors.append(f"{spec['name']}: listed more than once")
+            seen.add(spec['name'])
+            if spec_errors:
+                errors.extend(spec_errors)
+                continue
+            plan = dict(spec)
+            dom = existing.get(spec['name'])
+            if dom is None:
+                plan['action'] = CREATE
+                if pool and volume_name(spec['name']) in volumes:
+                    errors.append(f"{spec['name']}: volume {volume_name(spec['name'])} already exists in pool "
+                                  f"'{manifest['pool']}'")
+                plan['added_vcpus'] = spec['vcpus']
+                plan['added_memory_kib'] = spec['memory'] * 1024
+            elif manifest['on_existing'] == FAIL:
+                errors.append(f"{spec['name']}: a VM with this name already exists")
+                continue
+            else:
+                plan['action'] = manifest['on_existing']
+                info = dom.info()
+                grow = plan['action'] == UPDATE and dom.isActive()
+                plan['added_vcpus'] = max(0, spec['vcpus'] - info[3]) if grow else 0
+                plan['added_memory_kib'] = max(0, spec['memory'] * 1024 - info[1]) if grow else 0
+            plans.append(plan)
+    try:
+        check_admission(state, sum(p['added_vcpus'] for p in plans), sum(p['added_memory_kib'] for p in plans),
+                        settings.get('cpu_ratio', 4.0), settings.get('memory_ratio', 1.0))
+    except PlacementError as e:
+        errors.append(f"Host capacity: {e}")
+    preallocated = sum(plan['disk'] for plan in plans if plan['action'] == CREATE and not plan['template']
+                       and storage_profile(plan['profile']).get('preallocation') in PREALLOCATED)
+    if preallocated and pool:
+        free_gb = pool_free / 1024 ** 3
+        if preallocated > free_gb:
+            errors.append(f"Host capacity: {preallocated} GB of preallocated disks, {free_gb:.0f} GB free in "
+                          f"pool '{manifest['pool']}'")
+    if errors:
+        raise ManifestError(errors)
+    return plans
+
+
+def _timed(result, step, func, *args, **kwargs):
+    started = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        result['steps'][step] = round(time.perf_counter() - started, 3)
+
+
+def _set_config_value(current, target, set_current, set_maximum):
+    if target > current:
+        set_maximum(target)
+        set_current(target)
+    elif target < current:
+        set_current(target)
+        set_maximum(target)
+
+
+def update_domain(manager, plan):
+    config = libvirt.VIR_DOMAIN_AFFECT_CONFIG
+    with manager.lease() as conn:
+        dom = conn.lookupByName(plan['name'])
+        current_kib = dom.maxMemory()
+        vcpus = dom.vcpusFlags(config | libvirt.VIR_DOMAIN_VCPU_MAXIMUM)
+        memory_kib = plan['memory'] * 1024
+        if current_kib == memory_kib and vcpus == plan['vcpus']:
+            return "unchanged"
+        _set_config_value(current_kib, memory_kib,
+                          lambda kib: dom.setMemoryFlags(kib, config),
+                          lambda kib: dom.setMemoryFlags(kib, config | libvirt.VIR_DOMAIN_MEM_MAXIMUM))
+        _set_config_value(vcpus, plan['vcpus'],
+                          lambda count: dom.setVcpusFlags(count, config),
+                          lambda count: dom.setVcpusFlags(count, config | libvirt.VIR_DOMAIN_VCPU_MAXIMUM))
+    logging.info(f"VM '{plan['name']}' updated to {plan['memory']} MB, {plan['vcpus']} vCPUs (applies at next boot)")
+    return "updated"
+
+
+def _create_disks(manager, plan, pool, check_cancelled):
+    profile = storage_profile(plan['profile'])
+    with manager.lease() as conn:
+        if plan['template']:
+            return clone_disks(conn, plan['template_info'], slugify(plan['name']), plan['mode'], pool, check_cancelled,
+                               profile)
+        return {None: (create_volume(conn, pool, volume_name(plan['name']), plan['disk'], profile), 'qcow2')}
+
+
+def _remove_disks(manager, disk_paths):
+    with manager.lease() as conn:
+        for path, _ in disk_paths.values():
+            remove_volume(conn, path, local=False)
+
+
+def _domain_xml(plan, disk_paths):
+    profile = storage_profile(plan['profile'])
+    driver = driver_attributes(profile, plan['vcpus'])
+    if plan['template']:
+        return template_domain_xml(plan['template_info'], plan['name'], disk_paths, plan['network'],
+                                   plan['memory'], plan['vcpus'], driver, profile.get('iothreads', 0))
+    path, _ = disk_paths[None]
+    return build_domain_xml(plan['name'], plan['memory'], plan['vcpus'], path, plan['network'], cdroms=plan['cdroms'],
+                            driver=driver, iothreads=profile.get('iothreads', 0))
+
+
+def _provision_vm(manager, plan, slots, settings, pool, check_cancelled):
+    result = {'name': plan['name'], 'action': plan['action'], 'status': None, 'steps': {}, 'error': None}
+    started = time.perf_counter()
+    disk_paths = {}
+    try:
+        if plan['action'] == SKIP:
+            result['status'] = "skipped"
+            return result
+        check_cancelled()
+        if plan['action'] == UPDATE:
+            result['status'] = _timed(result, 'update', update_domain, manager, plan)
+            return result
+        with slots['disk']:
+            check_cancelled()
+            disk_paths = _timed(result, 'disk', _create_disks, manager, plan, pool, check_cancelled)
+        xml_config = _timed(result, 'xml', _domain_xml, plan, disk_paths)
+        placement = None
+        if plan['numa']:
+            placement = {**settings, 'hugepages': plan['hugepages']}
+        with slots['start']:
+            check_cancelled()
+            result['uuid'] = _timed(result, 'define_start', define_and_start, manager, plan['name'], xml_config,
+                                    plan['vcpus'], plan['memory'], placement, strict=True)
+        result['status'] = "created"
+    except JobCancelled as e:
+        result['status'] = "cancelled"
+        result['error'] = str(e)
+    except (libvirt.libvirtError, PlacementError, RuntimeError, OSError) as e:
+        logging.error(f"Provisioning '{plan['name']}' failed: {e}")
+        result['status'] = "failed"
+        result['error'] = str(e)
+    finally:
+        result['elapsed'] = round(time.perf_counter() - started, 3)
+    if disk_paths and result['status'] in ("failed", "cancelled"):
+        try:
+            _timed(result, 'rollback', _remove_disks, manager, disk_paths)
+        except (libvirt.libvirtError, OSError) as e:
+            logging.error(f"Rolling back '{plan['name']}' left disks behind: {e}")
+    return result
+
+
+def provision(manager, manifest, plans, catalog, settings=None, on_progress=None, check_cancelled=None):
+    settings = settings or {}
+    check_cancelled = check_cancelled or (lambda: None)
+    started = time.time()
+    for plan in plans:
+        plan['template_info'] = catalog.get(plan['template']) if plan['template'] else None
+    creating = [plan for plan in plans if plan['action'] == CREATE]
+    isos = sorted({iso for plan in creating if not plan['template'] for iso in (plan['iso'], plan['virtio']) if iso})
+    with manager.lease() as conn:
+        for network in {plan['network'] for plan in creating}:
+            ensure_network(conn, network)
+        staged = dict(zip(isos, stage_files(conn, manager.uri, isos, manifest['pool'],
+                                            check_cancelled=check_cancelled)))
+    for plan in creating:
+        plan['cdroms'] = [staged[iso] for iso in (plan['iso'], plan['virtio']) if iso]
+    slots = {
+        'disk': threading.BoundedSemaphore(manifest['disk_concurrency']),
+        'start': threading.BoundedSemaphore(manifest['start_concurrency']),
+    }
+    lock = threading.Lock()
+    done = [0]
+
+    def run(plan):
+        result = _provision_vm(manager, plan, slots, settings, manifest['pool'], check_cancelled)
+        with lock:
+            done[0] += 1
+            if on_progress:
+                on_progress(done[0] / len(plans) * 100)
+        return result
+
+    workers = max(1, min(len(plans), manifest['disk_concurrency'] + manifest['start_concurrency']))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="provision") as executor:
+        results = list(executor.map(run, plans))
+    report = {
+        'manifest': manifest['path'],
+        'uri': manager.uri,
+        'started': started,
+        'elapsed': round(time.time() - started, 3),
+        'disk_concurrency': manifest['disk_concurrency'],
+        'start_concurrency': manifest['start_concurrency'],
+        'summary': dict(Counter(result['status'] for result in results)),
+        'vms': results,
+    }
+    logging.info(f"Manifest {os.path.basename(manifest['path'])}: "
+                 f"{', '.join(f'{count} {status}' for status, count in report['summary'].items())} "
+                 f"in {report['elapsed']:.1f}s")
+    return report
+
+
+def report_path(manifest_path):
+    return f"{os.path.splitext(manifest_path)[0]}.report.json"
+
+
+def write_report(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Provision VMs from a JSON or YAML manifest")
+    parser.add_argument('manifest')
+    parser.add_argument('--uri', default="qemu:///system")
+    parser.add_argument('--check', action='store_true', help="validate only")
+    parser.add_argument('--report', help="report path (default: <manifest>.report.json)")
+    parser.add_argument('--cpu-ratio', type=float, default=4.0)
+    parser.add_argument('--memory-ratio', type=float, default=1.0)
+    args = parser.parse_args(argv)
+    manager = ConnectionManager(args.uri)
+    catalog = TemplateCatalog()
+    settings = {'cpu_ratio': args.cpu_ratio, 'memory_ratio': args.memory_ratio}
+    try:
+        manifest = load_manifest(args.manifest)
+        plans = validate_manifest(manager, manifest, catalog, settings)
+        if args.check:
+            print(json.dumps(dict(Counter(plan['action'] for plan in plans)), indent=2))
+            return 0
+        report = provision(manager, manifest, plans, catalog, settings)
+    except ManifestError as e:
+        print(json.dumps({'errors': e.errors}, indent=2))
+        return 2
+    except (libvirt.libvirtError, RuntimeError, OSError) as e:
+        print(json.dumps({'error': str(e)}))
+        return 1
+    finally:
+        manager.close()
+    write_report(report, args.report or report_path(args.manifest))
+    print(json.dumps(report['summary'], indent=2))
+    return 0 if 'failed' not in report['summary'] else 1
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,209 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import libvirt
+import numpy as np
+
+from Hypervisor_Inventory import row_key
+
+METRIC_FIELDS = ('cpu_time', 'vcpu_time', 'vcpus', 'rd_bytes', 'wr_bytes', 'rx_bytes', 'tx_bytes',
+                 'balloon_current', 'balloon_available', 'balloon_unused')
+COUNTER_FIELDS = ('cpu_time', 'vcpu_time', 'rd_bytes', 'wr_bytes', 'rx_bytes', 'tx_bytes')
+
+METRIC_STATS = (libvirt.VIR_DOMAIN_STATS_CPU_TOTAL |
+                libvirt.VIR_DOMAIN_STATS_VCPU |
+                libvirt.VIR_DOMAIN_STATS_BLOCK |
+                libvirt.VIR_DOMAIN_STATS_INTERFACE |
+                libvirt.VIR_DOMAIN_STATS_BALLOON)
+
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+
+def _sum_group(stats, prefix, count_key, suffix):
+    return float(sum(stats.get(f"{prefix}.{i}.{suffix}", 0) for i in range(stats.get(count_key, 0))))
+
+
+def stats_vector(stats):
+    vcpus = stats.get('vcpu.current', 0)
+    return [
+        float(stats.get('cpu.time', np.nan)),
+        float(sum(stats.get(f"vcpu.{i}.time", 0) for i in range(vcpus))),
+        float(vcpus) if vcpus else np.nan,
+        _sum_group(stats, 'block', 'block.count', 'rd.bytes'),
+        _sum_group(stats, 'block', 'block.count', 'wr.bytes'),
+        _sum_group(stats, 'net', 'net.count', 'rx.bytes'),
+        _sum_group(stats, 'net', 'net.count', 'tx.bytes'),
+        float(stats.get('balloon.current', np.nan)),
+        float(stats.get('balloon.available', np.nan)),
+        float(stats.get('balloon.unused', np.nan)),
+    ]
+
+
+def sparkline(values):
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if values.size == 0:
+        return ""
+    low, high = values.min(), values.max()
+    if high - low <= 0:
+        return SPARK_CHARS[0] * values.size
+    levels = ((values - low) / (high - low) * (len(SPARK_CHARS) - 1)).round().astype(int)
+    return "".join(SPARK_CHARS[level] for level in levels)
+
+
+class MetricsStore:
+    def __init__(self, capacity=120, fields=METRIC_FIELDS):
+        self.capacity = capacity
+        self.fields = fields
+        self.columns = {field: i for i, field in enumerate(fields)}
+        self.counters = np.array([field in COUNTER_FIELDS for field in fields])
+        self.keys = []
+        self.index = {}
+        self.names = {}
+        self.values = np.full((16, capacity, len(fields)), np.nan)
+        self.times = np.full(capacity, np.nan)
+        self.head = -1
+        self.count = 0
+        self.pushes = 0
+        self._lock = threading.Lock()
+
+    def _row(self, key):
+        row = self.index.get(key)
+        if row is None:
+            row = len(self.keys)
+            if row >= self.values.shape[0]:
+                grown = np.full((self.values.shape[0] * 2, self.capacity, len(self.fields)), np.nan)
+                grown[:row] = self.values
+                self.values = grown
+            self.keys.append(key)
+            self.index[key] = row
+        return row
+
+    def push(self, timestamp, samples, names=None):
+        with self._lock:
+            if names:
+                self.names.update(names)
+            rows = [self._row(key) for key in samples]
+            self.head = (self.head + 1) % self.capacity
+            self.times[self.head] = timestamp
+            self.values[:, self.head, :] = np.nan
+            if rows:
+                self.values[rows, self.head, :] = np.array(list(samples.values()), dtype=float)
+            self.count = min(self.count + 1, self.capacity)
+            self.pushes += 1
+            if self.pushes % self.capacity == 0:
+                self._compact()
+
+    def _compact(self):
+        n = len(self.keys)
+        alive = ~np.all(np.isnan(self.values[:n]), axis=(1, 2))
+        if alive.all():
+            return
+        keep = np.flatnonzero(alive)
+        size = max(16, 1 << int(len(keep)).bit_length())
+        values = np.full((size, self.capacity, len(self.fields)), np.nan)
+        values[:len(keep)] = self.values[keep]
+        self.values = values
+        for row in np.flatnonzero(~alive):
+            self.names.pop(self.keys[row], None)
+        self.keys = [self.keys[row] for row in keep]
+        self.index = {key: row for row, key in enumerate(self.keys)}
+
+    def latest(self):
+        with self._lock:
+            n = len(self.keys)
+            if self.count < 2:
+                return list(self.keys), None
+            previous = (self.head - 1) % self.capacity
+            dt = self.times[self.head] - self.times[previous]
+            current = self.values[:n, self.head, :].copy()
+            before = self.values[:n, previous, :].copy()
+            keys = list(self.keys)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rates = np.where(self.counters, (current - before) / dt, current)
+        rates[rates < 0] = np.nan
+        return keys, {field: rates[:, column] for field, column in self.columns.items()}
+
+    def series(self, key, field, rate=True):
+        with self._lock:
+            row = self.index.get(key)
+            if row is None or self.count == 0:
+                return np.array([])
+            order = (np.arange(self.count) + self.head - self.count + 1) % self.capacity
+            times = self.times[order]
+            values = self.values[row, order, self.columns[field]]
+        if not rate:
+            return values
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rates = np.diff(values) / np.diff(times)
+        rates[rates < 0] = np.nan
+        return rates
+
+
+def derived_metrics(rates):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cpu = rates['cpu_time'] / 1e7 / rates['vcpus']
+        used_kib = np.where(np.isnan(rates['balloon_available']),
+                            rates['balloon_current'],
+                            rates['balloon_available'] - rates['balloon_unused'])
+    return {
+        'cpu': cpu,
+        'rd': rates['rd_bytes'] / 1048576,
+        'wr': rates['wr_bytes'] / 1048576,
+        'rx': rates['rx_bytes'] / 1048576,
+        'tx': rates['tx_bytes'] / 1048576,
+        'mem': used_kib / 1024,
+    }
+
+
+class MetricsSampler:
+    def __init__(self, managers, store, interval=2.0):
+        self.managers = managers
+        self.store = store
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="metrics")
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="metrics-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _sample_host(self, uri, manager):
+        with manager.lease(timeout=self.interval) as conn:
+            records = conn.getAllDomainStats(METRIC_STATS, libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_ACTIVE)
+        samples = {}
+        names = {}
+        for dom, stats in records:
+            key = row_key(uri, dom.UUIDString())
+            samples[key] = stats_vector(stats)
+            names[key] = dom.name()
+        return samples, names
+
+    def sample(self):
+        futures = [self._executor.submit(self._sample_host, uri, manager)
+                   for uri, manager in list(self.managers().items())]
+        done, _ = wait(futures, timeout=self.interval)
+        samples = {}
+        names = {}
+        for future in done:
+            try:
+                host_samples, host_names = future.result()
+            except libvirt.libvirtError as e:
+                logging.warning(f"Metrics sampling failed: {e}")
+                continue
+            samples.update(host_samples)
+            names.update(host_names)
+        self.store.push(time.monotonic(), samples, names)
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            self.sample()
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
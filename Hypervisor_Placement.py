@@ -0,0 +1,379 @@
+import time
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+import libvirt
+
+from Hypervisor_Inventory import is_unsupported
+
+HUGEPAGE_KIB = 2048
+SPREAD = "spread"
+PACK = "pack"
+NUMA_FIT = "numa-fit"
+
+HostCell = namedtuple('HostCell', 'id cpus memory_kib free_kib free_hugepages')
+Placement = namedtuple('Placement', 'cells vcpu_pins emulator_cpus memory_mode hugepages')
+HostCapacity = namedtuple('HostCapacity', 'uri host state free_kib cpu_busy pool_free domains networks')
+HostDecision = namedtuple('HostDecision', 'uri host strategy score reason candidates rejected')
+
+
+class PlacementError(Exception):
+    pass
+
+
+def parse_cpuset(text):
+    cpus = set()
+    excluded = set()
+    for part in (text or "").split(','):
+        part = part.strip()
+        if not part:
+            continue
+        target = excluded if part.startswith('^') else cpus
+        part = part.lstrip('^')
+        if '-' in part:
+            start, end = part.split('-')
+            target.update(range(int(start), int(end) + 1))
+        else:
+            target.add(int(part))
+    return cpus - excluded
+
+
+def format_cpuset(cpus):
+    cpus = sorted(cpus)
+    ranges = []
+    for cpu in cpus:
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(start) if start == end else f"{start}-{end}" for start, end in ranges)
+
+
+class HostState:
+    def __init__(self, cells, memory_kib, reserved_cpus=()):
+        self.cells = cells
+        self.memory_kib = memory_kib
+        self.reserved_cpus = set(reserved_cpus)
+        self.cpu_load = {cpu: 0.0 for cell in cells for cpu in cell.cpus}
+        self.allocated_vcpus = 0
+        self.allocated_memory_kib = 0
+
+    @property
+    def cpu_count(self):
+        return len(self.cpu_load)
+
+    def add_domain(self, xml_desc):
+        root = ET.fromstring(xml_desc)
+        vcpus = int(root.findtext('vcpu', '0'))
+        self.allocated_vcpus += vcpus
+        self.allocated_memory_kib += int(root.findtext('memory', '0'))
+        pinned = 0
+        for pin in root.findall('./cputune/vcpupin'):
+            cpus = parse_cpuset(pin.get('cpuset')) & self.cpu_load.keys()
+            for cpu in cpus:
+                self.cpu_load[cpu] += 1.0 / len(cpus)
+            pinned += 1
+        floating = vcpus - pinned
+        if floating > 0:
+            cpuset = parse_cpuset(root.find('vcpu').get('cpuset')) & self.cpu_load.keys()
+            cpus = cpuset or self.cpu_load.keys()
+            for cpu in cpus:
+                self.cpu_load[cpu] += floating / len(cpus)
+
+    def add_pending(self, xml_desc, plan):
+        self.add_domain(xml_desc)
+        used = {cell_id: memory_kib for cell_id, _, memory_kib in plan.cells}
+        self.cells = [cell._replace(free_hugepages=cell.free_hugepages - used.get(cell.id, 0) // HUGEPAGE_KIB)
+                      if plan.hugepages else cell._replace(free_kib=cell.free_kib - used.get(cell.id, 0))
+                      for cell in self.cells]
+
+
+def parse_cells(capabilities_xml):
+    root = ET.fromstring(capabilities_xml)
+    cells = []
+    for cell in root.findall('./host/topology/cells/cell'):
+        memory = cell.find('memory')
+        memory_kib = int(memory.text) if memory is not None else 0
+        pages = {int(page.get('size')): int(page.text) for page in cell.findall('pages')}
+        cpus = [int(cpu.get('id')) for cpu in cell.findall('./cpus/cpu')]
+        cells.append(HostCell(int(cell.get('id')), cpus, memory_kib, memory_kib, pages.get(HUGEPAGE_KIB, 0)))
+    return cells
+
+
+def host_state(conn, reserved_cpus=()):
+    info = conn.getInfo()
+    cells = parse_cells(conn.getCapabilities())
+    if not cells:
+        cells = [HostCell(0, list(range(info[2])), info[1] * 1024, info[1] * 1024, 0)]
+    free = {cell.id: conn.getCellsFreeMemory(cell.id, 1)[0] for cell in cells}
+    free_pages = {}
+    try:
+        for cell in cells:
+            free_pages.update(conn.getFreePages([HUGEPAGE_KIB], cell.id, 1))
+    except libvirt.libvirtError as e:
+        if not is_unsupported(e):
+            raise
+    cells = [cell._replace(free_kib=free[cell.id] // 1024,
+                           free_hugepages=free_pages.get(cell.id, {}).get(HUGEPAGE_KIB, 0))
+             for cell in cells]
+    state = HostState(cells, info[1] * 1024, reserved_cpus)
+    for dom in conn.listAllDomains(libvirt.VIR_CONNECT_LIST_DOMAINS_ACTIVE):
+        try:
+            state.add_domain(dom.XMLDesc(0))
+        except libvirt.libvirtError as e:
+            if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                raise
+    return state
+
+
+def check_admission(state, vcpus, memory_kib, cpu_ratio, memory_ratio):
+    vcpu_limit = state.cpu_count * cpu_ratio
+    if state.allocated_vcpus + vcpus > vcpu_limit:
+        raise PlacementError(
+            f"Not enough CPU: {state.allocated_vcpus} + {vcpus} vCPUs exceeds "
+            f"{vcpu_limit:.0f} ({state.cpu_count} CPUs x {cpu_ratio})")
+    memory_limit = state.memory_kib * memory_ratio
+    if state.allocated_memory_kib + memory_kib > memory_limit:
+        raise PlacementError(
+            f"Not enough memory: {(state.allocated_memory_kib + memory_kib) // 1024} MB requested of "
+            f"{memory_limit // 1024:.0f} MB ({memory_ratio}x overcommit)")
+
+
+def _cell_capacity(cell, hugepages):
+    return cell.free_hugepages * HUGEPAGE_KIB if hugepages else cell.free_kib
+
+
+def _pick_cpus(state, cell_ids, count):
+    candidates = [cpu for cell in state.cells if cell.id in cell_ids for cpu in cell.cpus
+                  if cpu not in state.reserved_cpus]
+    if not candidates:
+        raise PlacementError("No usable host CPUs on the selected NUMA node(s)")
+    candidates.sort(key=lambda cpu: (state.cpu_load[cpu], cpu))
+    return [candidates[i % len(candidates)] for i in range(count)]
+
+
+def plan_placement(state, vcpus, memory_mb, hugepages=False, cpu_ratio=4.0, memory_ratio=1.0):
+    memory_kib = memory_mb * 1024
+    if hugepages and memory_kib % HUGEPAGE_KIB:
+        raise PlacementError(f"Memory must be a multiple of {HUGEPAGE_KIB // 1024} MB to use hugepages")
+    check_admission(state, vcpus, memory_kib, cpu_ratio, memory_ratio)
+    fitting = [cell for cell in state.cells if _cell_capacity(cell, hugepages) >= memory_kib]
+    if fitting:
+        cell = min(fitting, key=lambda c: (sum(state.cpu_load[cpu] for cpu in c.cpus) / max(1, len(c.cpus)),
+                                           -_cell_capacity(c, hugepages)))
+        cells = [(cell.id, vcpus, memory_kib)]
+        memory_mode = 'strict'
+    else:
+        ordered = sorted(state.cells, key=lambda c: -_cell_capacity(c, hugepages))
+        cells = []
+        remaining = memory_kib
+        for cell in ordered:
+            if remaining <= 0:
+                break
+            share = min(remaining, _cell_capacity(cell, hugepages))
+            if hugepages:
+                share -= share % HUGEPAGE_KIB
+            if share <= 0:
+                continue
+            cells.append([cell.id, 0, share])
+            remaining -= share
+        if remaining > 0:
+            if hugepages:
+                raise PlacementError(f"Not enough free {HUGEPAGE_KIB // 1024} MB hugepages for {memory_mb} MB")
+            if memory_ratio <= 1.0:
+                raise PlacementError(f"Not enough free memory on the NUMA nodes for {memory_mb} MB")
+            cells = [[ordered[0].id, vcpus, memory_kib]]
+            memory_mode = 'preferred'
+        else:
+            memory_mode = 'strict'
+            if len(cells) > vcpus:
+                raise PlacementError(f"{memory_mb} MB spans {len(cells)} NUMA nodes but the VM has only {vcpus} vCPUs")
+            assigned = 0
+            for i, cell in enumerate(cells):
+                cell[1] = max(1, round(vcpus * cell[2] / memory_kib)) if i < len(cells) - 1 else vcpus - assigned
+                assigned += cell[1]
+            if cells[-1][1] <= 0:
+                raise PlacementError(f"Cannot split {vcpus} vCPUs across {len(cells)} NUMA nodes")
+        cells = [tuple(cell) for cell in cells]
+    vcpu_pins = []
+    for cell_id, cell_vcpus, _ in cells:
+        vcpu_pins.extend(_pick_cpus(state, {cell_id}, cell_vcpus))
+    emulator_cpus = [cpu for cell in state.cells if cell.id in {c[0] for c in cells} for cpu in cell.cpus
+                     if cpu not in state.reserved_cpus]
+    return Placement(cells, vcpu_pins, emulator_cpus, memory_mode, hugepages)
+
+
+def _replace(root, tag):
+    node = root.find(tag)
+    if node is not None:
+        root.remove(node)
+    node = ET.SubElement(root, tag)
+    return node
+
+
+def apply_placement(xml_desc, placement):
+    root = ET.fromstring(xml_desc)
+    cputune = _replace(root, 'cputune')
+    for vcpu, cpu in enumerate(placement.vcpu_pins):
+        ET.SubElement(cputune, 'vcpupin', vcpu=str(vcpu), cpuset=str(cpu))
+    emulator_cpuset = format_cpuset(placement.emulator_cpus)
+    ET.SubElement(cputune, 'emulatorpin', cpuset=emulator_cpuset)
+    iothreads = int(root.findtext('iothreads', '0'))
+    for iothread in range(1, iothreads + 1):
+        ET.SubElement(cputune, 'iothreadpin', iothread=str(iothread), cpuset=emulator_cpuset)
+    numatune = _replace(root, 'numatune')
+    nodeset = format_cpuset(cell_id for cell_id, _, _ in placement.cells)
+    ET.SubElement(numatune, 'memory', mode=placement.memory_mode, nodeset=nodeset)
+    if len(placement.cells) > 1:
+        for guest_cell, (cell_id, _, _) in enumerate(placement.cells):
+            ET.SubElement(numatune, 'memnode', cellid=str(guest_cell), mode='strict', nodeset=str(cell_id))
+    cpu = root.find('cpu')
+    if cpu is None:
+        cpu = ET.SubElement(root, 'cpu', mode='host-passthrough')
+    for tag in ('topology', 'numa'):
+        node = cpu.find(tag)
+        if node is not None:
+            cpu.remove(node)
+    cell_vcpus = {count for _, count, _ in placement.cells}
+    if len(cell_vcpus) == 1:
+        ET.SubElement(cpu, 'topology', sockets=str(len(placement.cells)), dies='1',
+                      cores=str(cell_vcpus.pop()), threads='1')
+    numa = ET.SubElement(cpu, 'numa')
+    first = 0
+    for guest_cell, (_, count, memory_kib) in enumerate(placement.cells):
+        cpus = format_cpuset(range(first, first + count))
+        ET.SubElement(numa, 'cell', id=str(guest_cell), cpus=cpus, memory=str(memory_kib), unit='KiB')
+        first += count
+    backing = root.find('memoryBacking')
+    if placement.hugepages:
+        if backing is None:
+            backing = ET.SubElement(root, 'memoryBacking')
+        hugepages = backing.find('hugepages')
+        if hugepages is not None:
+            backing.remove(hugepages)
+        hugepages = ET.SubElement(backing, 'hugepages')
+        ET.SubElement(hugepages, 'page', size=str(HUGEPAGE_KIB), unit='KiB')
+    elif backing is not None and backing.find('hugepages') is not None:
+        backing.remove(backing.find('hugepages'))
+    return ET.tostring(root, encoding='unicode')
+
+
+def cpu_busy(conn, interval=0.2):
+    try:
+        first = conn.getCPUStats(libvirt.VIR_NODE_CPU_STATS_ALL_CPUS, 0)
+        time.sleep(interval)
+        second = conn.getCPUStats(libvirt.VIR_NODE_CPU_STATS_ALL_CPUS, 0)
+    except libvirt.libvirtError as e:
+        if not is_unsupported(e):
+            raise
+        return None
+    total = sum(second.values()) - sum(first.values())
+    idle = sum(second.get(key, 0) - first.get(key, 0) for key in ('idle', 'iowait'))
+    return min(1.0, max(0.0, 1.0 - idle / total)) if total > 0 else 0.0
+
+
+def host_capacity(conn, uri, host, pool_name=None, reserved_cpus=(), interval=0.2):
+    state = host_state(conn, reserved_cpus)
+    pool_free = None
+    if pool_name:
+        try:
+            pool = conn.storagePoolLookupByName(pool_name)
+            pool_free = pool.info()[3] if pool.isActive() else None
+        except libvirt.libvirtError as e:
+            if e.get_error_code() != libvirt.VIR_ERR_NO_STORAGE_POOL:
+                raise
+            pool_free = 0
+    return HostCapacity(uri, host, state, conn.getFreeMemory() // 1024, cpu_busy(conn, interval), pool_free,
+                        conn.numOfDomains(), conn.listNetworks() + conn.listDefinedNetworks())
+
+
+def host_load(capacity):
+    if capacity.cpu_busy is not None:
+        return capacity.cpu_busy
+    return min(1.0, capacity.state.allocated_vcpus / max(1, capacity.state.cpu_count))
+
+
+def _describe(capacity):
+    pool = "" if capacity.pool_free is None else f", {capacity.pool_free / 1024 ** 3:.0f} GB pool free"
+    return (f"{capacity.free_kib // 1024} MB free, CPU {host_load(capacity):.0%} busy, "
+            f"{capacity.domains} running{pool}")
+
+
+def spread_score(capacity, vcpus, memory_kib, settings):
+    headroom = max(0.0, 1.0 - memory_kib / max(1, capacity.free_kib))
+    score = 0.5 * headroom + 0.3 * (1.0 - host_load(capacity)) + 0.2 / (1 + capacity.domains)
+    return score, _describe(capacity)
+
+
+def pack_score(capacity, vcpus, memory_kib, settings):
+    fill = min(1.0, memory_kib / max(1, capacity.free_kib))
+    committed = min(1.0, (capacity.state.allocated_vcpus + vcpus) / max(1, capacity.state.cpu_count))
+    score = 0.6 * fill + 0.3 * committed + 0.1 * (1.0 - host_load(capacity))
+    return score, _describe(capacity)
+
+
+def numa_fit_score(capacity, vcpus, memory_kib, settings):
+    plan = plan_placement(capacity.state, vcpus, memory_kib // 1024, settings.get('hugepages', False),
+                          settings.get('cpu_ratio', 4.0), settings.get('memory_ratio', 1.0))
+    if len(plan.cells) > 1 or plan.memory_mode != 'strict':
+        return 0.5 / len(plan.cells), f"spans NUMA nodes {format_cpuset(cell for cell, _, _ in plan.cells)}, " \
+            f"{_describe(capacity)}"
+    cell = next(cell for cell in capacity.state.cells if cell.id == plan.cells[0][0])
+    fit = memory_kib / max(1, _cell_capacity(cell, plan.hugepages))
+    return 0.5 + 0.5 * fit, f"fits NUMA node {cell.id} ({_cell_capacity(cell, plan.hugepages) // 1024} MB free), " \
+        f"{_describe(capacity)}"
+
+
+STRATEGIES = {
+    SPREAD: spread_score,
+    PACK: pack_score,
+    NUMA_FIT: numa_fit_score,
+}
+
+
+def host_rejection(capacity, vcpus, memory_kib, disk_bytes=0, network=None, settings=None):
+    settings = settings or {}
+    if network and network not in capacity.networks:
+        return f"network '{network}' is not defined"
+    try:
+        check_admission(capacity.state, vcpus, memory_kib, settings.get('cpu_ratio', 4.0),
+                        settings.get('memory_ratio', 1.0))
+    except PlacementError as e:
+        return str(e)
+    if disk_bytes and capacity.pool_free is not None and capacity.pool_free < disk_bytes:
+        return f"only {capacity.pool_free / 1024 ** 3:.1f} GB free in the storage pool, " \
+            f"{disk_bytes / 1024 ** 3:.0f} GB needed"
+    return None
+
+
+def choose_host(capacities, vcpus, memory_mb, disk_bytes=0, network=None, strategy=SPREAD, settings=None,
+                errors=None):
+    settings = settings or {}
+    score_host = STRATEGIES[strategy]
+    memory_kib = memory_mb * 1024
+    rejected = dict(errors or {})
+    candidates = []
+    for capacity in capacities:
+        reason = host_rejection(capacity, vcpus, memory_kib, disk_bytes, network, settings)
+        if reason is None:
+            try:
+                score, reason = score_host(capacity, vcpus, memory_kib, settings)
+                candidates.append((score, capacity, reason))
+                continue
+            except PlacementError as e:
+                reason = str(e)
+        rejected[capacity.host] = reason
+    if not candidates:
+        details = "; ".join(f"{host}: {reason}" for host, reason in rejected.items())
+        raise PlacementError(f"No host can run a {vcpus} vCPU / {memory_mb} MB VM ({details or 'no hosts'})")
+    candidates.sort(key=lambda candidate: (-candidate[0], candidate[1].domains, candidate[1].host))
+    score, capacity, reason = candidates[0]
+    return HostDecision(capacity.uri, capacity.host, strategy, score, reason,
+                        [(c.host, round(sc, 3), r) for sc, c, r in candidates], rejected)
+
+
+def explain_decision(decision, name):
+    lines = [f"Placing '{name}' on {decision.host} ({decision.strategy}, score {decision.score:.2f}): {decision.reason}"]
+    lines += [f"  candidate {host}: score {score:.2f}, {reason}" for host, score, reason in decision.candidates[1:]]
+    lines += [f"  rejected {host}: {reason}" for host, reason in decision.rejected.items()]
+    return lines
@@ -0,0 +1,91 @@
+import logging
+import os
+import threading
+
+from Hypervisor_Templates import image_info, run_qemu_img
+
+RECLAIM_SLOTS = threading.BoundedSemaphore(1)
+DEFAULT_RATE_MB = 100
+SPARSE_FORMATS = ('qcow2', 'raw')
+
+
+def allocated_bytes(path):
+    return os.stat(path).st_blocks * 512
+
+
+def wait_for_slot(check_cancelled=None, poll_interval=1.0):
+    while not RECLAIM_SLOTS.acquire(timeout=poll_interval):
+        if check_cancelled:
+            check_cancelled()
+
+
+def trim_domain(dom, description):
+    if not description.guest_agent_connected:
+        raise RuntimeError(f"'{dom.name()}' is running without a connected guest agent; shut it off to sparsify")
+    dom.fSTrim(None, 0, 0)
+    logging.info(f"Trimmed filesystems of {dom.name()} through the guest agent")
+
+
+def sparsify_image(path, rate_mb=DEFAULT_RATE_MB, on_progress=None, before_replace=None):
+    info = image_info(path)
+    fmt = info['format']
+    if fmt not in SPARSE_FORMATS:
+        raise RuntimeError(f"Cannot sparsify {path}: unsupported format {fmt}")
+    backing = info.get('full-backing-filename')
+    backing_args = ['-B', backing, '-F', info.get('backing-filename-format', 'qcow2')] if backing else []
+    cluster_args = ['-o', f"cluster_size={info['cluster-size']}"] if fmt == 'qcow2' and 'cluster-size' in info else []
+    before = allocated_bytes(path)
+    stat = os.stat(path)
+    temp = f"{path}.sparsify"
+    try:
+        run_qemu_img(['convert', '-r', str(rate_mb * 1048576), '-S', '4k', '-O', fmt, *cluster_args,
+                      *backing_args, path, temp], on_progress)
+        try:
+            os.chown(temp, stat.st_uid, stat.st_gid)
+        except PermissionError:
+            pass
+        os.chmod(temp, stat.st_mode)
+        if before_replace:
+            before_replace()
+        os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.unlink(temp)
+        raise
+    saved = before - allocated_bytes(path)
+    logging.info(f"Sparsified {path}: {saved / 1048576:.0f} MB reclaimed")
+    return saved
+
+
+def sparsify_domain(dom, description, rate_mb=DEFAULT_RATE_MB, protected_paths=(), on_progress=None,
+                    check_cancelled=None):
+    disks = [disk for disk in description.disks if disk['device'] == 'disk' and disk['type'] == 'file'
+             and disk['source'] and disk['source'] not in protected_paths]
+
+    def ensure_inactive():
+        if dom.isActive():
+            raise RuntimeError(f"'{dom.name()}' was started while its disks were being sparsified")
+
+    saved = 0
+    for i, disk in enumerate(disks):
+        if check_cancelled:
+            check_cancelled()
+        ensure_inactive()
+        progress = None
+        if on_progress:
+            progress = lambda percent, i=i: on_progress((i + percent / 100) / len(disks) * 100)
+        saved += sparsify_image(disk['source'], rate_mb, progress, ensure_inactive)
+    return saved
+
+
+def reclaim_domain(dom, description, local=True, rate_mb=DEFAULT_RATE_MB, protected_paths=(), on_progress=None,
+                   check_cancelled=None):
+    if dom.isActive():
+        trim_domain(dom, description)
+        return "Trimmed"
+    if not local:
+        raise RuntimeError(f"Sparsifying '{dom.name()}' needs local access to its disks; start it with a guest agent "
+                           "to trim instead")
+    saved = sparsify_domain(dom, description, rate_mb, protected_paths, on_progress, check_cancelled)
+    return f"Reclaimed {saved / 1073741824:.1f} GB"
+
@@ -0,0 +1,151 @@
+import logging
+import time
+import xml.etree.ElementTree as ET
+
+import libvirt
+
+from Hypervisor_DomainXML import xml_escape
+
+INTERNAL = "internal"
+EXTERNAL = "external"
+COMMIT = "commit"
+PULL = "pull"
+
+
+def snapshot_xml(name, disks=(), text=""):
+    disk_xml = "".join(
+        f"\n    <disk name='{disk['target']}' snapshot='{EXTERNAL if disk['device'] == 'disk' else 'no'}'/>"
+        for disk in disks if disk['target'])
+    disks_xml = f"\n  <disks>{disk_xml}\n  </disks>" if disk_xml else ""
+    return f"""<domainsnapshot>
+  <name>{xml_escape(name)}</name>
+  <description>{xml_escape(text)}</description>{disks_xml}
+</domainsnapshot>"""
+
+
+def create_snapshot(dom, description, name, text="", disk_only=False, quiesce=None, metadata=True):
+    if not disk_only:
+        snap = dom.snapshotCreateXML(snapshot_xml(name, text=text), 0)
+        logging.info(f"Created snapshot '{name}' of {dom.name()}")
+        return snap.getName()
+    disks = [disk for disk in description.disks if disk['type'] == 'file']
+    flags = libvirt.VIR_DOMAIN_SNAPSHOT_CREATE_DISK_ONLY | libvirt.VIR_DOMAIN_SNAPSHOT_CREATE_ATOMIC
+    if not metadata:
+        flags |= libvirt.VIR_DOMAIN_SNAPSHOT_CREATE_NO_METADATA
+    auto_quiesce = quiesce is None
+    if auto_quiesce:
+        quiesce = dom.isActive() and description.guest_agent_connected
+    xml = snapshot_xml(name, disks, text)
+    try:
+        snap = dom.snapshotCreateXML(xml, flags | (libvirt.VIR_DOMAIN_SNAPSHOT_CREATE_QUIESCE if quiesce else 0))
+    except libvirt.libvirtError as e:
+        if not (quiesce and auto_quiesce):
+            raise
+        logging.warning(f"Quiesced snapshot of {dom.name()} failed, retrying without the guest agent: {e}")
+        quiesce = False
+        snap = dom.snapshotCreateXML(xml, flags)
+    logging.info(f"Created external snapshot '{name}' of {dom.name()}{' (quiesced)' if quiesce else ''}")
+    return snap.getName()
+
+
+def list_snapshots(dom):
+    snapshots = []
+    for snap in dom.listAllSnapshots(0):
+        root = ET.fromstring(snap.getXMLDesc(0))
+        external = any(disk.get('snapshot') == EXTERNAL for disk in root.findall('./disks/disk'))
+        snapshots.append({
+            'name': root.findtext('name'),
+            'parent': root.findtext('./parent/name'),
+            'created': int(root.findtext('creationTime', '0')),
+            'state': root.findtext('state'),
+            'description': root.findtext('description') or "",
+            'kind': EXTERNAL if external else INTERNAL,
+            'current': bool(snap.isCurrent(0)),
+        })
+    snapshots.sort(key=lambda snapshot: snapshot['created'])
+    return snapshots
+
+
+def snapshot_overlays(dom):
+    overlays = set()
+    for snap in dom.listAllSnapshots(0):
+        for disk in ET.fromstring(snap.getXMLDesc(0)).findall('./disks/disk'):
+            source = disk.find('source')
+            if disk.get('snapshot') == EXTERNAL and source is not None and source.get('file'):
+                overlays.add(source.get('file'))
+    return overlays
+
+
+def snapshot_tree(snapshots):
+    names = {snapshot['name'] for snapshot in snapshots}
+    children = {}
+    for snapshot in snapshots:
+        parent = snapshot['parent'] if snapshot['parent'] in names else None
+        children.setdefault(parent, []).append(snapshot)
+    return children
+
+
+def revert_snapshot(dom, name):
+    dom.revertToSnapshot(dom.snapshotLookupByName(name, 0), 0)
+    logging.info(f"Reverted {dom.name()} to snapshot '{name}'")
+
+
+def delete_snapshot(dom, name, children=False):
+    flags = libvirt.VIR_DOMAIN_SNAPSHOT_DELETE_CHILDREN if children else 0
+    dom.snapshotLookupByName(name, 0).delete(flags)
+    logging.info(f"Deleted snapshot '{name}'{' and its children' if children else ''} of {dom.name()}")
+
+
+def wait_block_job(dom, target, on_progress=None, check_cancelled=None, poll_interval=1.0, pivot=False):
+    while True:
+        info = dom.blockJobInfo(target, 0)
+        if not info:
+            return
+        if info.get('end'):
+            if on_progress:
+                on_progress(info['cur'] / info['end'] * 100)
+            if pivot and info['cur'] == info['end']:
+                dom.blockJobAbort(target, libvirt.VIR_DOMAIN_BLOCK_JOB_ABORT_PIVOT)
+                pivot = False
+                continue
+        if check_cancelled:
+            try:
+                check_cancelled()
+            except BaseException:
+                dom.blockJobAbort(target, 0)
+                raise
+        time.sleep(poll_interval)
+
+
+def chain_base(chain, protected_paths=(), overlays=()):
+    for i, path in enumerate(chain):
+        if path in protected_paths:
+            return i
+        if path not in overlays:
+            return i + 1
+    return len(chain)
+
+
+def shorten_chain(dom, description, target, mode=COMMIT, bandwidth=0, protected_paths=(), overlays=None,
+                  on_progress=None, check_cancelled=None, poll_interval=1.0):
+    if not dom.isActive():
+        raise RuntimeError(f"Block {mode} needs '{dom.name()}' to be running; use Flatten Disk while it is shut off")
+    if overlays is None:
+        overlays = snapshot_overlays(dom)
+    chain = description.backing_chain(target)
+    keep = chain_base(chain, protected_paths, overlays)
+    if keep < 2:
+        return False
+    if mode == COMMIT:
+        base = chain[keep - 1]
+        dom.blockCommit(target, base, None, bandwidth, libvirt.VIR_DOMAIN_BLOCK_COMMIT_ACTIVE)
+        wait_block_job(dom, target, on_progress, check_cancelled, poll_interval, pivot=True)
+        logging.info(f"Committed {keep - 1} layer(s) of {target} on {dom.name()} into {base}")
+        return True
+    if keep < len(chain):
+        dom.blockRebase(target, chain[keep], bandwidth, 0)
+    else:
+        dom.blockPull(target, bandwidth, 0)
+    wait_block_job(dom, target, on_progress, check_cancelled, poll_interval)
+    logging.info(f"Pulled {keep - 1} layer(s) of {target} on {dom.name()} into {chain[0]}")
+    return True
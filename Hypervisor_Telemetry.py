@@ -0,0 +1,285 @@
+import bisect
+import contextvars
+import itertools
+import os
+import threading
+import time
+from collections import Counter, deque, namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import libvirt
+
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'))
+LIBVIRT_CLASSES = ('virConnect', 'virDomain', 'virNetwork', 'virStoragePool', 'virStorageVol', 'virStream')
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Span = namedtuple('Span', 'id parent job operation started duration error')
+
+CURRENT_JOB = contextvars.ContextVar('hypervisor_job', default=None)
+CURRENT_SPAN = contextvars.ContextVar('hypervisor_span', default=None)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+        self.maximum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        self.maximum = max(self.maximum, seconds)
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(BUCKETS, self.counts):
+            if count and seen + count >= rank:
+                upper = min(bound, self.maximum)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.maximum
+
+
+class _NullTracker:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TRACKER = _NullTracker()
+
+
+class _Tracker:
+    def __init__(self, telemetry, operation):
+        self.telemetry = telemetry
+        self.operation = operation
+        self.span_token = None
+
+    def __enter__(self):
+        telemetry = self.telemetry
+        with telemetry._lock:
+            telemetry.in_flight[self.operation] += 1
+        if telemetry.tracing:
+            self.span_id = next(telemetry._span_ids)
+            self.parent = CURRENT_SPAN.get()
+            self.span_token = CURRENT_SPAN.set(self.span_id)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.started
+        error = None
+        if exc_type is not None:
+            error = f"{exc_type.__name__}:{exc.get_error_code()}" if isinstance(exc, libvirt.libvirtError) \
+                else exc_type.__name__
+        telemetry = self.telemetry
+        with telemetry._lock:
+            telemetry.in_flight[self.operation] -= 1
+            histogram = telemetry.histograms.get(self.operation)
+            if histogram is None:
+                histogram = telemetry.histograms[self.operation] = Histogram()
+            histogram.observe(duration)
+            if error:
+                telemetry.errors[self.operation, error] += 1
+            if self.span_token is not None:
+                telemetry.spans.append(Span(self.span_id, self.parent, CURRENT_JOB.get(), self.operation,
+                                            time.time() - duration, duration, error))
+        if self.span_token is not None:
+            CURRENT_SPAN.reset(self.span_token)
+        return False
+
+
+class Telemetry:
+    def __init__(self, span_capacity=2000):
+        self.enabled = False
+        self.tracing = False
+        self.histograms = {}
+        self.errors = Counter()
+        self.in_flight = Counter()
+        self.spans = deque(maxlen=span_capacity)
+        self._lock = threading.Lock()
+        self._span_ids = itertools.count(1)
+        self._originals = []
+        self._server = None
+
+    def track(self, operation):
+        if not self.enabled:
+            return NULL_TRACKER
+        return _Tracker(self, operation)
+
+    def job(self, job_id, label):
+        return _JobContext(self, job_id, label)
+
+    def _wrap(self, operation, method):
+        def instrumented(*args, **kwargs):
+            if not self.enabled:
+                return method(*args, **kwargs)
+            with _Tracker(self, operation):
+                return method(*args, **kwargs)
+        instrumented.__wrapped__ = method
+        return instrumented
+
+    def _instrument_libvirt(self):
+        for cls_name in LIBVIRT_CLASSES:
+            cls = getattr(libvirt, cls_name, None)
+            if cls is None:
+                continue
+            for name, method in list(vars(cls).items()):
+                if name.startswith('_') or not callable(method) or name == 'c_pointer':
+                    continue
+                self._originals.append((cls, name, method))
+                setattr(cls, name, self._wrap(f"libvirt {name}", method))
+
+    def _restore_libvirt(self):
+        for cls, name, method in self._originals:
+            setattr(cls, name, method)
+        self._originals = []
+
+    def enable(self, tracing=False):
+        self.tracing = tracing
+        if not self.enabled:
+            self._instrument_libvirt()
+            self.enabled = True
+
+    def disable(self):
+        if self.enabled:
+            self.enabled = False
+            self.tracing = False
+            self._restore_libvirt()
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.errors = Counter()
+            self.spans.clear()
+
+    def snapshot(self):
+        with self._lock:
+            errors = Counter()
+            for (operation, _), count in self.errors.items():
+                errors[operation] += count
+            operations = set(self.histograms) | {op for op, count in self.in_flight.items() if count}
+            rows = []
+            for operation in sorted(operations):
+                histogram = self.histograms.get(operation) or Histogram()
+                rows.append({
+                    'operation': operation,
+                    'count': histogram.count,
+                    'errors': errors[operation],
+                    'in_flight': self.in_flight[operation],
+                    'mean': histogram.total / histogram.count if histogram.count else 0.0,
+                    'p50': histogram.quantile(0.5),
+                    'p95': histogram.quantile(0.95),
+                    'max': histogram.maximum,
+                    'total': histogram.total,
+                })
+            return rows
+
+    def recent_spans(self, limit=200):
+        with self._lock:
+            return list(self.spans)[-limit:]
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP hypervisor_operation_duration_seconds Latency of libvirt calls, subprocesses and UI updates.",
+            "# TYPE hypervisor_operation_duration_seconds histogram",
+        ]
+        with self._lock:
+            histograms = {op: (list(h.counts), h.total, h.count) for op, h in self.histograms.items()}
+            errors = dict(self.errors)
+            in_flight = dict(self.in_flight)
+        for operation, (counts, total, count) in sorted(histograms.items()):
+            label = _label(operation)
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, counts):
+                cumulative += bucket
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                lines.append(f'hypervisor_operation_duration_seconds_bucket{{operation="{label}",le="{le}"}} {cumulative}')
+            lines.append(f'hypervisor_operation_duration_seconds_sum{{operation="{label}"}} {total:.6f}')
+            lines.append(f'hypervisor_operation_duration_seconds_count{{operation="{label}"}} {count}')
+        lines += [
+            "# HELP hypervisor_operation_errors_total Failed operations by error type.",
+            "# TYPE hypervisor_operation_errors_total counter",
+        ]
+        for (operation, error), count in sorted(errors.items()):
+            lines.append(f'hypervisor_operation_errors_total{{operation="{_label(operation)}",error="{_label(error)}"}} {count}')
+        lines += [
+            "# HELP hypervisor_operations_in_flight Operations currently running.",
+            "# TYPE hypervisor_operations_in_flight gauge",
+        ]
+        for operation, count in sorted(in_flight.items()):
+            lines.append(f'hypervisor_operations_in_flight{{operation="{_label(operation)}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+    def serve(self, port, host="127.0.0.1"):
+        self.stop_serving()
+        telemetry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = telemetry.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        return self._server.server_address
+
+    def stop_serving(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class _JobContext:
+    def __init__(self, telemetry, job_id, label):
+        self.telemetry = telemetry
+        self.job_id = job_id
+        self.label = label
+        self.tracker = None
+
+    def __enter__(self):
+        self.token = CURRENT_JOB.set(self.job_id)
+        if self.telemetry.enabled:
+            self.tracker = _Tracker(self.telemetry, f"job {self.label.split()[0].lower()}")
+            self.tracker.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        if self.tracker:
+            self.tracker.__exit__(*exc)
+        CURRENT_JOB.reset(self.token)
+        return False
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+TELEMETRY = Telemetry()
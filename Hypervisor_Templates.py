@@ -0,0 +1,216 @@
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+
+import libvirt
+
+from Hypervisor_DomainXML import DomainDescription, build_domain_xml, clone_domain_xml
+from Hypervisor_Snapshots import wait_block_job
+from Hypervisor_Telemetry import TELEMETRY
+from Hypervisor_Volumes import DEFAULT_POOL, find_volume, lookup_volume, remove_volumes, storage_pool, volume_xml
+
+IMAGE_DIR = "/var/lib/libvirt/images"
+CATALOG_PATH = os.path.join(IMAGE_DIR, "templates.json")
+LINKED = "linked"
+FULL = "full"
+CLONE_MODES = (LINKED, FULL)
+
+PROGRESS_RE = re.compile(r"\((\d+(?:\.\d+)?)/100%\)")
+
+
+def run_qemu_img(args, on_progress=None):
+    with TELEMETRY.track(f"qemu-img {args[0]}"):
+        return _run_qemu_img(args, on_progress)
+
+
+def _run_qemu_img(args, on_progress=None):
+    if on_progress is None:
+        process = subprocess.run(['qemu-img', *args], capture_output=True, text=True)
+        if process.returncode != 0:
+            raise RuntimeError(f"qemu-img {args[0]} failed: {process.stderr.strip()}")
+        return process.stdout
+    process = subprocess.Popen(['qemu-img', args[0], '-p', *args[1:]], stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, text=True)
+    try:
+        for line in process.stdout:
+            match = PROGRESS_RE.search(line)
+            if match:
+                on_progress(float(match.group(1)))
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    stderr = process.stderr.read()
+    if process.wait() != 0:
+        raise RuntimeError(f"qemu-img {args[0]} failed: {stderr.strip()}")
+    return ""
+
+
+def image_info(path):
+    return json.loads(run_qemu_img(['info', '--output=json', '-U', path]))
+
+
+def flatten_image(path, on_progress=None):
+    run_qemu_img(['rebase', '-b', '', path], on_progress)
+
+
+def backing_file(path):
+    return image_info(path).get('backing-filename')
+
+
+def image_chain(path):
+    images = json.loads(run_qemu_img(['info', '--output=json', '-U', '--backing-chain', path]))
+    return [image['filename'] for image in images]
+
+
+class TemplateCatalog:
+    def __init__(self, path=CATALOG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._templates = None
+
+    def _load(self):
+        if self._templates is None:
+            try:
+                with open(self.path) as f:
+                    self._templates = {t['name']: t for t in json.load(f)}
+            except FileNotFoundError:
+                self._templates = {}
+        return self._templates
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(sorted(self._templates.values(), key=lambda t: t['name']), f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def templates(self):
+        with self._lock:
+            return sorted(self._load().values(), key=lambda t: t['name'])
+
+    def get(self, name):
+        with self._lock:
+            return self._load().get(name)
+
+    def add(self, template):
+        with self._lock:
+            templates = self._load()
+            if template['name'] in templates:
+                raise ValueError(f"Template '{template['name']}' already exists")
+            templates[template['name']] = template
+            self._save()
+
+    def remove(self, name):
+        with self._lock:
+            template = self._load().pop(name, None)
+            if template is not None:
+                self._save()
+            return template
+
+    def base_paths(self):
+        with self._lock:
+            return {disk['path'] for t in self._load().values() for disk in t['disks']}
+
+
+def protect_image(path):
+    os.chmod(path, 0o444)
+
+
+def template_from_domain(name, uri, dom):
+    if dom.isActive():
+        raise RuntimeError(f"Shut down '{dom.name()}' before using it as a template")
+    xml_desc = dom.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
+    description = DomainDescription(xml_desc)
+    disks = [{'path': disk['source'], 'format': disk['format'] or 'raw', 'target': disk['target']}
+             for disk in description.disks
+             if disk['device'] == 'disk' and disk['type'] == 'file' and disk['source']]
+    if not disks:
+        raise RuntimeError(f"'{dom.name()}' has no file-backed disks")
+    for disk in disks:
+        protect_image(disk['path'])
+    return {
+        'name': name,
+        'uri': uri,
+        'source': description.name,
+        'disks': disks,
+        'xml': xml_desc,
+        'memory': description.memory_kib // 1024,
+        'vcpus': description.vcpus,
+        'created': time.time(),
+    }
+
+
+def template_from_image(name, uri, path, memory_mb, vcpus):
+    info = image_info(path)
+    protect_image(path)
+    return {
+        'name': name,
+        'uri': uri,
+        'source': path,
+        'disks': [{'path': path, 'format': info.get('format', 'raw'), 'target': 'vda'}],
+        'xml': None,
+        'memory': memory_mb,
+        'vcpus': vcpus,
+        'created': time.time(),
+    }
+
+
+def clone_disks(conn, template, disk_name, mode=LINKED, pool_name=DEFAULT_POOL, check_cancelled=None, profile=None):
+    profile = profile or {}
+    pool = storage_pool(conn, pool_name)
+    disk_paths = {}
+    created = []
+    try:
+        for i, disk in enumerate(template['disks']):
+            if check_cancelled:
+                check_cancelled()
+            suffix = "" if i == 0 else f"-{disk['target'] or i}"
+            name = f"{disk_name}{suffix}.qcow2"
+            if find_volume(pool, name):
+                raise RuntimeError(f"Volume {name} already exists in pool '{pool_name}'")
+            base = lookup_volume(conn, disk['path'])
+            capacity = base.info()[1]
+            with TELEMETRY.track(f"clone {mode}"):
+                if mode == LINKED:
+                    overlay = {'cluster_size': profile['cluster_size']} if 'cluster_size' in profile else {}
+                    vol = pool.createXML(volume_xml(name, capacity, 'qcow2', overlay, 'B', disk['path'],
+                                                    disk['format']), 0)
+                else:
+                    flags = libvirt.VIR_STORAGE_VOL_CREATE_PREALLOC_METADATA \
+                        if profile.get('preallocation') == 'metadata' else 0
+                    vol = pool.createXMLFrom(volume_xml(name, capacity, 'qcow2', profile, 'B'), base, flags)
+            created.append(vol.path())
+            disk_paths[disk['path']] = (vol.path(), 'qcow2')
+    except BaseException:
+        remove_volumes(conn, created, local=False)
+        raise
+    return disk_paths
+
+
+def template_domain_xml(template, name, disk_paths, network, memory_mb=None, vcpus=None, driver=None, iothreads=0):
+    if template['xml']:
+        return clone_domain_xml(template['xml'], name, disk_paths, network, memory_mb, vcpus, driver, iothreads)
+    disk_path, disk_format = next(iter(disk_paths.values()))
+    return build_domain_xml(name, memory_mb or template['memory'], vcpus or template['vcpus'],
+                            disk_path, network, disk_format=disk_format, driver=driver, iothreads=iothreads)
+
+
+def flatten_domain(dom, description, on_progress=None, check_cancelled=None, poll_interval=1.0):
+    flattened = []
+    disks = [disk for disk in description.disks
+             if disk['device'] == 'disk' and disk['type'] == 'file' and disk['source']]
+    for disk in disks:
+        if check_cancelled:
+            check_cancelled()
+        if not backing_file(disk['source']):
+            continue
+        if dom.isActive():
+            dom.blockPull(disk['target'], 0, 0)
+            wait_block_job(dom, disk['target'], on_progress, check_cancelled, poll_interval)
+        else:
+            flatten_image(disk['source'], on_progress)
+        flattened.append(disk['source'])
+    return flattened
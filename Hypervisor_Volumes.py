@@ -0,0 +1,216 @@
+import logging
+import mmap
+import os
+import time
+from urllib.parse import urlparse
+from xml.sax.saxutils import escape
+
+import libvirt
+
+DEFAULT_POOL = "default"
+CHUNK_SIZE = 8 * 1024 * 1024
+PREALLOCATED = ('falloc', 'full')
+LOCAL_HOSTS = ('', 'localhost', '127.0.0.1', '::1')
+
+
+def is_remote(uri):
+    return (urlparse(uri).hostname or '') not in LOCAL_HOSTS
+
+
+def volume_xml(name, capacity, fmt='qcow2', profile=None, unit='G', backing=None, backing_format='qcow2'):
+    profile = profile or {}
+    allocation = capacity if profile.get('preallocation') in PREALLOCATED else 0
+    cluster_size = profile.get('cluster_size') if fmt == 'qcow2' else None
+    cluster = f"\n    <clusterSize unit='{cluster_size[-1]}'>{cluster_size[:-1]}</clusterSize>" if cluster_size else ""
+    backing_store = f"""
+  <backingStore>
+    <path>{escape(backing)}</path>
+    <format type='{backing_format}'/>
+  </backingStore>""" if backing else ""
+    return f"""<volume>
+  <name>{escape(name)}</name>
+  <capacity unit='{unit}'>{capacity}</capacity>
+  <allocation unit='{unit}'>{allocation}</allocation>
+  <target>
+    <format type='{fmt}'/>{cluster}
+  </target>{backing_store}
+</volume>"""
+
+
+def storage_pool(conn, pool_name=DEFAULT_POOL):
+    try:
+        pool = conn.storagePoolLookupByName(pool_name)
+    except libvirt.libvirtError as e:
+        raise RuntimeError(f"Storage pool '{pool_name}' not found on {conn.getURI()}: {e}")
+    if not pool.isActive():
+        pool.create(0)
+    return pool
+
+
+def find_volume(pool, name):
+    try:
+        return pool.storageVolLookupByName(name)
+    except libvirt.libvirtError as e:
+        if e.get_error_code() != libvirt.VIR_ERR_NO_STORAGE_VOL:
+            raise
+        return None
+
+
+def create_volume(conn, pool_name, name, capacity_gb, profile=None):
+    pool = storage_pool(conn, pool_name)
+    if find_volume(pool, name):
+        raise RuntimeError(f"Volume {name} already exists in pool '{pool_name}'")
+    flags = libvirt.VIR_STORAGE_VOL_CREATE_PREALLOC_METADATA if (profile or {}).get('preallocation') == 'metadata' else 0
+    vol = pool.createXML(volume_xml(name, capacity_gb, 'qcow2', profile), flags)
+    logging.info(f"Created volume {vol.path()} ({capacity_gb} GB) in pool '{pool_name}'")
+    return vol.path()
+
+
+def lookup_volume(conn, path):
+    try:
+        return conn.storageVolLookupByPath(path)
+    except libvirt.libvirtError as e:
+        if e.get_error_code() != libvirt.VIR_ERR_NO_STORAGE_VOL:
+            raise
+    refresh_pools(conn)
+    try:
+        return conn.storageVolLookupByPath(path)
+    except libvirt.libvirtError as e:
+        if e.get_error_code() != libvirt.VIR_ERR_NO_STORAGE_VOL:
+            raise
+        raise RuntimeError(f"{path} is not in a storage pool on {conn.getURI()}")
+
+
+def remove_volume(conn, path, local=True):
+    try:
+        conn.storageVolLookupByPath(path).delete(0)
+    except libvirt.libvirtError as e:
+        if e.get_error_code() != libvirt.VIR_ERR_NO_STORAGE_VOL or not local:
+            raise
+        os.unlink(path)
+    logging.info(f"Deleted disk: {path}")
+
+
+def refresh_pools(conn):
+    for pool in conn.listAllStoragePools(libvirt.VIR_CONNECT_LIST_STORAGE_POOLS_ACTIVE):
+        try:
+            pool.refresh(0)
+        except libvirt.libvirtError as e:
+            logging.warning(f"Cannot refresh pool '{pool.name()}': {e}")
+
+
+def remove_volumes(conn, paths, local=True):
+    errors = {}
+    refreshed = False
+    for path in paths:
+        try:
+            try:
+                remove_volume(conn, path, local)
+            except libvirt.libvirtError as e:
+                if e.get_error_code() != libvirt.VIR_ERR_NO_STORAGE_VOL or refreshed:
+                    raise
+                refresh_pools(conn)
+                refreshed = True
+                remove_volume(conn, path, local)
+        except FileNotFoundError:
+            logging.info(f"Disk already gone: {path}")
+        except (libvirt.libvirtError, OSError) as e:
+            logging.error(f"Error deleting disk {path}: {e}")
+            errors[path] = str(e)
+    return errors
+
+
+def volume_usage(vol):
+    _, capacity, allocation = vol.info()
+    try:
+        physical = vol.infoFlags(libvirt.VIR_STORAGE_VOL_GET_PHYSICAL)[2]
+    except libvirt.libvirtError as e:
+        if e.get_error_code() not in (libvirt.VIR_ERR_NO_SUPPORT, libvirt.VIR_ERR_INVALID_ARG):
+            raise
+        physical = allocation
+    return {'name': vol.name(), 'path': vol.path(), 'capacity': capacity, 'allocation': allocation,
+            'physical': physical}
+
+
+def pool_usage(conn, owners=None):
+    owners = owners or {}
+    pools = []
+    for pool in conn.listAllStoragePools(0):
+        active = bool(pool.isActive())
+        _, capacity, allocation, available = pool.info()
+        volumes = []
+        for vol in pool.listAllVolumes(0) if active else ():
+            try:
+                usage = volume_usage(vol)
+            except libvirt.libvirtError as e:
+                if e.get_error_code() != libvirt.VIR_ERR_NO_STORAGE_VOL:
+                    raise
+                continue
+            usage['owner'] = owners.get(usage['path'])
+            volumes.append(usage)
+        volumes.sort(key=lambda usage: usage['name'])
+        pools.append({'name': pool.name(), 'active': active, 'capacity': capacity, 'allocation': allocation,
+                      'available': available, 'volumes': volumes})
+    return pools
+
+
+def domain_disk_usage(dom, description):
+    usage = []
+    for disk in description.disks:
+        if disk['device'] == 'cdrom' or not disk['target'] or not disk['source']:
+            continue
+        capacity, allocation, physical = dom.blockInfo(disk['target'], 0)
+        usage.append({**disk, 'capacity': capacity, 'allocation': allocation, 'physical': physical})
+    return usage
+
+
+def upload_file(conn, local_path, pool_name=DEFAULT_POOL, name=None, on_progress=None, check_cancelled=None,
+                chunk_size=CHUNK_SIZE):
+    name = name or os.path.basename(local_path)
+    size = os.path.getsize(local_path)
+    if not size:
+        raise RuntimeError(f"{local_path} is empty")
+    pool = storage_pool(conn, pool_name)
+    vol = find_volume(pool, name)
+    if vol is not None:
+        if vol.info()[1] == size:
+            logging.info(f"{name} is already in pool '{pool_name}', skipping upload")
+            return vol.path()
+        raise RuntimeError(f"Volume {name} already exists in pool '{pool_name}' with a different size")
+    vol = pool.createXML(volume_xml(name, size, 'raw', unit='B'), 0)
+    stream = conn.newStream(0)
+    started = time.monotonic()
+    sent = 0
+    try:
+        vol.upload(stream, 0, size, 0)
+        with open(local_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            while sent < size:
+                if check_cancelled:
+                    check_cancelled()
+                sent += stream.send(data[sent:sent + chunk_size])
+                if on_progress:
+                    on_progress(sent / size * 100, sent / max(time.monotonic() - started, 1e-6))
+        stream.finish()
+    except BaseException:
+        try:
+            stream.abort()
+        except libvirt.libvirtError:
+            pass
+        vol.delete(0)
+        raise
+    elapsed = time.monotonic() - started
+    logging.info(f"Uploaded {local_path} to {vol.path()}: {size / 1048576:.0f} MB in {elapsed:.1f}s "
+                 f"({size / 1048576 / max(elapsed, 1e-6):.0f} MB/s)")
+    return vol.path()
+
+
+def stage_files(conn, uri, paths, pool_name=DEFAULT_POOL, on_progress=None, check_cancelled=None):
+    if not is_remote(uri):
+        return list(paths)
+    staged = []
+    for i, path in enumerate(paths):
+        progress = None
+        if on_progress:
+            progress = lambda percent, rate, i=i: on_progress((i + percent / 100) / len(paths) * 100, rate)
+        staged.append(upload_file(conn, path, pool_name, on_progress=progress, check_cancelled=check_cancelled))
+    return staged
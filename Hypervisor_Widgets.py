@@ -0,0 +1,165 @@
+import tkinter as tk
+from tkinter import ttk
+
+SHIFT_MASK = 0x0001
+CONTROL_MASK = 0x0004
+
+
+class VirtualTreeview(ttk.Frame):
+    def __init__(self, parent, columns, row_values, **kwargs):
+        super().__init__(parent)
+        self.row_values = row_values
+        self.keys = []
+        self.offset = 0
+        self.selected = set()
+        self.focus_key = None
+        self._slots = []
+        self._slot_keys = []
+        self._slot_values = []
+        self._replace_selection = False
+        self.tree = ttk.Treeview(self, columns=columns, show='headings', selectmode='extended', **kwargs)
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.yview)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.bind('<Configure>', lambda event: self.render())
+        self.tree.bind('<<TreeviewSelect>>', self._on_select)
+        self.tree.bind('<ButtonPress-1>', self._on_press, add='+')
+        self.tree.bind('<ButtonRelease-1>', self._on_release, add='+')
+        self.tree.bind('<MouseWheel>', lambda event: self.scroll(-3 if event.delta > 0 else 3))
+        self.tree.bind('<Button-4>', lambda event: self.scroll(-3))
+        self.tree.bind('<Button-5>', lambda event: self.scroll(3))
+        self.tree.bind('<Up>', lambda event: self._move_focus(-1))
+        self.tree.bind('<Down>', lambda event: self._move_focus(1))
+        self.tree.bind('<Prior>', lambda event: self._move_focus(-self.visible_rows()))
+        self.tree.bind('<Next>', lambda event: self._move_focus(self.visible_rows()))
+        self.tree.bind('<Control-a>', self._select_all)
+
+    def heading(self, column, **kwargs):
+        return self.tree.heading(column, **kwargs)
+
+    def column(self, column, **kwargs):
+        return self.tree.column(column, **kwargs)
+
+    def bind_rows(self, sequence, func):
+        self.tree.bind(sequence, func, add='+')
+
+    def visible_rows(self):
+        row_height = int(ttk.Style().lookup('Treeview', 'rowheight') or 20)
+        return max(1, self.tree.winfo_height() // row_height - 1)
+
+    def set_keys(self, keys):
+        self.keys = keys
+        if self.selected:
+            self.selected &= set(keys)
+        self.render()
+
+    def render(self):
+        rows = self.visible_rows()
+        self.offset = min(max(self.offset, 0), max(0, len(self.keys) - rows))
+        window = self.keys[self.offset:self.offset + rows]
+        while len(self._slots) < len(window):
+            iid = f"slot{len(self._slots)}"
+            self.tree.insert('', tk.END, iid=iid)
+            self._slots.append(iid)
+            self._slot_keys.append(None)
+            self._slot_values.append(None)
+        while len(self._slots) > len(window):
+            self.tree.delete(self._slots.pop())
+            self._slot_keys.pop()
+            self._slot_values.pop()
+        for i, key in enumerate(window):
+            values = self.row_values(key)
+            if self._slot_values[i] != values:
+                self.tree.item(self._slots[i], values=values)
+                self._slot_values[i] = values
+            self._slot_keys[i] = key
+        self._sync_selection()
+        total = len(self.keys)
+        if total:
+            self.scrollbar.set(self.offset / total, min(1.0, (self.offset + len(window)) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def refresh_keys(self, keys):
+        for i, key in enumerate(self._slot_keys):
+            if key in keys:
+                values = self.row_values(key)
+                if self._slot_values[i] != values:
+                    self.tree.item(self._slots[i], values=values)
+                    self._slot_values[i] = values
+
+    def _sync_selection(self):
+        wanted = [iid for iid, key in zip(self._slots, self._slot_keys) if key in self.selected]
+        if set(wanted) != set(self.tree.selection()):
+            self.tree.selection_set(wanted)
+        for iid, key in zip(self._slots, self._slot_keys):
+            if key == self.focus_key:
+                self.tree.focus(iid)
+                break
+
+    def yview(self, *args):
+        if args[0] == 'moveto':
+            self.offset = int(float(args[1]) * len(self.keys))
+        elif args[0] == 'scroll':
+            step = int(args[1])
+            self.offset += step * self.visible_rows() if args[2] == 'pages' else step
+        self.render()
+
+    def scroll(self, rows):
+        self.offset += rows
+        self.render()
+        return 'break'
+
+    def scroll_to(self, key):
+        if key not in self.keys:
+            return
+        index = self.keys.index(key)
+        rows = self.visible_rows()
+        if index < self.offset:
+            self.offset = index
+        elif index >= self.offset + rows:
+            self.offset = index - rows + 1
+        self.render()
+
+    def _on_press(self, event):
+        self._replace_selection = not (event.state & (SHIFT_MASK | CONTROL_MASK))
+
+    def _on_release(self, event):
+        self._replace_selection = False
+
+    def _on_select(self, event=None):
+        slot_keys = dict(zip(self._slots, self._slot_keys))
+        visible_selected = {slot_keys[iid] for iid in self.tree.selection() if slot_keys.get(iid)}
+        if self._replace_selection:
+            self.selected = visible_selected
+        else:
+            self.selected = (self.selected - set(self._slot_keys)) | visible_selected
+        focus = slot_keys.get(self.tree.focus())
+        if focus:
+            self.focus_key = focus
+
+    def _move_focus(self, delta):
+        if not self.keys:
+            return 'break'
+        try:
+            index = self.keys.index(self.focus_key) + delta
+        except ValueError:
+            index = self.offset
+        index = min(max(index, 0), len(self.keys) - 1)
+        self.focus_key = self.keys[index]
+        self.selected = {self.focus_key}
+        self.scroll_to(self.focus_key)
+        return 'break'
+
+    def _select_all(self, event=None):
+        self.selected = set(self.keys)
+        self._sync_selection()
+        return 'break'
+
+    def selection(self):
+        if not self.selected:
+            return []
+        return [key for key in self.keys if key in self.selected]
+
+    def focus(self):
+        return self.focus_key
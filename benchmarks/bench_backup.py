@@ -0,0 +1,141 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Hypervisor_Backup import CHUNK_SIZE, COMPRESSION_LEVEL, SUFFIX, ArchiveWriter, partial_path
+
+WINDOW_HOURS = 6.0
+NIGHTLY_TB = 2.0
+
+
+class FileStream:
+    def __init__(self):
+        self.fd = None
+        self.position = 0
+        self.hole = 0
+
+    def recvFlags(self, size, flags):
+        length = os.fstat(self.fd).st_size
+        if self.position >= length:
+            return b""
+        try:
+            data = os.lseek(self.fd, self.position, os.SEEK_DATA)
+        except OSError:
+            data = length
+        if data > self.position:
+            self.hole = data - self.position
+            return -3
+        end = os.lseek(self.fd, self.position, os.SEEK_HOLE)
+        chunk = os.pread(self.fd, min(size, end - self.position), self.position)
+        self.position += len(chunk)
+        return chunk
+
+    def recvHole(self, flags):
+        self.position += self.hole
+        return self.hole
+
+    def finish(self):
+        os.close(self.fd)
+
+    def abort(self):
+        os.close(self.fd)
+
+
+class FileVolume:
+    def __init__(self, path):
+        self.path = path
+
+    def download(self, stream, offset, length, flags):
+        stream.fd = os.open(self.path, os.O_RDONLY)
+        stream.position = offset
+
+
+class FileConnection:
+    def storageVolLookupByPath(self, path):
+        return FileVolume(path)
+
+    def newStream(self, flags):
+        return FileStream()
+
+
+def synthetic_image(path, chunks, seed=0):
+    rng = random.Random(seed)
+    text = b"".join(f"line {i} of a guest log file with some repetition\n".encode() for i in range(100000))
+    with open(path, 'wb') as f:
+        for i in range(chunks):
+            kind = i % 8
+            if kind in (0, 4):
+                f.write(rng.randbytes(CHUNK_SIZE))
+            elif kind == 3:
+                f.seek(CHUNK_SIZE, os.SEEK_CUR)
+            elif kind == 7:
+                f.write(bytes(CHUNK_SIZE))
+            else:
+                start = rng.randrange(len(text) - CHUNK_SIZE)
+                f.write(text[start:start + CHUNK_SIZE])
+        f.truncate()
+
+
+def drop_cache(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def bench_export(image, directory, workers, level):
+    archive = os.path.join(directory, f"bench-{workers}{SUFFIX}")
+    drop_cache(image)
+    started = time.perf_counter()
+    writer = ArchiveWriter(archive, workers=workers, level=level, resume=False)
+    writer.add_disk(FileConnection(), {'target': 'vda', 'source': image, 'format': 'raw'})
+    writer.finish("<domain/>")
+    elapsed = time.perf_counter() - started
+    return os.path.getsize(image) / elapsed, writer.stored
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backup export throughput: a sparse image streamed through the "
+                                                 "archive writer")
+    parser.add_argument('--chunks', type=int, default=256, help=f"{CHUNK_SIZE // 1048576} MB chunks in the image")
+    parser.add_argument('--image', help="existing raw or qcow2 image to export instead of a synthetic one")
+    parser.add_argument('--dir', default=tempfile.gettempdir(), help="directory for the image and archives")
+    parser.add_argument('--level', type=int, default=COMPRESSION_LEVEL)
+    parser.add_argument('--window', type=float, default=WINDOW_HOURS, help="backup window in hours")
+    parser.add_argument('--nightly', type=float, default=NIGHTLY_TB, help="TB read per night")
+    args = parser.parse_args()
+    image = args.image or os.path.join(args.dir, "bench-backup.img")
+    if not args.image:
+        synthetic_image(image, args.chunks)
+    size = os.path.getsize(image)
+    workers = sorted({1, 2, 4, os.cpu_count() or 1})
+    best = 0
+    try:
+        for count in workers:
+            rate, stored = bench_export(image, args.dir, count, args.level)
+            best = max(best, rate)
+            print(f"{count:>3} workers {rate / 1048576:9.0f} MB/s  stored {stored / size:6.1%}")
+    finally:
+        if not args.image:
+            os.unlink(image)
+        for count in workers:
+            archive = os.path.join(args.dir, f"bench-{count}{SUFFIX}")
+            for path in (archive, partial_path(archive)):
+                if os.path.exists(path):
+                    os.unlink(path)
+    hours = args.nightly * 1024 ** 4 / best / 3600
+    flag = "" if hours <= args.window else "  OVER BUDGET"
+    print(f"{args.nightly:.1f} TB at {best / 1048576:.0f} MB/s: {hours:.1f} h of a {args.window:.1f} h window{flag}")
+    print("Local read through the archive writer; remote hosts add libvirt stream and network time")
+    sys.exit(1 if flag else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Hypervisor_Storage import STORAGE_PROFILES, create_image_args
+
+WORKLOADS = (
+    ("seq-read", ['-s', '1M', '-d', '4']),
+    ("seq-write", ['-w', '-s', '1M', '-d', '4']),
+    ("stride-4k-read", ['-s', '4K', '-d', '32', '-S', '1052672']),
+    ("stride-4k-write", ['-w', '-s', '4K', '-d', '32', '-S', '1052672']),
+)
+
+ELAPSED_RE = re.compile(r"Run completed in (\d+(?:\.\d+)?) seconds")
+
+
+def qemu_img(args):
+    process = subprocess.run(['qemu-img', *args], capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"qemu-img {args[0]} failed: {process.stderr.strip()}")
+    return process.stdout
+
+
+def bench_args(profile):
+    args = ['-t', profile.get('cache', 'writeback')]
+    if profile.get('io') in ('native', 'io_uring', 'threads'):
+        args += ['-i', profile['io']]
+    return args
+
+
+def run_workload(path, profile, options, count):
+    output = qemu_img(['bench', '-f', 'qcow2', '-c', str(count), *bench_args(profile), *options, path])
+    match = ELAPSED_RE.search(output)
+    if not match:
+        raise RuntimeError(f"Unexpected qemu-img bench output: {output.strip()}")
+    return float(match.group(1))
+
+
+def buffer_bytes(options):
+    size = options[options.index('-s') + 1]
+    return int(size[:-1]) * {'K': 1024, 'M': 1048576}[size[-1]]
+
+
+def bench_profile(name, profile, directory, size_gb, count):
+    path = os.path.join(directory, f"{name}.qcow2")
+    started = time.perf_counter()
+    qemu_img(create_image_args(path, size_gb, profile))
+    create_time = time.perf_counter() - started
+    results = {'create': create_time}
+    try:
+        for workload, options in WORKLOADS:
+            try:
+                elapsed = run_workload(path, profile, options, count)
+            except RuntimeError as e:
+                print(f"{name}/{workload}: {e}", file=sys.stderr)
+                results[workload] = None
+                continue
+            results[workload] = (count / elapsed, count * buffer_bytes(options) / elapsed / 1048576)
+    finally:
+        os.unlink(path)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare storage profiles on a local file-backed qcow2 disk")
+    parser.add_argument('--dir', default=None, help="directory for scratch images (default: a temp dir)")
+    parser.add_argument('--size', type=int, default=4, help="image size in GiB")
+    parser.add_argument('--count', type=int, default=20000, help="requests per workload")
+    parser.add_argument('--profiles', nargs='*', default=list(STORAGE_PROFILES))
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        header = f"{'profile':<12}{'create (s)':>12}" + "".join(f"{workload:>24}" for workload, _ in WORKLOADS)
+        print(header)
+        print(" " * 24 + "".join(f"{'IOPS':>12}{'MiB/s':>12}" for _ in WORKLOADS))
+        for name in args.profiles:
+            results = bench_profile(name, STORAGE_PROFILES[name], directory, args.size, args.count)
+            line = f"{name:<12}{results['create']:>12.2f}"
+            for workload, _ in WORKLOADS:
+                result = results[workload]
+                line += f"{'n/a':>24}" if result is None else f"{result[0]:>12.0f}{result[1]:>12.1f}"
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
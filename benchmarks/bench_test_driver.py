@@ -0,0 +1,297 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid as uuidlib
+from collections import Counter
+from xml.sax.saxutils import escape
+
+import numpy as np
+import libvirt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Hypervisor_Connection import ConnectionManager
+from Hypervisor_Controller import start_domain, shutdown_domain, list_networks
+from Hypervisor_DomainXML import DomainDescription, build_domain_xml
+from Hypervisor_Inventory import DomainListModel, DomainIndex, collect_domains, tag_rows
+
+SIZES = (10, 100, 1000, 10000)
+TEST_NS = "http://libvirt.org/schemas/domain/test"
+SHUTOFF = 5
+RPC_CLASSES = ('virConnect', 'virDomain', 'virNetwork')
+
+
+def domain_xml(i, rng, networks):
+    running = rng.random() < 0.5
+    memory_kib = rng.choice([512, 1024, 2048, 4096]) * 1024
+    return f"""  <domain type='test' xmlns:test='{TEST_NS}'>
+    <name>bench-{i:05d}</name>
+    <uuid>{uuidlib.UUID(int=rng.getrandbits(128))}</uuid>
+    <memory unit='KiB'>{memory_kib}</memory>
+    <currentMemory unit='KiB'>{memory_kib}</currentMemory>
+    <vcpu>{rng.choice([1, 2, 4, 8])}</vcpu>
+    <os><type arch='x86_64'>hvm</type></os>
+    <devices>
+      <disk type='file' device='disk'>
+        <driver name='qemu' type='qcow2'/>
+        <source file='/var/lib/libvirt/images/bench-{i:05d}.qcow2'/>
+        <target dev='vda' bus='virtio'/>
+      </disk>
+      <interface type='network'>
+        <mac address='52:54:00:{i >> 16 & 0xff:02x}:{i >> 8 & 0xff:02x}:{i & 0xff:02x}'/>
+        <source network='{escape(networks[i % len(networks)])}'/>
+        <model type='virtio'/>
+      </interface>
+      <graphics type='vnc' port='{5900 + i % 1000}' autoport='no'/>
+    </devices>
+    {'' if running else f'<test:runstate>{SHUTOFF}</test:runstate>'}
+  </domain>
+"""
+
+
+def network_xml(i, name):
+    return f"""  <network>
+    <name>{escape(name)}</name>
+    <bridge name='vbr{i}'/>
+    <forward mode='nat'/>
+    <ip address='10.{i // 256 % 256}.{i % 256}.1' netmask='255.255.255.0'/>
+  </network>
+"""
+
+
+def write_node_xml(path, domains, networks, seed=0):
+    rng = random.Random(seed)
+    names = [f"bench-net-{i}" for i in range(networks)]
+    with open(path, 'w') as f:
+        f.write("<node>\n")
+        for i, name in enumerate(names):
+            f.write(network_xml(i, name))
+        for i in range(domains):
+            f.write(domain_xml(i, rng, names))
+        f.write("</node>\n")
+
+
+class RpcCounter:
+    def __init__(self):
+        self.calls = Counter()
+        self._originals = []
+
+    def _wrap(self, cls_name, name, method):
+        calls = self.calls
+        label = f"{cls_name}.{name}"
+
+        def counted(*args, **kwargs):
+            calls[label] += 1
+            return method(*args, **kwargs)
+        return counted
+
+    def install(self):
+        for cls_name in RPC_CLASSES:
+            cls = getattr(libvirt, cls_name)
+            for name, method in list(vars(cls).items()):
+                if name.startswith('_') or not callable(method):
+                    continue
+                self._originals.append((cls, name, method))
+                setattr(cls, name, self._wrap(cls_name, name, method))
+
+    def uninstall(self):
+        for cls, name, method in self._originals:
+            setattr(cls, name, method)
+        self._originals = []
+
+    def total(self):
+        return sum(self.calls.values())
+
+
+class Recorder:
+    def __init__(self, counter):
+        self.counter = counter
+        self.samples = {}
+        self.rpcs = {}
+
+    def measure(self, label, func, iterations=1):
+        samples = self.samples.setdefault(label, [])
+        rpcs = self.rpcs.setdefault(label, [])
+        result = None
+        for _ in range(iterations):
+            before = self.counter.total()
+            started = time.perf_counter()
+            result = func()
+            samples.append((time.perf_counter() - started) * 1000)
+            rpcs.append(self.counter.total() - before)
+        return result
+
+    def summary(self):
+        report = {}
+        for label, samples in self.samples.items():
+            values = np.array(samples)
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            report[label] = {
+                'samples': len(samples),
+                'p50_ms': round(float(p50), 3),
+                'p95_ms': round(float(p95), 3),
+                'p99_ms': round(float(p99), 3),
+                'mean_ms': round(float(values.mean()), 3),
+                'rpcs': round(float(np.mean(self.rpcs[label])), 1),
+            }
+        return report
+
+
+def open_display():
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+    except Exception as e:
+        print(f"No display, timing the headless list model only: {e}")
+        return None
+    root.geometry("1000x700")
+    return root
+
+
+def bench_list(recorder, rows, root, iterations):
+    def populate():
+        model = DomainListModel()
+        index = DomainIndex(model)
+        index.apply(model.diff(rows))
+        return model, index
+    model, index = recorder.measure("list model populate", populate, iterations)
+    if root is None:
+        return
+    import tkinter as tk
+    from Hypervisor_Widgets import VirtualTreeview
+    values = lambda key: tuple(model.rows[key][field] for field in model.fields)
+    view = VirtualTreeview(root, model.fields, values)
+    view.pack(fill=tk.BOTH, expand=True)
+    root.update()
+
+    def draw():
+        view.set_keys(index.view)
+        root.update_idletasks()
+    recorder.measure("treeview populate", draw, iterations)
+    view.destroy()
+
+
+def manager_collect(manager):
+    with manager.lease() as conn:
+        return collect_domains(conn)
+
+
+def bench_size(size, args, workdir, counter, root):
+    path = os.path.join(workdir, f"node-{size}.xml")
+    networks = max(1, size // args.domains_per_network)
+    write_node_xml(path, size, networks, args.seed)
+    recorder = Recorder(counter)
+    manager = recorder.measure("connect", lambda: ConnectionManager(f"test://{path}", max_retries=1))
+    try:
+        with manager.lease():
+            pass
+        rng = random.Random(args.seed)
+        rows = recorder.measure("enumerate domains", lambda: tag_rows(
+            manager_collect(manager), manager.uri, manager.hostname), args.iterations)
+        recorder.measure("list networks", lambda: list_networks(manager), args.iterations)
+        sample = rng.sample(rows, min(len(rows), args.lookups))
+
+        def details(row):
+            with manager.lease() as conn:
+                dom = conn.lookupByUUIDString(row['uuid'])
+                return dom.XMLDesc(0)
+        xml_descs = [recorder.measure("details lookup", lambda row=row: details(row)) for row in sample]
+
+        def parse(xml_desc):
+            description = DomainDescription(xml_desc)
+            return description.name, description.vcpus, description.disks, description.interfaces, \
+                description.graphics_port('vnc')
+        for xml_desc in xml_descs:
+            recorder.measure("xml parse", lambda xml_desc=xml_desc: parse(xml_desc))
+        stopped = [row for row in rows if not row['active']][:args.batch]
+        if stopped:
+            for label, action in (("start", start_domain), ("shutdown", shutdown_domain)):
+                recorder.measure(f"batch {label}", lambda label=label, action=action: [
+                    recorder.measure(f"{label} domain", lambda row=row: action(manager, row['uuid']))
+                    for row in stopped])
+        for i in range(args.lookups):
+            recorder.measure("domain xml generation", lambda i=i: build_domain_xml(
+                f"bench-new-{i}", 2048, 2, f"/var/lib/libvirt/images/bench-new-{i}.qcow2", "default",
+                cdroms=["/isos/install.iso", "/isos/virtio-win.iso"]))
+        bench_list(recorder, rows, root, args.iterations)
+    finally:
+        manager.close()
+    return {'domains': size, 'networks': networks, 'results': recorder.summary()}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(report, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    old = {run['domains']: run['results'] for run in baseline['runs']}
+    print(f"\nCompared with {baseline.get('commit') or baseline_path}:")
+    for run in report['runs']:
+        for label, result in run['results'].items():
+            before = old.get(run['domains'], {}).get(label)
+            if not before or not before['p95_ms']:
+                continue
+            ratio = result['p95_ms'] / before['p95_ms']
+            flag = "  REGRESSION" if ratio > 1.2 else ""
+            print(f"{run['domains']:>6} {label:<24} p95 {before['p95_ms']:9.2f} -> {result['p95_ms']:9.2f} ms "
+                  f"({ratio:4.2f}x){flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the manager against libvirt's test driver")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES))
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--lookups', type=int, default=200)
+    parser.add_argument('--batch', type=int, default=50)
+    parser.add_argument('--domains-per-network', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--headless', action='store_true', help="Skip the Treeview even if a display is available")
+    parser.add_argument('--output', default=f"bench-test-driver-{git_commit() or 'local'}.json")
+    parser.add_argument('--compare', metavar='BASELINE', help="Earlier JSON report to compare p95 latencies with")
+    args = parser.parse_args()
+    counter = RpcCounter()
+    counter.install()
+    root = None if args.headless else open_display()
+    report = {
+        'commit': git_commit(),
+        'created': time.time(),
+        'python': platform.python_version(),
+        'libvirt': libvirt.getVersion(),
+        'runs': [],
+    }
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for size in args.sizes:
+                run = bench_size(size, args, workdir, counter, root)
+                report['runs'].append(run)
+                print(f"\n{size} domains, {run['networks']} networks")
+                print(f"{'':<24}{'p50':>10}{'p95':>10}{'p99':>10}{'rpcs':>8}")
+                for label, result in run['results'].items():
+                    print(f"{label:<24}{result['p50_ms']:10.2f}{result['p95_ms']:10.2f}"
+                          f"{result['p99_ms']:10.2f}{result['rpcs']:8.1f}")
+    finally:
+        counter.uninstall()
+        if root is not None:
+            root.destroy()
+    report['rpc_calls'] = dict(counter.calls.most_common())
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.output}")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Hypervisor_Inventory import DomainListModel, DomainIndex, STATE_NAMES
+
+BUDGET_MS = 50.0
+
+
+def synthetic_rows(count, hosts=8, seed=0):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        host = f"host{i % hosts:02d}"
+        uri = f"qemu+ssh://{host}/system"
+        uuid = f"00000000-0000-0000-0000-{i:012d}"
+        state = rng.choice(list(STATE_NAMES))
+        active = state in (1, 2, 3)
+        rows.append({
+            'key': f"{uri}#{uuid}",
+            'uri': uri,
+            'host': host,
+            'uuid': uuid,
+            'name': f"vm-{rng.choice(['web', 'db', 'cache', 'ci', 'build'])}-{i:05d}",
+            'status': STATE_NAMES[state],
+            'active': active,
+            'id': i + 1 if active else None,
+            'memory': rng.choice([512, 1024, 2048, 4096, 8192]),
+            'vcpu': rng.choice([1, 2, 4, 8]),
+            'disk': [round(rng.uniform(1, 40), 1), 40],
+            'autostart': rng.random() < 0.3,
+        })
+    return rows
+
+
+def timed(label, func, results):
+    started = time.perf_counter()
+    func()
+    elapsed = (time.perf_counter() - started) * 1000
+    results.append((label, elapsed))
+    return elapsed
+
+
+def bench_index(count, results):
+    model = DomainListModel()
+    rows = synthetic_rows(count)
+    index = DomainIndex(model)
+    timed("initial diff + index", lambda: index.apply(model.diff(rows)), results)
+    for column in ('status', 'memory', 'vcpu', 'autostart', 'host', 'name'):
+        timed(f"sort by {column}", lambda column=column: index.set_sort(column), results)
+    timed("sort reverse", lambda: index.set_sort('name', True), results)
+    index.set_sort('name')
+    for pattern in ('w', 'we', 'web', 'web-0', 'web-00'):
+        timed(f"filter '{pattern}'", lambda pattern=pattern: index.set_filter(pattern), results)
+    timed("filter clear", lambda: index.set_filter(""), results)
+    timed("filter regex", lambda: index.set_filter(r"^vm-(db|ci)-\d+3$", regex=True), results)
+    index.set_filter("")
+    changed = [dict(row, status='shut off', memory=row['memory'] * 2) for row in rows[:100]] + rows[100:]
+    timed("patch 100 changed rows", lambda: index.apply(model.diff(changed)), results)
+    return model, index
+
+
+def bench_widget(model, index, results):
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+    except Exception as e:
+        print(f"Skipping widget benchmark: {e}")
+        return
+    from Hypervisor_Widgets import VirtualTreeview
+    root.geometry("1000x700")
+    values = lambda key: tuple(model.rows[key][field] for field in model.fields)
+    view = VirtualTreeview(root, model.fields, values)
+    view.pack(fill=tk.BOTH, expand=True)
+    root.update()
+    timed("widget set_keys", lambda: view.set_keys(index.view), results)
+    root.update()
+    timed("widget scroll page", lambda: view.yview('scroll', 1, 'pages'), results)
+    timed("widget scroll to middle", lambda: view.yview('moveto', 0.5), results)
+    timed("widget scroll to end", lambda: view.yview('moveto', 1.0), results)
+    index.set_sort('memory', True)
+    timed("widget resort", lambda: view.set_keys(index.view), results)
+    root.destroy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VM list index and widget benchmark")
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--budget', type=float, default=BUDGET_MS)
+    args = parser.parse_args()
+    results = []
+    model, index = bench_index(args.rows, results)
+    bench_widget(model, index, results)
+    over = 0
+    for label, elapsed in results:
+        flag = "" if elapsed <= args.budget or label.startswith("initial") else "  OVER BUDGET"
+        over += bool(flag)
+        print(f"{label:<28}{elapsed:9.2f} ms{flag}")
+    sys.exit(1 if over else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import uuid
+from contextlib import contextmanager
+
+import pytest
+
+libvirt = pytest.importorskip("libvirt")
+pytest.importorskip("slugify")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Hypervisor_Controller as controller
+from Hypervisor_Placement import Placement
+
+START_TIMEOUT = 5
+EVENT_TIMEOUT = 10
+
+
+class FakeDomain:
+    def __init__(self, host, xml_config):
+        self.host = host
+        self.uuid = str(uuid.uuid4())
+        self.xml_config = xml_config
+
+    def UUIDString(self):
+        return self.uuid
+
+    def create(self):
+        self.host.barrier.wait(START_TIMEOUT)
+
+    def undefine(self):
+        self.host.domains.pop(self.uuid)
+
+
+class FakeHost:
+    uri = "test:///overlap"
+
+    def __init__(self, starts):
+        self.barrier = threading.Barrier(starts)
+        self.domains = {}
+
+    def defineXML(self, xml_config):
+        dom = FakeDomain(self, xml_config)
+        self.domains[dom.uuid] = dom
+        return dom
+
+    def lookupByUUIDString(self, uuid):
+        return self.domains[uuid]
+
+    @contextmanager
+    def lease(self):
+        yield self
+
+
+def start_concurrently(host, count, slots, placement=None):
+    errors = []
+
+    def provision(i):
+        try:
+            with slots:
+                controller.define_and_start(host, f"vm-{i}", "<domain/>", 1, 128, placement, strict=True)
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=provision, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def test_starts_overlap_with_two_slots():
+    host = FakeHost(2)
+    assert start_concurrently(host, 4, threading.BoundedSemaphore(2)) == []
+    assert len(host.domains) == 4
+
+
+def test_placed_starts_overlap_and_see_pending(monkeypatch):
+    seen = []
+
+    def plan_vm(manager, vcpus, memory_mb, placement, pending=()):
+        seen.append(len(pending))
+        return Placement([(0, vcpus, memory_mb * 1024)], [0] * vcpus, [0], 'strict', False)
+    monkeypatch.setattr(controller, 'plan_vm', plan_vm)
+    monkeypatch.setattr(controller, 'apply_placement', lambda xml_config, plan: xml_config)
+    host = FakeHost(2)
+    assert start_concurrently(host, 2, threading.BoundedSemaphore(2), {'numa': True}) == []
+    assert sorted(seen) == [0, 1]
+    assert controller.PENDING_STARTS[host.uri] == {}
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def with_controller(func):
+    async with controller.HypervisorController("test:///default") as headless:
+        return await func(headless)
+
+
+def test_domains_lists_test_driver():
+    rows, errors = run(with_controller(lambda headless: headless.domains()))
+    assert errors == {}
+    assert {row['name']: row['status'] for row in rows}['test'] == "Running"
+
+
+def test_shutdown_and_start():
+    async def cycle(headless):
+        shutdown = await headless.shutdown("test")
+        stopped, _ = await headless.domains()
+        started = await headless.start("test")
+        running, _ = await headless.domains()
+        return shutdown, stopped, started, running
+
+    shutdown, stopped, started, running = run(with_controller(cycle))
+    assert shutdown == "Shutting down"
+    assert {row['name']: row['status'] for row in stopped}['test'] == "Stopped"
+    assert started == "Started"
+    assert {row['name']: row['status'] for row in running}['test'] == "Running"
+
+
+def test_events_report_lifecycle():
+    async def watch(headless):
+        events = headless.events()
+        seen = []
+        try:
+            seen.append(await asyncio.wait_for(events.__anext__(), EVENT_TIMEOUT))
+            await headless.shutdown("test")
+            await headless.start("test")
+            while len([event for event in seen if event.kind == 'lifecycle']) < 2:
+                seen.append(await asyncio.wait_for(events.__anext__(), EVENT_TIMEOUT))
+        finally:
+            await events.aclose()
+        return seen
+
+    seen = run(with_controller(watch))
+    assert seen[0].kind == 'connected'
+    assert [event.name for event in seen if event.kind == 'lifecycle'] == ["test", "test"]
+
+
+def test_cli_list_prints_json(capsys):
+    assert controller.main(["--uri", "test:///default", "list"]) == 0
+    output = json.loads(capsys.readouterr().out)
+    assert output['errors'] == {}
+    assert "test" in {row['name'] for row in output['domains']}
+
+
+def test_cli_reports_errors_as_json(capsys):
+    assert controller.main(["--uri", "test:///default", "start", "no-such-vm"]) == 1
+    assert 'error' in json.loads(capsys.readouterr().out)
@@ -0,0 +1,95 @@
+import os
+import sys
+from collections import Counter
+
+import pytest
+
+libvirt = pytest.importorskip("libvirt")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Hypervisor_Inventory import collect_domains
+
+RPC_CLASSES = ('virConnect', 'virDomain')
+LOCAL_ACCESSORS = ('name', 'ID', 'UUID', 'UUIDString', 'connect')
+
+
+def domain_xml(name):
+    return f"""<domain type='test'>
+  <name>{name}</name>
+  <memory unit='KiB'>131072</memory>
+  <vcpu>1</vcpu>
+  <os><type arch='x86_64'>hvm</type></os>
+</domain>"""
+
+
+@pytest.fixture
+def rpcs(monkeypatch):
+    calls = Counter()
+    for cls_name in RPC_CLASSES:
+        cls = getattr(libvirt, cls_name)
+        for name, method in list(vars(cls).items()):
+            if name.startswith('_') or name in LOCAL_ACCESSORS or not callable(method):
+                continue
+            def counted(*args, label=f"{cls_name}.{name}", method=method, **kwargs):
+                calls[label] += 1
+                return method(*args, **kwargs)
+            monkeypatch.setattr(cls, name, counted)
+    return calls
+
+
+@pytest.fixture
+def conn():
+    conn = libvirt.open("test:///default")
+    defined = []
+
+    def grow(count):
+        while len(defined) < count:
+            defined.append(conn.defineXML(domain_xml(f"inventory-{len(defined):03d}")))
+    conn.grow = grow
+    yield conn
+    for dom in defined:
+        dom.undefine()
+    conn.close()
+
+
+def count_rpcs(conn, calls):
+    calls.clear()
+    rows = collect_domains(conn)
+    return rows, sum(calls.values())
+
+
+def test_bulk_collection_uses_constant_rpcs(conn, rpcs):
+    conn.grow(5)
+    small_rows, small = count_rpcs(conn, rpcs)
+    conn.grow(50)
+    large_rows, large = count_rpcs(conn, rpcs)
+    assert len(large_rows) == len(small_rows) + 45
+    assert small == large
+    assert rpcs['virConnect.getAllDomainStats'] == 1
+    assert 'virDomain.info' not in rpcs
+
+
+def test_rows_match_domains(conn, rpcs):
+    conn.grow(3)
+    rows = {row['name']: row for row in collect_domains(conn)}
+    assert rows['test']['status'] == "Running"
+    assert rows['inventory-000']['status'] == "Stopped"
+    assert rows['inventory-000']['memory'] == 128
+    assert rows['inventory-000']['vcpu'] == 1
+
+
+def test_falls_back_without_bulk_stats(conn, rpcs, monkeypatch):
+    conn.grow(3)
+    bulk_names = {row['name'] for row in collect_domains(conn)}
+
+    def unsupported(*args, **kwargs):
+        error = libvirt.libvirtError("getAllDomainStats not supported")
+        error.err = (libvirt.VIR_ERR_NO_SUPPORT, 0, "not supported", 2, None, None, None, 0, 0)
+        raise error
+    monkeypatch.setattr(libvirt.virConnect, 'getAllDomainStats', unsupported)
+    rpcs.clear()
+    rows = collect_domains(conn)
+    assert {row['name'] for row in rows} == bulk_names
+    assert rpcs['virConnect.listAllDomains'] >= 1
+    assert all(row['memory'] for row in rows)
@@ -0,0 +1,220 @@
+import os
+import sys
+import threading
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+
+import pytest
+
+libvirt = pytest.importorskip("libvirt")
+pytest.importorskip("slugify")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Hypervisor_Manifest import DEFAULTS, ManifestError, expand_specs, provision, validate_manifest
+from Hypervisor_Templates import TemplateCatalog
+
+START_TIMEOUT = 5
+GIB = 1024 ** 3
+
+
+def libvirt_error(code, message):
+    error = libvirt.libvirtError(message)
+    error.err = (code, 0, message, 2, None, None, None, 0, 0)
+    return error
+
+
+class Peak:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+
+    @contextmanager
+    def track(self):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class FakeVolume:
+    def __init__(self, host, path):
+        self.host = host
+        self._path = path
+
+    def path(self):
+        return self._path
+
+    def delete(self, flags):
+        self.host.volumes.remove(self._path)
+
+
+class FakePool:
+    def __init__(self, host):
+        self.host = host
+
+    def isActive(self):
+        return True
+
+    def info(self):
+        return [1, 100 * GIB, 0, 100 * GIB]
+
+    def listVolumes(self):
+        return [os.path.basename(path) for path in self.host.volumes]
+
+    def storageVolLookupByName(self, name):
+        raise libvirt_error(libvirt.VIR_ERR_NO_STORAGE_VOL, f"no volume {name}")
+
+    def createXML(self, xml, flags):
+        with self.host.disks.track():
+            threading.Event().wait(0.05)
+            path = f"/pool/{ET.fromstring(xml).findtext('name')}"
+            self.host.volumes.add(path)
+            return FakeVolume(self.host, path)
+
+
+class FakeDomain:
+    def __init__(self, host, xml):
+        self.host = host
+        self.xml = xml
+        self._name = ET.fromstring(xml).findtext('name')
+        self.active = False
+
+    def name(self):
+        return self._name
+
+    def UUIDString(self):
+        return f"uuid-{self._name}"
+
+    def XMLDesc(self, flags=0):
+        return self.xml
+
+    def isActive(self):
+        return self.active
+
+    def info(self):
+        return [1, 2097152, 2097152, 2, 0]
+
+    def create(self):
+        with self.host.starts.track():
+            self.host.barrier.wait(START_TIMEOUT)
+            if self._name in self.host.fail_once:
+                self.host.fail_once.discard(self._name)
+                raise libvirt_error(libvirt.VIR_ERR_INTERNAL_ERROR, f"{self._name} failed to boot")
+            self.active = True
+
+    def undefine(self):
+        del self.host.domains[self._name]
+
+
+class FakeNetwork:
+    def isActive(self):
+        return True
+
+
+class FakeHost:
+    uri = "test:///manifest"
+
+    def __init__(self, start_slots, fail_once=()):
+        self.barrier = threading.Barrier(start_slots)
+        self.fail_once = set(fail_once)
+        self.disks = Peak()
+        self.starts = Peak()
+        self.volumes = set()
+        self.domains = {}
+
+    @contextmanager
+    def lease(self):
+        yield self
+
+    def getURI(self):
+        return self.uri
+
+    def getInfo(self):
+        return ['x86_64', 65536, 16, 2000, 1, 1, 16, 1]
+
+    def getCapabilities(self):
+        return "<capabilities><host/></capabilities>"
+
+    def getCellsFreeMemory(self, start, count):
+        return [64 * GIB]
+
+    def getFreePages(self, pages, start, count):
+        return {}
+
+    def listNetworks(self):
+        return ['default']
+
+    def listDefinedNetworks(self):
+        return []
+
+    def networkLookupByName(self, name):
+        return FakeNetwork()
+
+    def listAllDomains(self, flags=0):
+        domains = list(self.domains.values())
+        if flags == libvirt.VIR_CONNECT_LIST_DOMAINS_ACTIVE:
+            domains = [dom for dom in domains if dom.active]
+        return domains
+
+    def defineXML(self, xml):
+        dom = FakeDomain(self, xml)
+        self.domains[dom.name()] = dom
+        return dom
+
+    def lookupByUUIDString(self, uuid):
+        return next(dom for dom in self.domains.values() if dom.UUIDString() == uuid)
+
+    def storagePoolLookupByName(self, name):
+        return FakePool(self)
+
+    def storageVolLookupByPath(self, path):
+        return FakeVolume(self, path)
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    iso = tmp_path / "install.iso"
+    iso.write_bytes(b"")
+    return {'path': str(tmp_path / "fleet.json"), 'on_existing': "skip", 'pool': "default",
+            'disk_concurrency': 1, 'start_concurrency': 2,
+            'vms': expand_specs([{'name': "web", 'count': 4, 'iso': str(iso)}], DEFAULTS)}
+
+
+def run(host, manifest, tmp_path):
+    catalog = TemplateCatalog(str(tmp_path / "templates.json"))
+    plans = validate_manifest(host, manifest, catalog)
+    return provision(host, manifest, plans, catalog)
+
+
+def test_provision_respects_slots_and_rolls_back(manifest, tmp_path):
+    host = FakeHost(2, fail_once={"web-03"})
+    report = run(host, manifest, tmp_path)
+    assert host.starts.peak == manifest['start_concurrency']
+    assert host.disks.peak == manifest['disk_concurrency']
+    assert report['summary'] == {'created': 3, 'failed': 1}
+    results = {result['name']: result for result in report['vms']}
+    assert "web-03 failed to boot" in results["web-03"]['error']
+    assert set(results["web-03"]['steps']) == {'disk', 'xml', 'define_start', 'rollback'}
+    assert set(results["web-01"]['steps']) == {'disk', 'xml', 'define_start'}
+    assert sorted(host.domains) == ["web-01", "web-02", "web-04"]
+    assert sorted(host.volumes) == ["/pool/web-01.qcow2", "/pool/web-02.qcow2", "/pool/web-04.qcow2"]
+
+
+def test_second_run_skips_existing(manifest, tmp_path):
+    host = FakeHost(1, fail_once={"web-03"})
+    run(host, manifest, tmp_path)
+    report = run(host, manifest, tmp_path)
+    assert report['summary'] == {'skipped': 3, 'created': 1}
+    assert {result['name']: result['action'] for result in report['vms']}["web-01"] == "skip"
+    assert len(host.domains) == 4
+
+
+def test_count_requires_name():
+    with pytest.raises(ManifestError, match="count needs a name"):
+        expand_specs([{'count': 3, 'iso': "/tmp/install.iso"}], {})
@@ -0,0 +1,88 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("libvirt")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Hypervisor_Placement import (HUGEPAGE_KIB, NUMA_FIT, PACK, SPREAD, HostCapacity, HostCell, HostState,
+                                  PlacementError, choose_host, host_state)
+
+
+def capacity(name, cells_free_mb, busy=0.2, domains=0, vcpus=0, allocated_mb=0, networks=('default',),
+             cpus_per_cell=4, memory_mb=16384):
+    cells = [HostCell(i, list(range(i * cpus_per_cell, (i + 1) * cpus_per_cell)),
+                      memory_mb * 1024 // len(cells_free_mb), free_mb * 1024, 0)
+             for i, free_mb in enumerate(cells_free_mb)]
+    state = HostState(cells, memory_mb * 1024)
+    state.allocated_vcpus = vcpus
+    state.allocated_memory_kib = allocated_mb * 1024
+    return HostCapacity(f"qemu+ssh://{name}/system", name, state, sum(cells_free_mb) * 1024, busy, None, domains,
+                        list(networks))
+
+
+class SparseHost:
+    free_mb = {0: 1000, 2: 3000}
+
+    def getInfo(self):
+        return ['x86_64', 8192, 8, 2000, 2, 1, 4, 1]
+
+    def getCapabilities(self):
+        cells = "".join(f'<cell id="{i}"><memory unit="KiB">4194304</memory><cpus num="4">'
+                        + "".join(f'<cpu id="{i * 4 + cpu}"/>' for cpu in range(4)) + "</cpus></cell>"
+                        for i in self.free_mb)
+        return f'<capabilities><host><topology><cells num="2">{cells}</cells></topology></host></capabilities>'
+
+    def getCellsFreeMemory(self, start, count):
+        return [self.free_mb[cell] * 1024 * 1024 for cell in range(start, start + count)]
+
+    def getFreePages(self, pages, start, count):
+        return {cell: {HUGEPAGE_KIB: cell + 1} for cell in range(start, start + count)}
+
+    def listAllDomains(self, flags):
+        return []
+
+
+def fleet():
+    return [capacity("idle", [15000, 15000], busy=0.1, domains=1),
+            capacity("busy", [3000, 3000], busy=0.7, domains=8, vcpus=12, allocated_mb=10000)]
+
+
+def test_spread_prefers_headroom():
+    decision = choose_host(fleet(), 2, 2048, strategy=SPREAD)
+    assert decision.host == "idle"
+    assert [host for host, _, _ in decision.candidates] == ["idle", "busy"]
+
+
+def test_pack_fills_busiest_host():
+    assert choose_host(fleet(), 2, 2048, strategy=PACK).host == "busy"
+
+
+def test_numa_fit_prefers_single_node():
+    hosts = [capacity("split", [3072, 3072], busy=0.1), capacity("fits", [5120, 512], busy=0.5)]
+    assert choose_host(hosts, 2, 4096, strategy=SPREAD).host == "split"
+    decision = choose_host(hosts, 2, 4096, strategy=NUMA_FIT)
+    assert decision.host == "fits"
+    assert decision.reason.startswith("fits NUMA node 0")
+
+
+def test_rejects_host_without_network():
+    hosts = fleet() + [capacity("lab", [15000, 15000], busy=0.0, networks=('default', 'lab'))]
+    decision = choose_host(hosts, 2, 2048, network='lab')
+    assert decision.host == "lab"
+    assert decision.rejected == {"idle": "network 'lab' is not defined", "busy": "network 'lab' is not defined"}
+
+
+def test_rejects_overcommit():
+    decision = choose_host(fleet(), 2, 8192, settings={'memory_ratio': 1.0})
+    assert decision.host == "idle"
+    assert decision.rejected["busy"].startswith("Not enough memory")
+    with pytest.raises(PlacementError, match="busy: Not enough memory"):
+        choose_host(fleet()[1:], 2, 8192, settings={'memory_ratio': 1.0})
+
+
+def test_host_state_maps_sparse_cells():
+    cells = host_state(SparseHost()).cells
+    assert [(cell.id, cell.free_kib // 1024, cell.free_hugepages) for cell in cells] == [(0, 1000, 1), (2, 3000, 3)]